@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf8  -*-
+
+r"""Benchmark of parallel extraction of main3.py on a simulated high-latency network share: sequential extraction,
+and by thread pools of several sizes (option --jobs), the number of worker threads being the number of file reads in flight.
+
+Generates a synthetic directory of JPEG and MP4 files, then runs the whole processing pipeline (in dry-run mode)
+with every file open and read delayed by given latency, as a stand-in for a round trip to SMB/NFS server.
+The latency is injected by replacing the open() function used by main3.py; time.sleep() releases the GIL,
+just like waiting for a network file system does.
+
+Usage: python3 bench/bench_engine.py [--files 2000] [--latency 2.0] [--jobs 8,64,256]
+"""
+
+import io
+import sys
+import time
+import shutil
+import pathlib
+import optparse
+import tempfile
+import datetime
+import contextlib
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+import main3
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent.joinpath('tests')))
+import media_builders
+
+
+class LatencyFile:
+    ''' File object delaying every read by given latency, like a file on a network share would. '''
+
+    def __init__(self, file, latency):
+        self.file = file
+        self.latency = latency
+
+    def read(self, size=-1):
+        time.sleep(self.latency)
+        return self.file.read(size)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.file.close()
+
+
+def make_latency_open(latency):
+    def latency_open(*args, **kwargs):
+        time.sleep(latency)
+        return LatencyFile(open(*args, **kwargs), latency)
+    return latency_open
+
+
+def make_directory(root_path, file_count):
+    date_time = datetime.datetime(2019, 6, 1, 12, 0, 0)
+    for index in range(file_count):
+        file_date_time = date_time + datetime.timedelta(seconds=index)
+        if index % 4:
+            root_path.joinpath('IMG_%05d.JPG' % index).write_bytes(media_builders.make_jpeg(file_date_time.strftime('%Y:%m:%d %H:%M:%S')))
+        else:
+            media_builders.make_mov(root_path.joinpath('MOV_%05d.MP4' % index), 4 * main3.HEADER_SIZE, 'moov-first', file_date_time)
+
+
+def run_jobs(root_path, jobs):
+    ''' Runs main3.py in dry-run mode with given number of worker threads; returns time taken and the final summary line. '''
+    output = io.StringIO()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        main3.main(['main3.py', '--path', str(root_path), '--dry-run', '--no-cache', '--jobs', str(jobs)])
+    seconds = time.perf_counter() - started
+    return seconds, output.getvalue().splitlines()[-1]
+
+
+def main(argv=None):
+    parser = optparse.OptionParser()
+    parser.add_option('', '--files', action='store', type='int', default=2000, dest='files', help='number of files in synthetic directory; default is 2000')
+    parser.add_option('', '--latency', action='store', type='float', default=2.0, dest='latency', help='latency of every file open and read, in milliseconds; default is 2.0')
+    parser.add_option('', '--jobs', action='store', default='8,64,256', dest='jobs', help='comma separated numbers of worker threads; default is 8,64,256')
+    (options, _) = parser.parse_args(argv)
+
+    root_path = pathlib.Path(tempfile.mkdtemp(prefix='bench_engine_'))
+    try:
+        make_directory(root_path, options.files)
+        main3.open = make_latency_open(options.latency / 1000)
+
+        runs = [('sequential', 1)] + [('threads (jobs: %s)' % jobs, int(jobs)) for jobs in options.jobs.split(',')]
+        for (name, jobs) in runs:
+            (seconds, summary) = run_jobs(root_path, jobs)
+            print('%-25s: %7.3f s, %8.1f files/s  [%s]' % (name, seconds, options.files / seconds, summary))
+    finally:
+        del main3.open
+        shutil.rmtree(root_path)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf8  -*-
+
+r"""Micro-benchmark comparing the native EXIF DateTimeOriginal parser of main3.py with exifread.
+
+Runs both parsers on the header of each JPEG file in given directory (or on synthetic JPEG files,
+if no directory is given), verifies they agree, and reports average time per file.
+
+Usage: python3 bench/bench_exif.py [--path DIRECTORY] [--repeat N]
+"""
+
+import io
+import sys
+import pathlib
+import optparse
+import timeit
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent.joinpath('tests')))
+import main3
+import exifread
+from media_builders import make_jpeg
+
+
+def synthetic_headers():
+    headers = []
+    for i in range(100):
+        date_time = '2019:06:%02d 12:%02d:%02d' % (1 + i % 28, i % 60, (i * 7) % 60)
+        jpeg = make_jpeg(date_time, byte_order='<' if i % 2 else '>', jfif=i % 3 == 0, thumbnail_size=8192 if i % 4 == 0 else 0)
+        headers.append(('synthetic-%03d.jpg' % i, jpeg[:main3.HEADER_SIZE]))
+    return headers
+
+
+def read_with_exifread(header):
+    exif_tags = exifread.process_file(io.BytesIO(header), details=False, stop_tag='DateTimeOriginal')
+    return str(exif_tags['EXIF DateTimeOriginal']) if 'EXIF DateTimeOriginal' in exif_tags else None
+
+
+def read_with_native(header):
+    try:
+        return main3.read_exif_date_time_original(header)
+    except RuntimeError:
+        return read_with_exifread(header)
+
+
+def main(argv=None):
+    parser = optparse.OptionParser()
+    parser.add_option('-p', '--path', action='store', default=None, dest='path', help='directory with sample JPEG files; default is to use synthetic files')
+    parser.add_option('-n', '--repeat', action='store', type='int', default=20, dest='repeat', help='number of passes over all files; default is 20')
+    (options, _) = parser.parse_args(argv)
+
+    if options.path is None:
+        headers = synthetic_headers()
+    else:
+        headers = []
+        for file_path in sorted(pathlib.Path(options.path).iterdir()):
+            if file_path.suffix.lower() in ('.jpg', '.jpeg') and file_path.is_file():
+                with open(file_path, 'rb') as jpeg_file:
+                    headers.append((file_path.name, jpeg_file.read(main3.HEADER_SIZE)))
+    if not headers:
+        print('ERROR! No JPEG files to benchmark => quitting ...')
+        return 1
+
+    fallback_count = 0
+    for (name, header) in headers:
+        try:
+            main3.read_exif_date_time_original(header)
+        except RuntimeError:
+            fallback_count += 1
+        if read_with_native(header) != read_with_exifread(header):
+            print('ERROR! Parsers disagree on file "%s": native "%s", exifread "%s"' % (name, read_with_native(header), read_with_exifread(header)))
+            return 1
+
+    results = {}
+    for (label, func) in (('exifread', read_with_exifread), ('native', read_with_native)):
+        seconds = timeit.timeit(lambda: [func(header) for (_, header) in headers], number=options.repeat)
+        results[label] = seconds / (options.repeat * len(headers))
+        print('%-8s: %8.2f us per file' % (label, results[label] * 1e6))
+
+    print('Files: %d, native parser fallbacks to exifread: %d, speed-up: %.1fx' % (len(headers), fallback_count, results['exifread'] / results['native']))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
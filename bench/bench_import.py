@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf8  -*-
+
+r"""Regression check of main3.py startup: import time (python -X importtime) and modules imported on the way.
+
+Runs main3.py in fresh interpreters with -X importtime, in several scenarios: just importing it, processing
+a tiny batch of one JPEG and one MP4 file (in dry-run mode), with and without option --skip-image, and renaming
+a fresh copy of such a batch with default options (i.e. with the metadata cache, rename journal and thread pool).
+Reports time taken by imports (best of --repeat runs) and checks that modules meant to be imported on first use
+only (see LAZY_MODULES) do not get imported in these scenarios, except for the ones a scenario needs (see
+DEFAULT_RUN_MODULES). Exits with status 1 on any regression, i.e. a lazy module imported, or import time of main3
+over --max-ms.
+
+Usage: python3 bench/bench_import.py [--repeat 10] [--max-ms 100]
+"""
+
+import sys
+import shutil
+import pathlib
+import optparse
+import datetime
+import tempfile
+import subprocess
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent.joinpath('tests')))
+import media_builders
+
+MAIN3_PATH = pathlib.Path(__file__).resolve().parent.parent.joinpath('main3.py')
+
+## modules not to be imported by any of the scenarios, see top of main3.py
+LAZY_MODULES = ('exifread', 'hashlib', 'sqlite3', 'concurrent.futures', 'random', 'ctypes', 'select', 'signal', 'cProfile', 'xxhash')
+
+## options of a typical run on a tiny drop batch; a single job, so that no thread pool gets started
+RUN_OPTIONS = ['--dry-run', '--no-cache', '--no-journal', '--jobs', '1', '-q']
+
+## lazy modules needed by a run with default options: the metadata cache and the thread pool
+DEFAULT_RUN_MODULES = ('sqlite3', 'concurrent.futures')
+
+
+def run_importtime(args):
+    ''' Runs python -X importtime with given arguments; returns dict of tuples (cumulative import time in microseconds,
+        whether imported at the top level, i.e. not by other modules) by module name.
+    '''
+    process = subprocess.run([sys.executable, '-X', 'importtime'] + args, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, cwd=MAIN3_PATH.parent)
+    modules = {}
+    for line in process.stderr.splitlines():
+        ## import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or line.endswith('imported package'):
+            continue
+        (_, cumulative, name) = line.split('|')
+        modules[name.strip()] = (int(cumulative), len(name) - len(name.lstrip()) == 1)
+    return modules
+
+
+def get_lazy_imports(modules, needed=()):
+    ''' Returns those of LAZY_MODULES imported (along with any of their sub-modules), except for the needed ones. '''
+    return [lazy for lazy in LAZY_MODULES if lazy not in needed and any(name == lazy or name.startswith(lazy + '.') for name in modules)]
+
+
+def make_batch(dir_path):
+    ''' Writes a tiny drop batch of one JPEG and one MP4 file into given directory, created anew. '''
+    shutil.rmtree(dir_path, ignore_errors=True)
+    dir_path.mkdir()
+    date_time = datetime.datetime(2019, 6, 1, 12, 0, 0)
+    dir_path.joinpath('IMG_00001.JPG').write_bytes(media_builders.make_jpeg(date_time.strftime('%Y:%m:%d %H:%M:%S')))
+    media_builders.make_mov(dir_path.joinpath('MOV_00002.MP4'), 4096, 'moov-first', date_time)
+
+
+def main(argv=None):
+    parser = optparse.OptionParser()
+    parser.add_option('', '--repeat', action='store', type='int', default=10, dest='repeat', help='number of runs of each scenario, the best one reported; default is 10')
+    parser.add_option('', '--max-ms', action='store', type='float', default=100.0, dest='max_ms', help='maximum import time of main3, in milliseconds; default is 100')
+    (options, _) = parser.parse_args(argv)
+
+    root_path = pathlib.Path(tempfile.mkdtemp(prefix='bench_import_'))
+    try:
+        batch_path = root_path.joinpath('batch')
+        make_batch(batch_path)
+        ## renamed by each run, so written anew before each one
+        fresh_batch_path = root_path.joinpath('fresh')
+
+        ## tuples (name, arguments, lazy modules needed, whether the batch gets renamed)
+        scenarios = [
+            ('import', ['-c', 'import main3'], (), False),
+            ('run', [str(MAIN3_PATH), '--path', str(batch_path)] + RUN_OPTIONS, (), False),
+            ('run --skip-image', [str(MAIN3_PATH), '--path', str(batch_path), '--skip-image'] + RUN_OPTIONS, (), False),
+            ('run defaults', [str(MAIN3_PATH), '--path', str(fresh_batch_path), '-q'], DEFAULT_RUN_MODULES, True),
+        ]
+        failed = False
+        for (name, args, needed, renaming) in scenarios:
+            best = None
+            for _ in range(options.repeat):
+                if renaming is True:
+                    make_batch(fresh_batch_path)
+                modules = run_importtime(args)
+                ## imports of the script itself (run as __main__) are not reported as of any module, but top level ones
+                micros = modules['main3'][0] if 'main3' in modules else sum(cumulative for (cumulative, top) in modules.values() if top)
+                best = micros if best is None else min(best, micros)
+
+            lazy_imports = get_lazy_imports(modules, needed)
+            print('%-18s: %8.1f ms, %4d modules imported%s' % (name, best / 1000, len(modules), ', LAZY MODULES IMPORTED: ' + ', '.join(lazy_imports) if lazy_imports else ''))
+            if lazy_imports or (name == 'import' and best / 1000 > options.max_ms):
+                failed = True
+    finally:
+        shutil.rmtree(root_path)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf8  -*-
+
+r"""Benchmark of MOV/MP4 creation date-time extraction from large files, using the memory-mapped atom walker
+of main3.py.
+
+Generates sparse MP4 files of given sizes (a 64-bit sized "mdat" atom holding no actual data, so that they
+take next to no disk space), with "moov" atom either in front of or behind the media data and version 1
+(64-bit) "mvhd" atom, then reports time and page faults per extraction. Both are expected to stay flat
+regardless of the file size, as only atom headers and "mvhd" atom get touched; "moov" atom behind the media data
+is expected to be found by a single read of the file tail.
+
+Usage: python3 bench/bench_mov.py [--sizes 1,4,16] [--repeat 1000]
+"""
+
+import sys
+import time
+import shutil
+import pathlib
+import optparse
+import tempfile
+import datetime
+
+try:
+    import resource  # Unix only
+except ImportError:
+    resource = None
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent.joinpath('tests')))
+import main3
+from media_builders import LAYOUTS, make_mov
+
+GIB = 1 << 30
+
+
+def run_extraction(file_path, repeat):
+    ''' Returns extracted date-time string (or error), strategy of finding "moov" atom, time per extraction (in microseconds) and page faults per extraction. '''
+    faults = resource.getrusage(resource.RUSAGE_SELF).ru_minflt if resource else 0
+    started = time.perf_counter()
+    for _ in range(repeat):
+        (date_time_str, error, strategy, _) = main3.extract_date_time_str(file_path, 'video')
+    seconds = time.perf_counter() - started
+    faults = (resource.getrusage(resource.RUSAGE_SELF).ru_minflt - faults) if resource else float('nan')
+    return date_time_str or error, strategy, seconds * 1e6 / repeat, faults / repeat
+
+
+def main(argv=None):
+    parser = optparse.OptionParser()
+    parser.add_option('', '--sizes', action='store', default='1,4,16', dest='sizes', help='comma separated sizes of synthetic files, in GiB; default is 1,4,16')
+    parser.add_option('', '--repeat', action='store', type='int', default=1000, dest='repeat', help='number of extractions per file; default is 1000')
+    (options, _) = parser.parse_args(argv)
+
+    date_time = datetime.datetime(2019, 6, 1, 12, 0, 0)
+    root_path = pathlib.Path(tempfile.mkdtemp(prefix='bench_mov_'))
+    try:
+        for size in options.sizes.split(','):
+            for layout in LAYOUTS:
+                file_path = root_path.joinpath('MOV_%s_%s.mp4' % (size, layout))
+                make_mov(file_path, int(float(size) * GIB), layout, date_time)
+                (result, strategy, micros, faults) = run_extraction(file_path, options.repeat)
+                print('%6s GiB, %-10s: %s (%s), %.1f us, %.1f page faults per file' % (size, layout, result, strategy, micros, faults))
+                file_path.unlink()
+    finally:
+        shutil.rmtree(root_path)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
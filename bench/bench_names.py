@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf8  -*-
+
+r"""Benchmark of file name analysis of main3.py: media type by extension and date-time string search, on synthetic names.
+
+Generates (in memory) a deterministic mix of file names of various camera naming schemes, with and without date-time
+string, including long names without any, split into directory listings. Compares the previous per-file analysis
+(greedy pattern '^(.*)(\d{8}_\d{6}).*' and extension lookup, done for each file separately) with analyze_file_names(),
+called once per listing, and reports time per name. Verifies both find the same date-time strings, except for names
+containing more than one (the previous pattern found the last one, the current one finds the first one).
+
+Usage: python3 bench/bench_names.py [--names 1000000] [--listing 1000] [--repeat 3]
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import pathlib
+import optparse
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+import main3
+
+## previous pattern, see main3.date_time_search_re
+LEGACY_DATE_TIME_SEARCH_RE = re.compile(r'^(.*)(\d{8}_\d{6}).*')
+
+## file name formats, with relative weights; formatted with index and date-time string
+NAME_FORMATS = [
+    ('IMG_%(index)04d.JPG', 20),
+    ('DSC%(index)05d.JPG', 10),
+    ('MOV_%(index)04d.MOV', 10),
+    ('IMG_%(date_time)s.jpg', 10),
+    ('VID_%(date_time)s.mp4', 5),
+    ('PXL_%(date_time)s%(millis)03d.jpg', 10),
+    ('PXL_%(date_time)s%(millis)03d.PORTRAIT.jpg', 2),
+    ('%(date_time)s_IMG_%(index)04d.JPG', 15),
+    ('%(date_time)s_PXL_%(date_time)s%(millis)03d.jpg', 3),
+    ('Holiday trip to the mountains with family and friends, day %(day)d - copy (%(index)d).jpg', 10),
+    ('scan_of_old_family_album_page_%(index)06d_final_version.tiff', 5),
+]
+
+
+def make_names(name_count, seed=0):
+    ''' Returns list of synthetic file names, deterministic for given seed. '''
+    randomizer = random.Random(seed)
+    formats = [name_format for (name_format, weight) in NAME_FORMATS for _ in range(weight)]
+    names = []
+    for index in range(name_count):
+        date_time = '201906%02d_%02d%02d%02d' % (1 + index % 30, index % 24, index % 60, randomizer.randrange(60))
+        names.append(randomizer.choice(formats) % {'index': index % 10000, 'date_time': date_time, 'millis': index % 1000, 'day': 1 + index % 30})
+    return names
+
+
+def analyze_legacy(file_names, media_types):
+    ''' Previous analysis of file names, one by one, as done for each file by schedule_extraction(). '''
+    results = []
+    for file_name in file_names:
+        results.append((media_types.get(os.path.splitext(file_name)[1].lower()), LEGACY_DATE_TIME_SEARCH_RE.match(file_name)))
+    return results
+
+
+def analyze_listing(file_names, media_types):
+    return list(zip(*main3.analyze_file_names(file_names, media_types)))
+
+
+def run_analysis(analyze, listings, media_types, repeat):
+    ''' Returns best time of analyzing all the listings, in seconds, and the results of the last run. '''
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        results = [analyze(file_names, media_types) for file_names in listings]
+        seconds = time.perf_counter() - started
+        best = seconds if best is None else min(best, seconds)
+    return best, [result for listing_results in results for result in listing_results]
+
+
+def main(argv=None):
+    parser = optparse.OptionParser()
+    parser.add_option('', '--names', action='store', type='int', default=1000000, dest='names', help='number of synthetic file names; default is 1000000')
+    parser.add_option('', '--listing', action='store', type='int', default=1000, dest='listing', help='number of file names per directory listing; default is 1000')
+    parser.add_option('', '--repeat', action='store', type='int', default=3, dest='repeat', help='number of runs, the best one reported; default is 3')
+    (options, _) = parser.parse_args(argv)
+
+    names = make_names(options.names)
+    listings = [names[index:index + options.listing] for index in range(0, len(names), options.listing)]
+    media_types = main3.build_media_types(None)
+
+    (legacy_seconds, legacy_results) = run_analysis(analyze_legacy, listings, media_types, options.repeat)
+    (seconds, results) = run_analysis(analyze_listing, listings, media_types, options.repeat)
+
+    mismatches = 0
+    for (file_name, (legacy_media_type, legacy_search), (media_type, search)) in zip(names, legacy_results, results):
+        legacy_groups = legacy_search.groups() if legacy_search is not None else None
+        groups = search.groups() if search is not None else None
+        if media_type != legacy_media_type or (groups != legacy_groups and len(re.findall(r'\d{8}_\d{6}', file_name)) < 2):
+            mismatches += 1
+            print('  MISMATCH: %s: %r, previously %r' % (file_name, (media_type, groups), (legacy_media_type, legacy_groups)))
+
+    matched = sum(1 for (_, search) in results if search is not None)
+    print('%d names (%d with date-time string), in listings of %d' % (len(names), matched, options.listing))
+    print('previous (file by file): %7.3f s, %6.0f ns per name' % (legacy_seconds, legacy_seconds * 1e9 / len(names)))
+    print('current (by listing)   : %7.3f s, %6.0f ns per name, %.2fx' % (seconds, seconds * 1e9 / len(names), legacy_seconds / seconds))
+    return 1 if mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
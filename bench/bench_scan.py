@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf8  -*-
+
+r"""Benchmark of directory traversal, comparing the os.scandir() based scan stage of main3.py with
+the former pathlib based traversal (is_dir(), is_file() and exists() calls for every entry).
+
+Generates a synthetic directory tree and walks it with each walker, reporting time and number of
+file system calls. Calls are counted by strace, if available (option --strace); otherwise by wrapping
+the os module functions, which sees the calls made through Python code only.
+
+Usage: python3 bench/bench_scan.py [--dirs N] [--files N] [--strace]
+"""
+
+import os
+import sys
+import time
+import shutil
+import pathlib
+import optparse
+import tempfile
+import subprocess
+import collections
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+import main3
+
+WALKERS = ('pathlib', 'scandir')
+
+
+def make_tree(root_path, dir_count, file_count):
+    for dir_index in range(dir_count):
+        dir_path = root_path.joinpath('DIR_%04d' % dir_index)
+        dir_path.mkdir()
+        for file_index in range(file_count):
+            dir_path.joinpath('IMG_%05d.JPG' % file_index if file_index % 10 else 'notes_%05d.txt' % file_index).touch()
+
+
+def walk_pathlib(dir_path, dir_depth, max_depth):
+    ''' Traversal as formerly done by process_directory(), including the check for new file name collision. '''
+    count = 0
+    for tmp_path in dir_path.iterdir():
+        if tmp_path.is_dir():
+            if max_depth > dir_depth:
+                count += walk_pathlib(tmp_path, dir_depth + 1, max_depth)
+                continue
+        elif not tmp_path.is_file():
+            continue
+        count += 1
+        tmp_path.with_name('20190601_120000_' + tmp_path.name).exists()
+    return count
+
+
+def walk_scandir(dir_path, max_depth):
+    (options, _) = main3.build_option_parser().parse_args(['--max-depth', str(max_depth)])
+    options.context = main3.RunContext(main3.Logger(), main3.RunStats())
+    options.media_types = main3.build_media_types(None)
+    count = 0
+    for media_file in main3.scan_directory(dir_path, 0, options):
+        if media_file.kind == 'file':
+            count += 1
+            media_file.dir_names['20190601_120000_' + media_file.path.name.casefold()] > 0
+    return count
+
+
+def run_walker(walker, root_path):
+    started = time.perf_counter()
+    if walker == 'pathlib':
+        count = walk_pathlib(root_path, 0, 1)
+    else:
+        count = walk_scandir(root_path, 1)
+    return count, time.perf_counter() - started
+
+
+def count_os_calls(walker, root_path):
+    ''' Runs given walker with os module functions wrapped, so as to count their calls. '''
+    counts = collections.Counter()
+    originals = {}
+    for name in ('stat', 'lstat', 'scandir', 'listdir'):
+        originals[name] = getattr(os, name)
+        def counting(*args, _name=name, **kwargs):
+            counts[_name] += 1
+            return originals[_name](*args, **kwargs)
+        setattr(os, name, counting)
+    try:
+        (count, seconds) = run_walker(walker, root_path)
+    finally:
+        for (name, original) in originals.items():
+            setattr(os, name, original)
+    return count, seconds, counts
+
+
+def count_strace_calls(command):
+    ''' Runs given command in a subprocess under strace, so as to count all the system calls made. '''
+    with tempfile.NamedTemporaryFile(suffix='.strace') as strace_file:
+        subprocess.run(['strace', '-c', '-f', '-o', strace_file.name] + command, check=True, stdout=subprocess.DEVNULL)
+        counts = collections.Counter()
+        for line in open(strace_file.name):
+            fields = line.split()
+            ## columns: % time, seconds, usecs/call, calls, [errors,] syscall
+            if len(fields) >= 5 and fields[3].isdigit() and fields[-1] != 'total':
+                counts[fields[-1]] = int(fields[3])
+    return counts
+
+
+def main(argv=None):
+    parser = optparse.OptionParser()
+    parser.add_option('', '--dirs', action='store', type='int', default=20, dest='dirs', help='number of directories in synthetic tree; default is 20')
+    parser.add_option('', '--files', action='store', type='int', default=1000, dest='files', help='number of files per directory; default is 1000')
+    parser.add_option('', '--strace', action='store_true', default=False, dest='strace', help='whether to count system calls with strace')
+    parser.add_option('', '--walker', action='store', default=None, dest='walker', help=optparse.SUPPRESS_HELP)
+    parser.add_option('', '--root', action='store', default=None, dest='root', help=optparse.SUPPRESS_HELP)
+    (options, _) = parser.parse_args(argv)
+
+    ## single walker run, within strace
+    if options.walker is not None:
+        run_walker(options.walker, pathlib.Path(options.root))
+        return 0
+
+    root_path = pathlib.Path(tempfile.mkdtemp(prefix='bench_scan_'))
+    try:
+        make_tree(root_path, options.dirs, options.files)
+        for walker in WALKERS:
+            (count, seconds, counts) = count_os_calls(walker, root_path)
+            if options.strace:
+                counts = count_strace_calls([sys.executable, __file__, '--walker', walker, '--root', str(root_path)])
+                counts = collections.Counter({name: calls for (name, calls) in counts.items() if 'stat' in name or name in ('getdents64', 'openat')})
+            print('%-8s: %d files in %.3f s, %d calls (%s)' % (walker, count, seconds, sum(counts.values()), ', '.join('%s: %d' % item for item in sorted(counts.items()))))
+    finally:
+        shutil.rmtree(root_path)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf8  -*-
+
+r"""Benchmark suite of main3.py: the whole processing pipeline on a synthetic media corpus, stage by stage.
+
+Generates a corpus (see corpus.py) in a temporary directory, unless an existing one is given (option --root),
+then runs process_directory() stages (scan -> extract -> plan -> apply) in dry-run mode, in a subprocess of its own,
+reporting files per second, time spent in each stage, file system calls and peak RSS, followed by micro-benchmarks
+of EXIF parsing, MOV/MP4 parsing and get_mov_timestamps(). Results can be saved as JSON (option --output)
+and compared with results saved before (option --baseline), so as to track regressions across versions.
+
+File system calls are counted by wrapping the os module functions (and the open() and mmap.mmap() used by main3.py),
+which sees the calls made through Python code only; with option --strace, all the system calls are counted by strace.
+
+Usage: python3 bench/bench_suite.py [--dirs 10] [--files 1000] [--jobs 1] [--output results.json] [--baseline results.json]
+"""
+
+import os
+import sys
+import json
+import time
+import mmap
+import shutil
+import pathlib
+import optparse
+import platform
+import datetime
+import tempfile
+import contextlib
+import subprocess
+import collections
+import concurrent.futures
+
+try:
+    import resource  # Unix only
+except ImportError:
+    resource = None
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+import main3
+
+import corpus
+import bench_scan
+
+RESULTS_VERSION = 1
+
+STAGES = ('scan', 'extract', 'plan', 'apply')
+
+## os module functions counted as file system calls
+OS_CALLS = ('stat', 'lstat', 'scandir', 'listdir', 'rename', 'replace')
+
+
+def timed_stage(stage, media_files, timings):
+    ''' Passes MediaFile records through, adding up time spent in getting them (including all the upstream stages). '''
+    media_files = iter(media_files)
+    while True:
+        started = time.perf_counter()
+        media_file = next(media_files, None)
+        timings[stage] += time.perf_counter() - started
+        if media_file is None:
+            return
+        yield media_file
+
+
+def run_pipeline(root_path, options, executor=None):
+    ''' Runs process_directory() stages on given directory; returns number of files, total time and exclusive time of each stage. '''
+    timings = collections.Counter()
+    file_comparer = main3.FileComparer(options.hash, options.context.stats)
+    started = time.perf_counter()
+    media_files = timed_stage('scan', main3.scan_directory(root_path, 0, options), timings)
+    media_files = timed_stage('extract', main3.extract_date_time_strs(media_files, options, executor), timings)
+    media_files = timed_stage('plan', main3.plan_renames(media_files, options, file_comparer), timings)
+    media_files = timed_stage('apply', main3.apply_renames(media_files, options), timings)
+    file_count = sum(1 for media_file in media_files if media_file.kind == 'file')
+    seconds = time.perf_counter() - started
+
+    ## each stage timing includes its upstream stages, as the records are pulled through the chain
+    stages = {}
+    upstream = 0.0
+    for stage in STAGES:
+        stages[stage] = timings[stage] - upstream
+        upstream = timings[stage]
+    return file_count, seconds, stages
+
+
+@contextlib.contextmanager
+def counting_calls(counts):
+    ''' Wraps file system calls made by main3.py, so as to count them. '''
+    def counting(name, function):
+        def wrapper(*args, **kwargs):
+            counts[name] += 1
+            return function(*args, **kwargs)
+        return wrapper
+
+    originals = {name: getattr(os, name) for name in OS_CALLS}
+    for (name, original) in originals.items():
+        setattr(os, name, counting(name, original))
+    main3.open = counting('open', open)
+    main3.mmap.mmap = counting('mmap', mmap.mmap)
+    try:
+        yield counts
+    finally:
+        for (name, original) in originals.items():
+            setattr(os, name, original)
+        del main3.open
+        main3.mmap.mmap = mmap.mmap
+
+
+def time_per_call(function, args_list, repeat):
+    ''' Returns average time of calling function with each of given arguments, in microseconds. '''
+    if not args_list:
+        return None
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for args in args_list:
+            function(*args)
+    return (time.perf_counter() - started) * 1e6 / (repeat * len(args_list))
+
+
+def run_micro(root_path, sample_size, repeat):
+    ''' Micro-benchmarks of date-time extraction on a sample of the corpus files; returns time per file, in microseconds. '''
+    images = sorted(root_path.rglob('IMG_*.JPG'))[:sample_size]
+    videos = sorted(root_path.rglob('MOV_*.MP4'))[:sample_size]
+    headers = []
+    for image_path in images:
+        with open(image_path, 'rb') as f:
+            headers.append((f.read(main3.HEADER_SIZE),))
+    return {
+        'read_exif_date_time_original': time_per_call(main3.read_exif_date_time_original, headers, repeat),
+        'extract_date_time_str_image': time_per_call(main3.extract_date_time_str, [(path, 'image') for path in images], repeat),
+        'extract_date_time_str_video': time_per_call(main3.extract_date_time_str, [(path, 'video') for path in videos], repeat),
+        'get_mov_timestamps': time_per_call(main3.get_mov_timestamps, [(path,) for path in videos], repeat),
+    }
+
+
+def get_peak_rss_kib():
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    ## reported in bytes on macOS, in kilobytes elsewhere
+    return peak_rss // 1024 if sys.platform == 'darwin' else peak_rss
+
+
+def measure(root_path, jobs, sample_size, repeat):
+    ''' Runs the pipeline and the micro-benchmarks on given corpus; returns the measurements. '''
+    (options, _) = main3.build_option_parser().parse_args(['--dry-run', '--no-cache', '--no-journal', '--max-depth', '2', '--jobs', str(jobs)])
+    options.media_types = main3.build_media_types(None)
+    options.date_sources = main3.build_date_sources(options.date_source)
+    options.name_template = main3.build_name_template(options)
+    options.context = main3.RunContext(main3.Logger(), main3.RunStats())
+    stats = options.context.stats
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs) if jobs > 1 else None
+
+    calls = collections.Counter()
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), counting_calls(calls):
+            (file_count, seconds, stages) = run_pipeline(root_path, options, executor)
+            options.context.logger.close()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return {
+        'files': file_count,
+        'seconds': seconds,
+        'files_per_second': file_count / seconds if seconds else None,
+        'stages': stages,
+        'calls': dict(sorted(calls.items())),
+        'peak_rss_kib': get_peak_rss_kib(),
+        'counts': {'processed': stats.processed_count, 'renamed': stats.renamed_count, 'skipped': stats.skipped_count, 'failed': stats.failed_count},
+        'latency': stats.get_report()['latency'],
+        'micro': run_micro(root_path, sample_size, repeat),
+    }
+
+
+def compare(results, baseline):
+    ''' Yields lines comparing timings of given results with the baseline ones, as a ratio (lower is better). '''
+    metrics = [('seconds', results['seconds'], baseline.get('seconds'))]
+    metrics += [('stages.' + stage, seconds, baseline.get('stages', {}).get(stage)) for (stage, seconds) in results['stages'].items()]
+    metrics += [('micro.' + name, micros, baseline.get('micro', {}).get(name)) for (name, micros) in results['micro'].items()]
+    for (name, value, baseline_value) in metrics:
+        if value is not None and baseline_value:
+            yield '  %-38s: %6.2fx' % (name, value / baseline_value)
+
+
+def main(argv=None):
+    parser = optparse.OptionParser()
+    parser.add_option('', '--root', action='store', default=None, dest='root', help='path of an existing corpus to run on, instead of generating one')
+    parser.add_option('', '--dirs', action='store', type='int', default=10, dest='dirs', help='number of directories of generated corpus; default is 10')
+    parser.add_option('', '--files', action='store', type='int', default=1000, dest='files', help='number of files per directory of generated corpus; default is 1000')
+    parser.add_option('', '--seed', action='store', type='int', default=0, dest='seed', help='seed of the corpus generator; default is 0')
+    parser.add_option('-j', '--jobs', action='store', type='int', default=1, dest='jobs', help='number of worker threads extracting date-time strings; default is 1, so that stage timings are exclusive')
+    parser.add_option('', '--sample', action='store', type='int', default=100, dest='sample', help='number of images and videos for micro-benchmarks; default is 100')
+    parser.add_option('', '--repeat', action='store', type='int', default=10, dest='repeat', help='number of micro-benchmark repetitions; default is 10')
+    parser.add_option('', '--strace', action='store_true', default=False, dest='strace', help='whether to count system calls with strace')
+    parser.add_option('', '--output', action='store', default=None, dest='output', help='path of JSON file to save the results to', metavar='PATH')
+    parser.add_option('', '--baseline', action='store', default=None, dest='baseline', help='path of JSON file with results to compare with', metavar='PATH')
+    parser.add_option('', '--measure', action='store_true', default=False, dest='measure', help=optparse.SUPPRESS_HELP)
+    (options, _) = parser.parse_args(argv)
+
+    ## single measurement, in a subprocess of its own, so that peak RSS is not affected by the corpus generation
+    if options.measure:
+        json.dump(measure(pathlib.Path(options.root), options.jobs, options.sample, options.repeat), sys.stdout)
+        return 0
+
+    root_path = pathlib.Path(options.root) if options.root is not None else pathlib.Path(tempfile.mkdtemp(prefix='bench_suite_'))
+    try:
+        corpus_counts = None
+        if options.root is None:
+            print('Generating corpus of %d directories with %d files each ... ' % (options.dirs, options.files))
+            corpus_counts = corpus.make_corpus(root_path, options.dirs, options.files, seed=options.seed)
+
+        command = [sys.executable, __file__, '--measure', '--root', str(root_path), '--jobs', str(options.jobs), '--sample', str(options.sample), '--repeat', str(options.repeat)]
+        results = json.loads(subprocess.run(command, check=True, stdout=subprocess.PIPE).stdout)
+        if options.strace:
+            results['syscalls'] = dict(sorted(bench_scan.count_strace_calls(command).items()))
+    finally:
+        if options.root is None:
+            shutil.rmtree(root_path)
+
+    results = dict({
+        'version': RESULTS_VERSION,
+        'main3_version': main3.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'date_time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'corpus': {'dirs': options.dirs, 'files': options.files, 'seed': options.seed, 'counts': corpus_counts} if options.root is None else {'path': options.root},
+        'jobs': options.jobs,
+    }, **results)
+
+    print('%d files in %.3f s, %.1f files/s, peak RSS: %s KiB' % (results['files'], results['seconds'], results['files_per_second'] or 0, results['peak_rss_kib']))
+    print('Stages: ' + ', '.join('%s: %.3f s' % item for item in results['stages'].items()))
+    print('Calls: %d (%s)' % (sum(results['calls'].values()), ', '.join('%s: %d' % item for item in results['calls'].items())))
+    if 'syscalls' in results:
+        print('System calls: %d (%s)' % (sum(results['syscalls'].values()), ', '.join('%s: %d' % item for item in results['syscalls'].items())))
+    print('Micro: ' + ', '.join('%s: %.1f us' % (name, micros) for (name, micros) in results['micro'].items() if micros is not None))
+
+    if options.baseline is not None:
+        with open(options.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        print('Compared with %s (python %s, %s):' % (options.baseline, baseline.get('python'), baseline.get('date_time')))
+        for line in compare(results, baseline):
+            print(line)
+
+    if options.output is not None:
+        with open(options.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf8  -*-
+
+r"""Generator of synthetic media corpus for benchmarks: a directory tree of configurable size and mix of files.
+
+Generates minimal valid JPEG files with EXIF 'DateTimeOriginal' tag, sparse MP4 files with "moov" atom either in front
+of or behind the media data, other (non-media) files, file names with and without date-time prefix, and collisions,
+i.e. files which new file name of another file is taken by already (either by identical or different file).
+The corpus is deterministic for given seed.
+
+Usage: python3 bench/corpus.py PATH [--dirs 10] [--files 1000] [--seed 0] [...]
+"""
+
+import sys
+import random
+import pathlib
+import optparse
+import datetime
+import collections
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent.joinpath('tests')))
+import media_builders
+
+## default fractions of files of each kind
+DEFAULT_MIX = {'images': 0.6, 'videos': 0.3, 'moov_last': 0.5, 'prefixed': 0.1, 'collisions': 0.02}
+
+## size of synthetic video files, large enough for "moov" atom behind the media data not to fit within the file header
+VIDEO_SIZE = 1 << 20
+
+
+def make_corpus(root_path, dir_count, file_count, mix=None, seed=0):
+    ''' Generates corpus of dir_count directories (nested in pairs) with file_count files each, under root_path.
+
+        Fractions of files are given by mix: 'images' and 'videos' (the rest being other files), 'moov_last' (of videos),
+        'prefixed' (of images and videos, named with date-time prefix already) and 'collisions' (of images and videos,
+        colliding with an extra file, either identical or different). Returns counts of generated files by kind.
+    '''
+    mix = dict(DEFAULT_MIX, **(mix or {}))
+    randomizer = random.Random(seed)
+    date_time = datetime.datetime(2019, 6, 1, 12, 0, 0)
+    counts = collections.Counter()
+
+    for dir_index in range(dir_count):
+        ## every other directory nested within the previous one, so that the tree has some depth
+        dir_path = root_path.joinpath('DIR_%04d' % (dir_index - 1), 'DIR_%04d' % dir_index) if dir_index % 2 else root_path.joinpath('DIR_%04d' % dir_index)
+        dir_path.mkdir(parents=True, exist_ok=True)
+
+        for file_index in range(file_count):
+            file_date_time = date_time + datetime.timedelta(seconds=dir_index * file_count + file_index)
+            date_time_str = file_date_time.strftime('%Y%m%d_%H%M%S')
+            kind = randomizer.random()
+            if kind < mix['images']:
+                (file_name, data, layout) = ('IMG_%05d.JPG' % file_index, media_builders.make_jpeg(file_date_time.strftime('%Y:%m:%d %H:%M:%S')), None)
+                counts['images'] += 1
+            elif kind < mix['images'] + mix['videos']:
+                layout = 'moov-last' if randomizer.random() < mix['moov_last'] else 'moov-first'
+                (file_name, data) = ('MOV_%05d.MP4' % file_index, None)
+                counts['videos-' + layout] += 1
+            else:
+                dir_path.joinpath('notes_%05d.txt' % file_index).write_bytes(b'notes')
+                counts['others'] += 1
+                continue
+
+            if randomizer.random() < mix['prefixed']:
+                file_name = date_time_str + '_' + file_name
+                counts['prefixed'] += 1
+            elif randomizer.random() < mix['collisions']:
+                collision_path = dir_path.joinpath(date_time_str + '_' + file_name)
+                if randomizer.random() < 0.5:
+                    write_media_file(collision_path, data, layout, file_date_time)
+                    counts['collisions-identical'] += 1
+                else:
+                    collision_path.write_bytes(b'different')
+                    counts['collisions-different'] += 1
+
+            write_media_file(dir_path.joinpath(file_name), data, layout, file_date_time)
+
+    return counts
+
+
+def write_media_file(file_path, data, layout, date_time):
+    if data is not None:
+        file_path.write_bytes(data)
+    else:
+        media_builders.make_mov(file_path, VIDEO_SIZE, layout, date_time)
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog PATH [options]')
+    parser.add_option('', '--dirs', action='store', type='int', default=10, dest='dirs', help='number of directories; default is 10')
+    parser.add_option('', '--files', action='store', type='int', default=1000, dest='files', help='number of files per directory; default is 1000')
+    parser.add_option('', '--seed', action='store', type='int', default=0, dest='seed', help='seed of the random generator; default is 0')
+    for (name, fraction) in DEFAULT_MIX.items():
+        parser.add_option('', '--' + name.replace('_', '-'), action='store', type='float', default=fraction, dest=name, help='fraction of %s; default is %s' % (name.replace('_', ' '), fraction))
+    (options, args) = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error('expected exactly one argument, the corpus path')
+
+    counts = make_corpus(pathlib.Path(args[0]), options.dirs, options.files, {name: getattr(options, name) for name in DEFAULT_MIX}, options.seed)
+    print(', '.join('%s: %d' % item for item in sorted(counts.items())))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,9 +11,15 @@ __author__ = "Marcin Wolodkiewicz"
 __status__ = "Development"
 
 
+import os
 import re
 import sys
 import optparse
+import collections
+import stat
+## imported on first use only, so as to keep the startup fast for small batches (see bench/bench_import.py):
+## random (option --trust-window, or once over STAT_LATENCY_SAMPLES files got extracted), concurrent.futures (option --jobs), exifread, hashlib, sqlite3,
+## ctypes, select, signal (option --watch), cProfile (option --profile) and xxhash (option --hash)
 
 ## filemagic - Unix/Cygwin compatible only
 # try:
@@ -35,14 +41,16 @@ import pathlib
 # >>> import imghdr
 # >>> imghdr.what('bass.gif')
 # 'gif'
-import imghdr
+## replaced by sniff_media_type(), so as to open and read file header just once
+# import imghdr
 
 ## pip install exifread
 ## https://github.com/ianare/exif-py
 ##   EXIF tag: [Image DateTime], value: [2017:01:12 20:34:21]
 ##   EXIF tag: [EXIF DateTimeOriginal], value: [2017:01:12 20:34:21]
 ##   EXIF tag: [EXIF DateTimeDigitized], value: [2017:01:12 20:34:21]
-import exifread
+## imported by extract_date_time_str(), for JPEG files not handled by the built-in EXIF parser only
+# import exifread
 
 ## pip install mp4file - does not work
 # import mp4file.mp4file
@@ -67,6 +75,17 @@ import exifread
 ## http://stackoverflow.com/questions/21381652/python-find-record-time-of-mp4-movie
 import datetime
 import struct
+## https://docs.python.org/3/library/mmap.html
+import mmap
+## https://docs.python.org/3/library/time.html#time.perf_counter
+import time
+## https://docs.python.org/3/library/array.html
+import array
+import threading
+## https://docs.python.org/3/library/json.html
+import json
+## https://docs.python.org/3/library/string.html#format-string-syntax
+import string
 
 # import signal
 
@@ -76,89 +95,438 @@ def get_mov_timestamps(filename):
 
         Returns None if a value is not available.
     '''
-    from datetime import datetime as DateTime
-    import struct
+    with open(filename, "rb") as f:
+        return read_mov_timestamps(f)
 
-    ATOM_HEADER_SIZE = 8
-    # difference between Unix epoch and QuickTime epoch, in seconds
-    EPOCH_ADJUSTER = 2082844800
 
-    creation_time = modification_time = None
+def read_mov_timestamps(f, parse=None):
+    ''' Like get_mov_timestamps(), but reads .mov metadata from already opened (binary mode) file object.
 
+        The file gets memory-mapped, so that only the pages holding atom headers and "mvhd" atom are
+        actually read, no matter how large the skipped media data is.
+        With parse given, returns its result for the view of the memory-mapped file, instead of find_mov_timestamps() one.
+    '''
     # # Set the signal handler and a 5-second alarm
     # signal.signal(signal.SIGALRM, handler)
     # signal.alarm(5)
 
-    ## TODO: solve issue with this exception
-    #     atom_size = struct.unpack('>I', atom_header[0:4])[0]
-    # struct.error: unpack requires a buffer of 4 bytes
+    try:
+        mapped_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError) as e:  ## empty file, or file system not supporting memory mapping
+        raise RuntimeError('Failed to memory-map file: %s' % (e,))
 
-    # search for moov item
-    with open(filename, "rb") as f:
-        while True:
-            atom_header = f.read(ATOM_HEADER_SIZE)
-            # print('atom_header:', atom_header)  # debug purposes
-            if atom_header[4:8] == b'moov':
-                break  # found
-            elif atom_header == b'':
-                raise RuntimeError('Could not find moov atom')
-            else:
-                try:
-                    atom_size = struct.unpack('>I', atom_header[0:4])[0]
-                except struct.error:
-                    raise RuntimeError('Failed to unpack read data')
-                # print('atom_size:', atom_size)  # debug purposes
-                if atom_size == 0:
-                    raise RuntimeError('Read data is not a valid atom header')
-                f.seek(atom_size - 8, 1)  ## os.SEEK_CUR
-                # print('f.tell():', f.tell())
-
-        # found 'moov', look for 'mvhd' and timestamps
-        atom_header = f.read(ATOM_HEADER_SIZE)
-        if atom_header[4:8] == b'cmov':
-            raise RuntimeError('Read "moov" atom is compressed')
-        elif atom_header[4:8] != b'mvhd':
-            raise RuntimeError('Expected to find "mvhd" atom header')
-        else:
-            f.seek(4, 1)
+    with mapped_file:
+        view = memoryview(mapped_file)
+        try:
+            return (parse or find_mov_timestamps)(view)
+        finally:
+            ## the memoryview must be released before the mapping can be closed
+            view.release()
 
-            try:
-                creation_timestamp = struct.unpack('>I', f.read(4))[0] - EPOCH_ADJUSTER
-                # print('creation_timestamp: ', creation_timestamp)
-                creation_time = DateTime.fromtimestamp(creation_timestamp)
-                #? creation_time = DateTime.utcfromtimestamp(creation_timestamp)
-                # print('creation_time: ', creation_time)
-                if creation_time.year < 1990:  # invalid or censored data
-                    creation_time = None
-            except struct.error:
-                raise RuntimeError('Failed to unpack movie creation timestamp from "mvhd" atom')
-            except (OSError, OverflowError):
-                raise RuntimeError('Failed to convert movie creation timestamp to date/time')
+    # # Disable the alarm
+    # signal.alarm(0)
 
-            try:
-                modification_timestamp = struct.unpack('>I', f.read(4))[0] - EPOCH_ADJUSTER
-                # print('modification_timestamp: ', modification_timestamp)
-                modification_time = DateTime.fromtimestamp(modification_timestamp)
-                #? modification_time = DateTime.utcfromtimestamp(modification_timestamp)
-                # print('modification_time: ', modification_time)
-                if modification_time.year < 1990:  # invalid or censored data
-                    modification_time = None
-            except struct.error:
-                raise RuntimeError('Failed to unpack movie modification timestamp from "mvhd" atom')
-            except (OSError, OverflowError):
-                raise RuntimeError('Failed to convert movie modification timestamp to date/time')
 
-    # # Disable the alarm
-    # signal.alarm(0)    
+## QuickTime/ISO base media file format atom (box) header: 32-bit size and type, optionally followed by 64-bit size
+ATOM_HEADER_SIZE = 8
+ATOM_LARGE_HEADER_SIZE = 16
+## difference between Unix epoch and QuickTime epoch, in seconds
+QUICKTIME_EPOCH_ADJUSTER = 2082844800
+
+def iter_atoms(view, start, end):
+    ''' Iterate over consecutive atoms within view[start:end], yielding tuples (atom_type, data_start, atom_end).
+
+        Supports 64-bit atom size (size field equal to 1) and the last atom extending up to the end of
+        its container (size field equal to 0). Only atom headers are touched, never the atom data.
+        Yielded atom_end may lie beyond the end, for an atom truncated or not contained within the view.
+    '''
+    position = start
+    while position + ATOM_HEADER_SIZE <= end:
+        (atom_size, atom_type) = struct.unpack_from('>I4s', view, position)
+        header_size = ATOM_HEADER_SIZE
+        if atom_size == 1:
+            if position + ATOM_LARGE_HEADER_SIZE > end:
+                raise RuntimeError('Failed to unpack read data')
+            atom_size = struct.unpack_from('>Q', view, position + ATOM_HEADER_SIZE)[0]
+            header_size = ATOM_LARGE_HEADER_SIZE
+        elif atom_size == 0:
+            atom_size = end - position
+        if atom_size < header_size:
+            raise RuntimeError('Read data is not a valid atom header')
+        atom_end = position + atom_size
+        yield atom_type, position + header_size, atom_end
+        position = atom_end
+
+
+def find_moov_atom(view, start, end):
+    ''' Walk top-level atoms within view[start:end] forward; returns tuple (data_start, data_end) of "moov" atom, or None. '''
+    for (atom_type, data_start, atom_end) in iter_atoms(view, start, end):
+        if atom_type == b'moov':
+            return data_start, min(atom_end, end)
+    return None
+
+
+## size of file tail read at once, expected to contain the whole "moov" atom of a movie recorded with "mdat" atom first
+MOV_TAIL_SIZE = 262144
+
+def find_moov_atom_at_tail(tail):
+    ''' Search the tail of file for "moov" atom, i.e. one starting within the tail and followed by atoms ending exactly at the end of file.
+
+        Returns tuple (data_start, data_end) of "moov" atom, or None.
+    '''
+    tail_size = len(tail)
+    position = tail_size
+    while True:
+        position = tail.rfind(b'moov', 0, position)
+        if position < 4:
+            return None
+        try:
+            atoms = list(iter_atoms(tail, position - 4, tail_size))
+        except RuntimeError:
+            continue
+        ## atom type found within some other atom data is not likely to be followed by a valid chain of atoms
+        if atoms and atoms[0][0] == b'moov' and atoms[-1][2] == tail_size:
+            return atoms[0][1], atoms[0][2]
+
+
+def read_mvhd_timestamps(view, start, end):
+    ''' Get the creation and modification date-time from "mvhd" atom within "moov" atom data view[start:end].
+
+        Walks child atoms of "moov" up to "mvhd", and stops right there.
+        Supports both version 0 (32-bit) and version 1 (64-bit) "mvhd" timestamps.
+    '''
+    for (atom_type, start, atom_end) in iter_atoms(view, start, end):
+        if atom_type == b'cmov':
+            raise RuntimeError('Read "moov" atom is compressed')
+        elif atom_type == b'mvhd':
+            end = min(atom_end, end)
+            break
+    else:
+        raise RuntimeError('Expected to find "mvhd" atom header')
+
+    ## 1-byte version and 3-byte flags, followed by creation and modification timestamps
+    version = view[start] if start < end else None
+    if version == 0:
+        timestamps_format = '>II'
+    elif version == 1:
+        timestamps_format = '>QQ'
+    else:
+        raise RuntimeError('Unsupported "mvhd" atom version')
+    if start + 4 + struct.calcsize(timestamps_format) > end:
+        raise RuntimeError('Failed to unpack movie timestamps from "mvhd" atom')
+    (creation_timestamp, modification_timestamp) = struct.unpack_from(timestamps_format, view, start + 4)
+
+    creation_time = convert_mov_timestamp(creation_timestamp, 'creation')
+    modification_time = convert_mov_timestamp(modification_timestamp, 'modification')
 
     # print('  DEBUG: creation_time: "%r", modification_time: "%r"' % (creation_time, modification_time))
 
     return creation_time, modification_time
 
 
+def find_mov_timestamps(view):
+    ''' Like get_mov_timestamps(), but reads .mov metadata from a buffer holding the whole file (e.g. memory-mapped). '''
+    # search for moov item
+    moov_atom = find_moov_atom(view, 0, len(view))
+    if moov_atom is None:
+        raise RuntimeError('Could not find moov atom')
+
+    # found 'moov', look for 'mvhd' and timestamps
+    return read_mvhd_timestamps(view, *moov_atom)
+
+
+## sources of date-time strings (option --date-source), as reported by extract_date_time_str() and written to rename plan entries:
+## EXIF 'DateTimeOriginal' tag, "mvhd" atom creation time, QuickTime "meta" atom creation date key, file name and file modification time
+DATE_SOURCE_EXIF = 'exif'
+DATE_SOURCE_MVHD = 'mvhd'
+DATE_SOURCE_KEYS = 'keys'
+DATE_SOURCE_FILE_NAME = 'filename'
+DATE_SOURCE_MTIME = 'mtime'
+## sources read from the file metadata by extract_date_time_str(), by media type; the others need the directory entry only
+METADATA_DATE_SOURCES = {'image': (DATE_SOURCE_EXIF,), 'video': (DATE_SOURCE_MVHD, DATE_SOURCE_KEYS)}
+ENTRY_DATE_SOURCES = (DATE_SOURCE_FILE_NAME, DATE_SOURCE_MTIME)
+DATE_SOURCE_NAMES = (DATE_SOURCE_EXIF, DATE_SOURCE_MVHD, DATE_SOURCE_KEYS, DATE_SOURCE_FILE_NAME, DATE_SOURCE_MTIME)
+
+## QuickTime metadata key of the creation date-time, with time zone offset, e.g. '2019-06-01T12:00:00+0200'
+QUICKTIME_CREATION_DATE_KEY = b'com.apple.quicktime.creationdate'
+## pattern of the creation date-time value, its local date and time only
+quicktime_creation_date_re = re.compile(rb'^(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})')
+
+def read_keys_creation_date(view, start, end):
+    ''' Get the creation date-time from QuickTime "meta" atom (with "keys" and "ilst" atoms) within "moov" atom data view[start:end].
+
+        Returns the local date-time as recorded (regardless of its time zone), or None for invalid or censored data.
+        Raises RuntimeError on missing atoms, or atoms exceeding their parent atom.
+    '''
+    for (atom_type, meta_start, meta_end) in iter_atoms(view, start, end):
+        if atom_type == b'meta':
+            meta_end = min(meta_end, end)
+            break
+    else:
+        raise RuntimeError('Expected to find "meta" atom header')
+    ## "meta" atom of ISO base media file format (rather than of QuickTime) starts with version and flags
+    if meta_start + 4 <= meta_end and struct.unpack_from('>I', view, meta_start)[0] == 0:
+        meta_start += 4
+
+    key_index = None
+    for (atom_type, atom_start, atom_end) in iter_atoms(view, meta_start, meta_end):
+        if atom_end > meta_end:
+            break
+        if atom_type == b'keys':
+            ## version and flags, number of keys, then keys of 32-bit size, 4-byte namespace and the key itself, indexed from 1
+            if atom_start + 8 > atom_end:
+                raise RuntimeError('Failed to unpack number of keys from "keys" atom')
+            position = atom_start + 8
+            for index in range(1, struct.unpack_from('>I', view, atom_start + 4)[0] + 1):
+                if position + 8 > atom_end:
+                    raise RuntimeError('Key exceeds "keys" atom')
+                key_size = struct.unpack_from('>I', view, position)[0]
+                if key_size < 8 or position + key_size > atom_end:
+                    raise RuntimeError('Invalid size of key within "keys" atom')
+                if view[position + 8:position + key_size] == QUICKTIME_CREATION_DATE_KEY:
+                    key_index = index
+                    break
+                position += key_size
+            if key_index is None:
+                return None
+        elif atom_type == b'ilst' and key_index is not None:
+            ## items are atoms of type being the key index, holding "data" atom of 4-byte type and 4-byte locale, then the value
+            for (item_type, item_start, item_end) in iter_atoms(view, atom_start, atom_end):
+                if item_end > atom_end:
+                    raise RuntimeError('Item exceeds "ilst" atom')
+                if item_type == struct.pack('>I', key_index):
+                    for (data_type, data_start, data_end) in iter_atoms(view, item_start, item_end):
+                        if data_type == b'data':
+                            if data_end > item_end or data_start + 8 > data_end:
+                                raise RuntimeError('Failed to unpack "data" atom of "ilst" item')
+                            match = quicktime_creation_date_re.match(bytes(view[data_start + 8:data_end]))
+                            if match is None:
+                                return None
+                            try:
+                                date_time = datetime.datetime(*map(int, match.groups()))
+                            except ValueError:
+                                return None
+                            return date_time if date_time.year >= 1990 else None
+            return None
+    raise RuntimeError('Expected to find "keys" and "ilst" atoms')
+
+
+def read_moov_date_time(view, start, end, sources=(DATE_SOURCE_MVHD,), truncated=False):
+    ''' Get the creation date-time from "moov" atom data view[start:end], trying given sources (DATE_SOURCE_MVHD
+        and/or DATE_SOURCE_KEYS) in order, until one of them holds a valid one.
+
+        Returns tuple (creation_time, source), both None if censored (or missing) in all the sources.
+        Raises RuntimeError if none of the sources could be read; with the atom data truncated, already if any of them
+        could not, so that the whole atom gets read instead, rather than falling back to the next source.
+    '''
+    error = None
+    read_any = False
+    for source in sources:
+        try:
+            if source == DATE_SOURCE_KEYS:
+                date_time = read_keys_creation_date(view, start, end)
+            else:
+                date_time = read_mvhd_timestamps(view, start, end)[0]
+        except RuntimeError as e:
+            if truncated:
+                raise
+            error = error or e
+            continue
+        if date_time is not None:
+            return date_time, source
+        read_any = True
+    if not read_any:
+        raise error or RuntimeError('No source of movie creation date-time given')
+    return None, None
+
+
+def find_mov_date_time(view, sources=(DATE_SOURCE_MVHD,)):
+    ''' Like read_moov_date_time(), but for a buffer holding the whole file (e.g. memory-mapped). '''
+    moov_atom = find_moov_atom(view, 0, len(view))
+    if moov_atom is None:
+        raise RuntimeError('Could not find moov atom')
+    return read_moov_date_time(view, *moov_atom, sources)
+
+
+## strategies of finding "moov" atom, as reported by read_mov_date_time()
+MOV_STRATEGY_HEADER = 'moov-header'
+MOV_STRATEGY_TAIL = 'moov-tail'
+MOV_STRATEGY_WALK = 'moov-walk'
+
+def read_mov_date_time(f, header, sources=(DATE_SOURCE_MVHD,), stats=None):
+    ''' Get the creation date-time from already opened MOV/MP4 file, of which the header has already been read.
+
+        Tries the cheapest strategy first: "moov" atom within the header; then within a single bounded read
+        of the file tail, where cameras writing "mdat" atom first put it; only then walks all top-level atoms
+        of the memory-mapped file. Within "moov" atom, tries given sources in order, see read_moov_date_time().
+        Returns tuple (creation_time, strategy, source), strategy being one of MOV_STRATEGY_*.
+        Bytes read from the tail get added to given RunStats, if any.
+    '''
+    ## header shorter than requested means there is nothing more in the file
+    header_complete = len(header) < HEADER_SIZE
+
+    moov_atom = find_moov_atom(header, 0, len(header))
+    if moov_atom is not None:
+        try:
+            ## atom reaching the end of incomplete header is likely to continue beyond it
+            truncated = not header_complete and moov_atom[1] == len(header)
+            (date_time, source) = read_moov_date_time(header, *moov_atom, sources, truncated)
+            return date_time, MOV_STRATEGY_HEADER, source
+        except RuntimeError:
+            if header_complete:
+                raise
+    elif header_complete:
+        raise RuntimeError('Could not find moov atom')
+
+    file_size = f.seek(0, 2)  ## os.SEEK_END
+    tail_start = max(0, file_size - MOV_TAIL_SIZE)
+    f.seek(max(tail_start, len(header)))
+    tail = header[tail_start:] + f.read(MOV_TAIL_SIZE)
+    if stats is not None:
+        stats.add_bytes(MOV_STRATEGY_TAIL, len(tail) - len(header[tail_start:]))
+    moov_atom = find_moov_atom_at_tail(tail)
+    if moov_atom is not None:
+        try:
+            (date_time, source) = read_moov_date_time(tail, *moov_atom, sources)
+            return date_time, MOV_STRATEGY_TAIL, source
+        except RuntimeError:
+            pass  ## fall back to walking the whole file
+
+    (date_time, source) = read_mov_timestamps(f, lambda view: find_mov_date_time(view, sources))
+    return date_time, MOV_STRATEGY_WALK, source
+
+
+def convert_mov_timestamp(timestamp, timestamp_name):
+    ''' Convert QuickTime timestamp (seconds since 1904-01-01) to local date-time; returns None for invalid or censored data. '''
+    try:
+        date_time = datetime.datetime.fromtimestamp(timestamp - QUICKTIME_EPOCH_ADJUSTER)
+        #? date_time = datetime.datetime.utcfromtimestamp(timestamp - QUICKTIME_EPOCH_ADJUSTER)
+    except (OSError, OverflowError, ValueError):
+        raise RuntimeError('Failed to convert movie %s timestamp to date/time' % (timestamp_name,))
+    if date_time.year < 1990:  # invalid or censored data
+        return None
+    return date_time
+
+
+## EXIF tags of interest: pointer from IFD0 to EXIF IFD, and original/creation date-time within EXIF IFD
+EXIF_TAG_EXIF_IFD_POINTER = 0x8769
+EXIF_TAG_DATE_TIME_ORIGINAL = 0x9003
+EXIF_TAG_SUB_SEC_TIME_ORIGINAL = 0x9291
+## pattern of DateTimeOriginal tag value, optionally followed by sub-second digits, see read_exif_date_time_original()
+exif_date_time_re = re.compile(r'^\d{4}:\d{2}:\d{2} \d{2}:\d{2}:\d{2}(?:\.\d+)?$')
+
+def read_exif_date_time_original(header, sub_sec=False):
+    ''' Get the EXIF DateTimeOriginal tag value (e.g. '2017:01:12 20:34:21') from JPEG file header.
+
+        Minimal alternative to exifread - jumps from IFD0 straight to EXIF IFD and reads just that one tag.
+        With sub_sec set, the SubSecTimeOriginal tag value gets appended after a dot (e.g. '2017:01:12 20:34:21.045'),
+        if there is a valid one.
+        Returns None if there is no EXIF segment at all. Raises RuntimeError on anything else unexpected,
+        including a missing tag or EXIF data not contained within the header, so that exifread can be
+        used as a fallback.
+    '''
+    view = memoryview(header)
+    header_size = len(view)
+
+    # search for APP1 segment containing EXIF data, following SOI marker
+    position = 2
+    while True:
+        if position + 4 > header_size:
+            raise RuntimeError('Could not find EXIF segment within JPEG header')
+        (marker, segment_size) = struct.unpack_from('>HH', view, position)
+        if marker == 0xffff:  # fill byte
+            position += 1
+            continue
+        elif marker & 0xff00 != 0xff00:
+            raise RuntimeError('Read data is not a valid JPEG marker')
+        elif marker in (0xffda, 0xffd9):  # start of scan or end of image
+            if header.find(b'Exif', 0, position) != -1:
+                raise RuntimeError('Skipped EXIF segment apparently due to invalid segment size')
+            return None
+        elif 0xffd0 <= marker <= 0xffd7 or marker == 0xff01:  # standalone marker
+            position += 2
+            continue
+        elif marker == 0xffe1 and view[position + 4:position + 8] == b'Exif':
+            break  # found
+        position += 2 + segment_size
+
+    tiff_offset = position + 10
+    segment_end = position + 2 + segment_size
+    if segment_end > header_size:
+        raise RuntimeError('EXIF segment exceeds JPEG header')
+
+    byte_order = view[tiff_offset:tiff_offset + 2]
+    if byte_order == b'II':
+        byte_order = '<'
+    elif byte_order == b'MM':
+        byte_order = '>'
+    else:
+        raise RuntimeError('Invalid TIFF header byte order')
+
+    def find_ifd_entry(ifd_offset, tag):
+        position = tiff_offset + ifd_offset
+        if position + 2 > segment_end:
+            raise RuntimeError('IFD offset exceeds EXIF segment')
+        (entry_count,) = struct.unpack_from(byte_order + 'H', view, position)
+        position += 2
+        if position + entry_count * 12 > segment_end:
+            raise RuntimeError('IFD entries exceed EXIF segment')
+        for position in range(position, position + entry_count * 12, 12):
+            (entry_tag, field_type, value_count, value) = struct.unpack_from(byte_order + 'HHII', view, position)
+            if entry_tag == tag:
+                return field_type, value_count, value, position + 8
+        return None
+
+    try:
+        (magic, ifd0_offset) = struct.unpack_from(byte_order + 'HI', view, tiff_offset + 2)
+    except struct.error:
+        raise RuntimeError('Failed to unpack TIFF header')
+    if magic != 42:
+        raise RuntimeError('Invalid TIFF header magic number')
+
+    exif_ifd_entry = find_ifd_entry(ifd0_offset, EXIF_TAG_EXIF_IFD_POINTER)
+    if exif_ifd_entry is None:
+        raise RuntimeError('Could not find EXIF IFD pointer')
+    if exif_ifd_entry[0] not in (4, 13):  # LONG or IFD
+        raise RuntimeError('Unexpected type of EXIF IFD pointer')
+
+    def read_ascii_value(ifd_entry, tag_name):
+        (field_type, value_count, value_offset, value_position) = ifd_entry
+        if field_type != 2 or value_count == 0:  # non-empty ASCII
+            raise RuntimeError('Unexpected type of %s tag' % tag_name)
+
+        if value_count > 4:
+            value_position = tiff_offset + value_offset
+        if value_position + value_count > segment_end:
+            raise RuntimeError('%s tag value exceeds EXIF segment' % tag_name)
+
+        try:
+            return bytes(view[value_position:value_position + value_count]).split(b'\0', 1)[0].decode('utf-8')
+        except UnicodeDecodeError:
+            raise RuntimeError('Failed to decode %s tag value' % tag_name)
+
+    date_time_entry = find_ifd_entry(exif_ifd_entry[2], EXIF_TAG_DATE_TIME_ORIGINAL)
+    if date_time_entry is None:
+        raise RuntimeError('Could not find DateTimeOriginal tag')
+    date_time_original = read_ascii_value(date_time_entry, 'DateTimeOriginal')
+
+    if sub_sec is True:
+        ## optional, so neither a missing nor an invalid tag is an error
+        sub_sec_entry = find_ifd_entry(exif_ifd_entry[2], EXIF_TAG_SUB_SEC_TIME_ORIGINAL)
+        if sub_sec_entry is not None:
+            try:
+                sub_sec_original = read_ascii_value(sub_sec_entry, 'SubSecTimeOriginal').strip()
+            except RuntimeError:
+                sub_sec_original = ''
+            if sub_sec_original.isdigit():
+                return date_time_original + '.' + sub_sec_original
+    return date_time_original
+
+
 ## https://www.programiz.com/python-programming/examples/hash-file
 ## https://gist.github.com/aunyks/042c2798383f016939c40aa1be4f4aaf
-import hashlib
+## imported by new_hash(), i.e. for files colliding by new file name only
+# import hashlib
 
 # Specify how many bytes of the file you want to open at a time
 BLOCKSIZE = 65536
@@ -166,12 +534,53 @@ BLOCKSIZE = 65536
 def read_sha1_hexhash(filename):
    """"This function returns the SHA-1 hash of the file passed into it"""
 
-   # make a hash object
-   h = hashlib.sha1()
+   return read_hexhash(filename, 'sha1')
+
+
+## pip install xxhash - optional, for faster comparison of duplicate files
+## https://github.com/ifduyue/python-xxhash
+## imported by new_hash(), i.e. for files colliding by new file name only (and by is_hash_available())
+# import xxhash
+
+## hash algorithms for comparing files, selectable by option --hash
+HASH_ALGORITHMS = ('sha1', 'blake2b', 'xxhash')
+
+# Specify how many bytes of the file head and tail are hashed for quick comparison of files of equal size
+PARTIAL_HASH_SIZE = 4 * 1024 * 1024
+
+def is_hash_available(algorithm):
+    ''' Tells whether given hash algorithm can be used, i.e. is not an optional one (xxhash) which is not installed. '''
+    if algorithm == 'xxhash':
+        try:
+            import xxhash
+        except ImportError:
+            return False
+    return True
+
+
+def new_hash(algorithm):
+    if algorithm == 'xxhash':
+        import xxhash
+        return xxhash.xxh3_128()
+    import hashlib
+    return hashlib.new(algorithm)
+
+
+def read_hexhash(filename, algorithm='sha1', size=None):
+   """"This function returns the hash of the file passed into it, using given algorithm.
+
+       With size given, only the file head and tail (of size bytes each) get hashed."""
+
+   h = new_hash(algorithm)
 
-   # open file for reading in binary mode
    with open(filename,'rb') as file:
 
+       if size is not None:
+           h.update(file.read(size))
+           file.seek(-size, 2)  ## os.SEEK_END
+           h.update(file.read(size))
+           return h.hexdigest()
+
        # loop till the end of the file
        chunk = 0
        while chunk != b'':
@@ -182,287 +591,2531 @@ def read_sha1_hexhash(filename):
    return h.hexdigest()
 
 
-files_count = 0
-processed_count = 0
-renamed_count = 0
-skipped_count = 0
-failed_count = 0
+class FileComparer:
+    ''' Compares files for identity in tiers - by size, by hash of head and tail, and only then by hash of the whole content.
+
+        Computed hashes are remembered (by file path, size and modification time) for the lifetime of the comparer, i.e. a single
+        pass of the plan and apply stages (or a single batch in watch mode), so a file colliding with several others is read just once.
+    '''
+
+    def __init__(self, algorithm='sha1', stats=None):
+        self.algorithm = algorithm
+        self.stats = stats if stats is not None else RunStats()
+        self.hexhashes = {}
+
+    def read_hexhash(self, file_path, file_stat, partial):
+        size = None
+        if partial is True:
+            ## for small file, hash of head and tail would not be any cheaper than of the whole content
+            if file_stat.st_size <= 2 * PARTIAL_HASH_SIZE:
+                partial = False
+            else:
+                size = PARTIAL_HASH_SIZE
+
+        key = (str(file_path), file_stat.st_size, file_stat.st_mtime_ns, partial)
+        if key not in self.hexhashes:
+            started = time.perf_counter()
+            self.hexhashes[key] = read_hexhash(file_path, self.algorithm, size)
+            self.stats.add_stage('hash', started, file_stat.st_size if size is None else 2 * size)
+        return self.hexhashes[key]
+
+    def are_identical(self, file_path, other_file_path):
+        file_stat = os.stat(file_path)
+        other_file_stat = os.stat(other_file_path)
+        if file_stat.st_size != other_file_stat.st_size:
+            return False
+        for partial in (True, False):
+            if self.read_hexhash(file_path, file_stat, partial) != self.read_hexhash(other_file_path, other_file_stat, partial):
+                return False
+        return True
+
+
+## https://docs.python.org/3/library/sqlite3.html
+## imported by MetadataCache, i.e. unless option --no-cache is set
+# import sqlite3
+
+## default name of the metadata cache file, created in the working directory path
+CACHE_FILE_NAME = '.media-auto-renamer.cache'
+## to be increased whenever extraction of date-time strings changes its results, so as to drop stale entries
+CACHE_VERSION = 5
+## number of cache updates written per single transaction
+CACHE_COMMIT_BATCH = 1000
+
+class MetadataCache:
+    ''' Persistent cache of extracted date-time strings (or extraction errors), stored in SQLite database file.
+
+        Entries are keyed by file path and remain valid as long as file size, modification time and inode
+        do not change, and the same metadata sources are used (option --date-source). Not thread-safe - to be used by the main thread only.
+        Opened read-only (e.g. in dry-run mode), an existing cache is used for lookups only, and an outdated one not at all.
+    '''
+
+    def __init__(self, cache_path, read_only=False, stats=None):
+        self.cache_path = pathlib.Path(cache_path).resolve()
+        self.read_only = read_only
+        self.stats = stats if stats is not None else RunStats()
+        self.outdated = False
+        self.hit_count = 0
+        self.miss_count = 0
+        self.pending_count = 0
+
+        import sqlite3
+        if read_only is True:
+            self.connection = sqlite3.connect(self.cache_path.as_uri() + '?mode=ro', uri=True)
+            self.outdated = self.connection.execute('PRAGMA user_version').fetchone()[0] != CACHE_VERSION
+            return
+        self.connection = sqlite3.connect(str(self.cache_path))
+        self.connection.execute('PRAGMA synchronous = OFF')
+        if self.connection.execute('PRAGMA user_version').fetchone()[0] != CACHE_VERSION:
+            self.connection.execute('DROP TABLE IF EXISTS metadata')
+            self.connection.execute('PRAGMA user_version = %d' % CACHE_VERSION)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS metadata ('
+            'path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, '
+            'media_type TEXT, sources TEXT, date_time_str TEXT, error TEXT, date_source TEXT)')
+        self.connection.commit()
+
+    def is_cache_file(self, file_path):
+        ''' Tells whether given path is the cache database file itself (or its journal). '''
+        return str(file_path).startswith(str(self.cache_path))
+
+    def lookup(self, file_path, file_stat, media_type, sources):
+        ''' Returns cached result of extract_date_time_str() for given file and metadata sources, or None on cache miss. '''
+        if self.outdated is True:
+            self.miss_count += 1
+            return None
+        started = time.perf_counter()
+        row = self.connection.execute('SELECT size, mtime_ns, inode, media_type, sources, date_time_str, error, date_source FROM metadata WHERE path = ?', (str(file_path),)).fetchone()
+        self.stats.add_stage('cache', started)
+        if row is None or row[:5] != (file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino, media_type, ','.join(sources)):
+            self.miss_count += 1
+            return None
+        self.hit_count += 1
+        ## nothing gets read from the file, so there is no strategy to report
+        return row[5], row[6], None, row[7]
+
+    def store(self, file_path, file_stat, media_type, sources, result):
+        ''' Stores result of extract_date_time_str() for given file and metadata sources; returns the result for convenience. '''
+        if self.read_only is True:
+            return result
+        started = time.perf_counter()
+        self.connection.execute('INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (str(file_path), file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino, media_type, ','.join(sources), result[0], result[1], result[3]))
+        self.commit_batch()
+        self.stats.add_stage('cache', started)
+        return result
+
+    def rename(self, file_path, new_file_path):
+        ''' Moves cached entry along with renamed file, which keeps its size, modification time and inode. '''
+        self.connection.execute('UPDATE OR REPLACE metadata SET path = ? WHERE path = ?', (str(new_file_path), str(file_path)))
+        self.commit_batch()
+
+    def commit_batch(self):
+        self.pending_count += 1
+        if self.pending_count >= CACHE_COMMIT_BATCH:
+            self.commit()
+
+    def commit(self):
+        self.connection.commit()
+        self.pending_count = 0
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+## default name of the rename journal file, created in the working directory path
+JOURNAL_FILE_NAME = '.media-auto-renamer.journal'
+## version of the rename journal file format, written to its header record
+JOURNAL_VERSION = 1
+## number of renames recorded per single flush (fsync) of the journal
+JOURNAL_BATCH = 256
+
+class RenameJournal:
+    ''' Write-ahead journal of renames, stored as JSON lines file, allowing to resume an interrupted run or undo it.
+
+        Renames are collected in batches; intents of all the renames of a batch get flushed to disk (fsync)
+        before any of them is applied, and each applied rename is recorded as done afterwards. Directories with all
+        their entries (including sub-directories) processed are recorded as done too, so that resuming an interrupted run
+        does not even enter them again; recovery takes time proportional to the journal length, not the directory tree size.
+        Paths are recorded relative to the directory path. Not thread-safe - to be used by the main thread only.
+    '''
+
+    def __init__(self, journal_path, dir_path, command=None, records=None, stats=None):
+        self.journal_path = pathlib.Path(journal_path).resolve()
+        self.dir_path = dir_path
+        self.stats = stats if stats is not None else RunStats()
+        self.batch = []
+        self.batch_sources = set()
+        self.batch_dirs = []
+        self.done_dirs = set()
+        self.done_renames = {}
+
+        if records is None:
+            self.file = open(self.journal_path, 'w', encoding='utf-8', newline='\n')
+            self.write_record(journal=JOURNAL_VERSION, path=str(dir_path), command=command)
+        else:
+            ## resuming - renames applied but not recorded as done before interruption get recorded now
+            for (source, target) in get_journal_renames(records, dir_path, pending=True):
+                self.done_renames[source] = target
+            self.done_dirs = {record['path'] for record in records if record.get('op') == 'directory'}
+            ## anything past the header and records read (i.e. the record truncated by interruption) gets dropped, not to be appended to
+            with open(self.journal_path, 'rb+') as journal_file:
+                for _ in range(1 + len(records)):
+                    line = journal_file.readline()
+                journal_file.truncate(journal_file.tell())
+                if not line.endswith(b'\n'):
+                    journal_file.write(b'\n')
+            self.file = open(self.journal_path, 'a', encoding='utf-8', newline='\n')
+            done_sources = {record['source'] for record in records if record.get('op') == 'done'}
+            for (source, target) in self.done_renames.items():
+                if source not in done_sources:
+                    self.write_record(op='done', source=source, target=target)
+            self.sync()
+
+    def relative(self, path):
+        return path.relative_to(self.dir_path).as_posix()
+
+    def is_journal_file(self, path):
+        ''' Tells whether given path is the journal file itself. '''
+        return path == self.journal_path
+
+    def is_directory_done(self, dir_path):
+        return self.relative(dir_path) in self.done_dirs
+
+    def is_rename_done(self, file_path):
+        return self.relative(file_path) in self.done_renames
+
+    def write_record(self, **record):
+        self.file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+
+    def sync(self):
+        started = time.perf_counter()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.stats.add_stage('journal', started)
+
+    def add_rename(self, file_path, new_file_path, item=None):
+        ''' Adds rename to current batch; returns True once the batch is full, i.e. to be applied. '''
+        self.batch.append((file_path, new_file_path, item))
+        self.batch_sources.add(str(file_path).casefold())
+        return len(self.batch) >= JOURNAL_BATCH
+
+    def is_batched_source(self, file_path):
+        ''' Tells whether given path is the file path of a rename in current batch, i.e. to be freed before the renames batched after it. '''
+        return str(file_path).casefold() in self.batch_sources
+
+    def add_directory(self, dir_path):
+        ''' Records directory as done, right after the renames already batched. '''
+        self.batch_dirs.append(self.relative(dir_path))
+        if not self.batch:
+            self.apply_batch(None)
+
+    def apply_batch(self, rename):
+        ''' Applies batched renames with given function (returning whether renamed), recording them in the journal.
+
+            Returns items of the batched renames.
+        '''
+        items = []
+        if self.batch:
+            for (file_path, new_file_path, item) in self.batch:
+                self.write_record(op='rename', source=self.relative(file_path), target=self.relative(new_file_path))
+            self.sync()
+            for (file_path, new_file_path, item) in self.batch:
+                if rename(file_path, new_file_path, item):
+                    self.write_record(op='done', source=self.relative(file_path), target=self.relative(new_file_path))
+                items.append(item)
+        for dir_path in self.batch_dirs:
+            if dir_path not in self.done_dirs:
+                self.write_record(op='directory', path=dir_path)
+        self.batch = []
+        self.batch_sources = set()
+        self.batch_dirs = []
+        return items
+
+    def close(self, completed):
+        ''' Closes the journal, recording the run as completed (i.e. not to be resumed) if so. '''
+        if completed is True:
+            self.write_record(op='end')
+        self.sync()
+        self.file.close()
+
+
+def read_journal(journal_path):
+    ''' Read rename journal; returns its header (with the directory path and command of the run) and list of its records.
+
+        Ignores the last record, if truncated by interruption.
+    '''
+    with open(journal_path, 'r', encoding='utf-8') as journal_file:
+        header = json.loads(journal_file.readline() or 'null')
+        if not isinstance(header, dict) or header.get('journal') != JOURNAL_VERSION:
+            raise ValueError('not a rename journal file of version %d' % JOURNAL_VERSION)
+        records = []
+        for line in journal_file:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+    return header, records
+
+
+def get_journal_state(records):
+    ''' Returns state of the run recorded by rename journal: 'completed', 'interrupted' or 'undone'. '''
+    ops = {record.get('op') for record in records}
+    ## even if undone partially
+    if 'undone' in ops or 'undo' in ops:
+        return 'undone'
+    if 'end' in ops:
+        return 'completed'
+    return 'interrupted'
+
+
+def get_journal_renames(records, dir_path, pending=False):
+    ''' Returns list of tuples (source, target) of renames done according to journal records (in the order of applying).
+
+        With pending set, renames intended but not recorded as done get verified in the file system and included
+        if applied actually, i.e. the target exists while the source does not.
+    '''
+    renames = collections.OrderedDict()
+    intents = collections.OrderedDict()
+    for record in records:
+        op = record.get('op')
+        if op == 'rename':
+            intents[record['source']] = record['target']
+        elif op == 'done':
+            intents.pop(record['source'], None)
+            renames[record['source']] = record['target']
+        elif op == 'undo':
+            renames.pop(record['source'], None)
+    if pending is True:
+        for (source, target) in intents.items():
+            if dir_path.joinpath(target).exists() and not dir_path.joinpath(source).exists():
+                renames[source] = target
+    return list(renames.items())
+
+
+## stages timed by RunStats, in the order reported: directory listing, building the media types lookup table,
+## opening and reading file headers, parsing by each of EXIF_STRATEGY_* and MOV_STRATEGY_* strategies (or failing to),
+## metadata cache lookups and updates, hashing colliding files, renaming and flushing (fsync) the rename journal
+STAT_STAGES = ('scan', 'names', 'mimetypes', 'read', 'exif', 'exifread', 'exif-failed', 'moov-header', 'moov-tail', 'moov-walk', 'moov-failed', 'cache', 'hash', 'rename', 'journal')
+
+## percentiles of per-file extraction latency, as reported by RunStats
+STAT_PERCENTILES = (50, 90, 99)
+## maximum number of per-file extraction latencies kept by RunStats, i.e. 8 bytes each
+STAT_LATENCY_SAMPLES = 100000
+
+class RunStats:
+    ''' Counters and timings of a single run, reported by the summary line and (with option --stats) by the stats report.
+
+        File counters are updated by the main thread only; stage timings and per-file extraction latencies also from
+        within extraction worker threads, hence under a lock. Latencies are kept in an array of doubles, up to STAT_LATENCY_SAMPLES
+        of them; beyond, a uniform random sample of them (reservoir sampling), so that a long-lived Renamer does not keep
+        growing it.
+    '''
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.files_count = 0
+        self.processed_count = 0
+        self.renamed_count = 0
+        self.skipped_count = 0
+        self.failed_count = 0
+        self.trusted_count = 0
+        ## numbers of date-time strings found by each of EXIF_STRATEGY_* and MOV_STRATEGY_* strategies
+        self.strategy_counts = collections.Counter()
+        ## numbers of date-time strings determined from each of DATE_SOURCE_* sources, including metadata cache hits
+        self.source_counts = collections.Counter()
+        ## cumulative wall time, number of calls and bytes read, by stage (see STAT_STAGES)
+        self.stage_seconds = collections.Counter()
+        self.stage_calls = collections.Counter()
+        self.stage_bytes = collections.Counter()
+        ## time taken by extract_date_time_str() for each file (or for a sample of the files), in seconds
+        self.latencies = array.array('d')
+        self.latency_count = 0
+        self.latency_max = None
+        self.randomizer = None
+        ## total of stage_bytes, kept apart so as to be read by the main thread without the lock, see Progress
+        self.bytes_read = 0
+        self.lock = threading.Lock()
+
+    def add_stage(self, stage, started, size=0):
+        ''' Adds single call of given stage, started at given time.perf_counter() value, having read given number of bytes. '''
+        seconds = time.perf_counter() - started
+        with self.lock:
+            self.stage_seconds[stage] += seconds
+            self.stage_calls[stage] += 1
+            if size:
+                self.stage_bytes[stage] += size
+                self.bytes_read += size
+
+    def add_bytes(self, stage, size):
+        with self.lock:
+            self.stage_bytes[stage] += size
+            self.bytes_read += size
+
+    def add_latency(self, started):
+        seconds = time.perf_counter() - started
+        with self.lock:
+            self.latency_count += 1
+            if self.latency_max is None or seconds > self.latency_max:
+                self.latency_max = seconds
+            if len(self.latencies) < STAT_LATENCY_SAMPLES:
+                self.latencies.append(seconds)
+                return
+            if self.randomizer is None:
+                import random
+                self.randomizer = random.Random()
+            index = self.randomizer.randrange(self.latency_count)
+            if index < STAT_LATENCY_SAMPLES:
+                self.latencies[index] = seconds
+
+    def get_percentiles(self):
+        ''' Returns per-file extraction latencies at STAT_PERCENTILES (nearest-rank), in seconds, or an empty dictionary if none. '''
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return {}
+        return {'p%d' % percentile: latencies[min(len(latencies) - 1, len(latencies) * percentile // 100)] for percentile in STAT_PERCENTILES}
+
+    def get_report(self):
+        ''' Returns the stats report as a dictionary, suitable for writing as JSON. '''
+        ## including stages having read bytes without any call timed, e.g. moov-tail read, once the lookup in the tail fails
+        stages = sorted(set(self.stage_calls) | set(self.stage_bytes), key=lambda stage: STAT_STAGES.index(stage) if stage in STAT_STAGES else len(STAT_STAGES))
+        return {
+            'seconds': time.perf_counter() - self.started,
+            'files': self.files_count,
+            'processed': self.processed_count,
+            'renamed': self.renamed_count,
+            'skipped': self.skipped_count,
+            'failed': self.failed_count,
+            'trusted': self.trusted_count,
+            'strategies': dict(sorted(self.strategy_counts.items())),
+            'sources': dict(sorted(self.source_counts.items())),
+            'stages': {stage: {'seconds': self.stage_seconds[stage], 'calls': self.stage_calls[stage], 'bytes': self.stage_bytes[stage]} for stage in stages},
+            'latency': dict(self.get_percentiles(), count=self.latency_count, max=self.latency_max),
+        }
+
+    def print_report(self, logger, format='text'):
+        ''' Writes the stats report through given logger, regardless of its level. '''
+        report = self.get_report()
+        if format == 'json':
+            logger.write(json.dumps(report))
+            return
+
+        logger.write('Stats: wall time: %.3f s, files per second: %.1f' % (report['seconds'], report['files'] / report['seconds'] if report['seconds'] else 0))
+        for (stage, stage_report) in report['stages'].items():
+            per_call = stage_report['seconds'] * 1e6 / stage_report['calls'] if stage_report['calls'] else 0.0
+            logger.write('  %-12s: %10.3f s, %9d calls, %8.1f us per call, %12d bytes read' % (stage, stage_report['seconds'], stage_report['calls'], per_call, stage_report['bytes']))
+        if report['latency']['count']:
+            logger.write('  Per-file extraction latency: %s, max: %.3f ms (%d files)' % (', '.join('%s: %.3f ms' % (name, report['latency'][name] * 1e3) for name in report['latency'] if name.startswith('p')), report['latency']['max'] * 1e3, report['latency']['count']))
+
+## levels of messages logged by Logger; messages below the current level (see options -q and -v) are not even formatted
+LOG_DEBUG = 10
+LOG_INFO = 20
+LOG_WARNING = 30
+LOG_ERROR = 40
+## level of the final summary, logged regardless of option -q
+LOG_SUMMARY = 50
+LOG_LEVEL_NAMES = {LOG_DEBUG: 'debug', LOG_INFO: 'info', LOG_WARNING: 'warning', LOG_ERROR: 'error', LOG_SUMMARY: 'summary'}
+
+## number of lines kept buffered by Logger before writing them out at once, and the longest time to keep them, in seconds
+LOG_BUFFER_LINES = 256
+LOG_BUFFER_SECONDS = 0.25
+## interval of reporting messages suppressed by Logger (see option --log-limit), in seconds
+LOG_SUPPRESSED_SECONDS = 10.0
+
+## pattern used only for leaving the level prefix (e.g. '  WARNING: ' or '  ERROR! ') out of messages logged as JSON
+log_prefix_re = re.compile(r'^\s*(?:DEBUG|INFO|WARNING|ERROR)[:!] ')
+
+class Logger:
+    ''' Leveled logger writing lines through a buffer, either as plain text or as JSON lines (option --log-format).
+
+        Each message is given as %-format string and its arguments, to be formatted only if actually written, along with
+        its event name (e.g. 'already-prefixed'). With limit given (option --log-limit), only that many messages
+        of each event get written; the rest are counted and reported every LOG_SUPPRESSED_SECONDS and at close.
+        Buffered lines get written out once LOG_BUFFER_LINES are collected or LOG_BUFFER_SECONDS have passed since
+        the last write, and at close. Not thread-safe - to be used by the main thread only.
+    '''
+
+    def __init__(self, stream=None, level=LOG_INFO, format='text', limit=None):
+        ## None stands for current sys.stdout, looked up on every write
+        self.stream = stream
+        self.level = level
+        self.format = format
+        self.limit = limit
+        self.lines = []
+        self.flushed = time.monotonic()
+        ## progress line to be cleared before writing any lines, so that they do not get mixed up on a terminal
+        self.progress = None
+        ## numbers of messages logged (within limit or not) and suppressed since last reported, by event
+        self.event_counts = collections.Counter()
+        self.suppressed_counts = collections.Counter()
+        self.suppressed_reported = self.flushed
+
+    def is_enabled(self, level):
+        return level >= self.level
+
+    def log(self, level, event, message, *args):
+        if level < self.level:
+            return
+        if self.limit is not None and level < LOG_SUMMARY:
+            self.event_counts[event] += 1
+            if self.event_counts[event] > self.limit:
+                self.suppressed_counts[event] += 1
+                if time.monotonic() - self.suppressed_reported >= LOG_SUPPRESSED_SECONDS:
+                    self.report_suppressed()
+                return
+        if args:
+            message %= args
+        if self.format == 'json':
+            message = json.dumps({'time': round(time.time(), 3), 'level': LOG_LEVEL_NAMES[level], 'event': event, 'message': log_prefix_re.sub('', message).rstrip(' .')}, ensure_ascii=False)
+        self.write(message)
+
+    def debug(self, event, message, *args):
+        self.log(LOG_DEBUG, event, message, *args)
+
+    def info(self, event, message, *args):
+        self.log(LOG_INFO, event, message, *args)
+
+    def warning(self, event, message, *args):
+        self.log(LOG_WARNING, event, message, *args)
+
+    def error(self, event, message, *args):
+        self.log(LOG_ERROR, event, message, *args)
+
+    def write(self, line):
+        ''' Writes given line as is, through the buffer. '''
+        self.lines.append(line)
+        if len(self.lines) >= LOG_BUFFER_LINES or time.monotonic() - self.flushed >= LOG_BUFFER_SECONDS:
+            self.flush()
+
+    def flush(self):
+        stream = self.stream if self.stream is not None else sys.stdout
+        if self.lines:
+            if self.progress is not None:
+                self.progress.clear()
+            self.lines.append('')
+            stream.write('\n'.join(self.lines))
+            self.lines.clear()
+        stream.flush()
+        self.flushed = time.monotonic()
+
+    def report_suppressed(self):
+        suppressed_counts = sorted(self.suppressed_counts.items())
+        self.suppressed_counts.clear()
+        self.suppressed_reported = time.monotonic()
+        for (event, count) in suppressed_counts:
+            ## logged at the level of summary, so as not to be suppressed itself
+            self.log(LOG_SUMMARY, 'suppressed', '  INFO: Suppressed %d more messages of event "%s" (%d in total) ... ', count, event, self.event_counts[event])
+
+    def close(self):
+        if self.suppressed_counts:
+            self.report_suppressed()
+        self.flush()
+
+## minimum interval of rewriting the progress line on a terminal, and of writing a new progress line elsewhere, in seconds
+PROGRESS_INTERVAL = 0.5
+PROGRESS_LINE_INTERVAL = 10.0
+
+class Progress:
+    ''' Progress line (option --progress): number of files processed (out of total, if counted beforehand, see count_files()),
+        files and bytes of metadata read per second and estimated time left.
+
+        Updated by the main thread once per file processed, but written (to stderr) at most every PROGRESS_INTERVAL seconds,
+        rewritten in place on a terminal; elsewhere, written as a new line every PROGRESS_LINE_INTERVAL seconds.
+        Counts files processed by the main thread, i.e. after their extraction by any number of worker threads.
+    '''
+
+    def __init__(self, stats, stream=None, total=None):
+        self.stats = stats
+        self.stream = stream if stream is not None else sys.stderr
+        self.total = total
+        self.terminal = self.stream.isatty()
+        self.interval = PROGRESS_INTERVAL if self.terminal else PROGRESS_LINE_INTERVAL
+        self.restart()
+        ## length of the line currently shown on a terminal, to be overwritten
+        self.width = 0
+        self.closed = False
+
+    def restart(self, total=None):
+        ''' Starts measuring rates (again), e.g. once files have been counted. '''
+        self.total = total if total is not None else self.total
+        self.started = self.updated = time.monotonic()
+        self.started_bytes = self.stats.bytes_read
+
+    def update(self, done, force=False):
+        now = time.monotonic()
+        if force is not True and now - self.updated < self.interval:
+            return
+        self.updated = now
+
+        seconds = max(now - self.started, 1e-9)
+        line = 'Files: %d' % done
+        if self.total is not None:
+            line += ' of %d (%.1f%%)' % (self.total, 100.0 * done / self.total if self.total else 100.0)
+        line += ', %.1f files/s, %.2f MB/s of metadata read' % (done / seconds, (self.stats.bytes_read - self.started_bytes) / seconds / 1e6)
+        if self.total is not None and done > 0:
+            line += ', ETA: %s' % datetime.timedelta(seconds=round(max(self.total - done, 0) * seconds / done))
+        self.show(line)
+
+    def update_count(self, count):
+        ''' Reports number of files counted so far, see count_files(). '''
+        now = time.monotonic()
+        if now - self.updated >= self.interval:
+            self.updated = now
+            self.show('Counting files: %d ... ' % count)
+
+    def show(self, line):
+        if self.terminal:
+            self.stream.write('\r' + line.ljust(self.width))
+            self.width = len(line)
+        else:
+            self.stream.write(line + '\n')
+        self.stream.flush()
+
+    def clear(self):
+        if self.width > 0:
+            self.stream.write('\r' + ' ' * self.width + '\r')
+            self.stream.flush()
+            self.width = 0
+
+    def close(self, done):
+        ''' Shows the final progress line, to be left on a terminal; does nothing if closed already. '''
+        if self.closed is True:
+            return
+        self.closed = True
+        self.update(done, force=True)
+        if self.terminal:
+            self.stream.write('\n')
+            self.stream.flush()
+            self.width = 0
+
+
+class RunContext:
+    ''' Logger, counters and progress line (if any) of a single run, either of main() or of a Renamer.
+
+        Passed along to all the stages as options.context, including worker threads extracting date-time strings (its
+        RunStats being thread-safe), so that any number of runs can go on at once, each one logging and counting on its own.
+    '''
+
+    __slots__ = ('logger', 'stats', 'progress')
+
+    def __init__(self, logger, stats, progress=None):
+        self.logger = logger
+        self.stats = stats
+        self.progress = progress
 
 ## pattern used only for verifying new date-time string, not for formatting
 date_time_verify_re = re.compile(r'^\d{8}_\d{6}$')
-## pattern used only for finding any date-time string in current file name, not for formatting
+## pattern used only for finding the first date-time string in current file name, not for formatting, see analyze_file_names();
+## matches have groups (prefix, date_time_str). The shortest prefix gets tried first, so no name gets backtracked through
+## from its end, and names without any underscore are ruled out by the lookahead. There is no alternation of camera
+## file naming schemes (e.g. "IMG_", "PXL_"): the shortest prefix matches those already, and trying them first
+## is not measurably faster (see bench/bench_names.py)
 # date_time_search_re = re.compile('^.*(\d{8}_\d{6}).*$')
-date_time_search_re = re.compile(r'^(.*)(\d{8}_\d{6}).*')
+# date_time_search_re = re.compile(r'^(.*)(\d{8}_\d{6}).*')
+date_time_search_re = re.compile(r'^(?=[^_]*_)(.*?)(\d{8}_\d{6})')
 
-def process_directory(dir_path, dir_depth, options):
-    global files_count, processed_count, renamed_count, skipped_count, failed_count
+## size of file header (prefix) read at once, expected to contain the metadata of most media files
+HEADER_SIZE = 65536
 
-    if options.max_depth > 0:
-        print('Processing directory path "%s" recursively at depth %d ... ' % (dir_path.resolve(), dir_depth))
-    else:
-        print('Processing directory path "%s" non-recursively ... ' % dir_path.resolve())
+## QuickTime/ISO base media file format atom types, which a MOV/MP4 file is expected to start with
+MOV_LEADING_ATOM_TYPES = (b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide', b'pnot', b'uuid')
+
+def sniff_media_type(header):
+    ''' Determine media file type by magic bytes at the beginning of file header.
+
+        Returns 'jpeg' for JPEG image, 'mov' for MOV/MP4 video, or None for any other file.
+    '''
+    if header[:3] == b'\xff\xd8\xff':
+        return 'jpeg'
+    if header[4:8] in MOV_LEADING_ATOM_TYPES:
+        return 'mov'
+    return None
+
+
+class HeaderBufferedFile:
+    ''' Read-only file object serving reads from already read file header, whenever possible.
+
+        Only reads beyond the header fall back to seeking and reading the underlying file.
+    '''
+
+    def __init__(self, file, header):
+        self.file = file
+        self.header = header
+        ## header shorter than requested means there is nothing more in the file
+        self.complete = len(header) < HEADER_SIZE
+        self.position = 0
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=0):
+        if whence == 1:  ## os.SEEK_CUR
+            offset += self.position
+        elif whence == 2:  ## os.SEEK_END
+            offset += len(self.header) if self.complete else self.file.seek(0, 2)
+        self.position = offset
+        return self.position
+
+    def read(self, size=-1):
+        end = len(self.header) if self.complete else None
+        if size is not None and size >= 0:
+            end = self.position + size if end is None else min(end, self.position + size)
+
+        data = self.header[self.position:end]
+        if (end is None or end > len(self.header)) and not self.complete:
+            self.file.seek(self.position + len(data))
+            data += self.file.read(-1 if end is None else end - self.position - len(data))
+
+        self.position += len(data)
+        return data
+
+
+## error codes reported by extract_date_time_str()
+EXTRACT_ERROR_NOT_JPEG = 'not-jpeg'
+EXTRACT_ERROR_NO_EXIF = 'no-exif'
+EXTRACT_ERROR_MOV = 'mov'
+EXTRACT_ERROR_NO_DATE = 'no-date'
+
+## strategies of reading EXIF data, as reported by extract_date_time_str()
+EXIF_STRATEGY_NATIVE = 'exif'
+EXIF_STRATEGY_EXIFREAD = 'exifread'
+
+def extract_date_time_str(file_path, media_type, check_only=False, sources=(DATE_SOURCE_MVHD,), stats=None):
+    ''' Extract original/creation date-time string from image or video file metadata.
+
+        Opens the file just once and reads its header of HEADER_SIZE bytes, which is used both for
+        determining the file type and for parsing the metadata; more is read only if needed.
+        Neither logs anything nor updates any counters, but adds stage timings to given RunStats (if any) under its lock,
+        so that it can be run within worker threads.
+        Video file metadata sources (DATE_SOURCE_MVHD and/or DATE_SOURCE_KEYS) are tried in given order.
+        Returns tuple (date_time_str, error, strategy, source), where error is None on success or one of EXTRACT_ERROR_* codes,
+        date_time_str is followed by sub-second digits after a dot if recorded (by the EXIF SubSecTimeOriginal tag),
+        strategy tells how the date-time string was found (one of EXIF_STRATEGY_* or MOV_STRATEGY_*), if at all,
+        and source where from (one of DATE_SOURCE_*).
+        With check_only set, image file header gets verified only and date_time_str is None on success.
+    '''
+    started = time.perf_counter()
+    with open(file_path, 'rb') as media_file:
+        header = media_file.read(HEADER_SIZE)
+        if stats is not None:
+            stats.add_stage('read', started, len(header))
+        header_type = sniff_media_type(header)
+        # print('  DEBUG: header_type=%s' % (header_type,))
+
+        if media_type == 'image':
+            if header_type != 'jpeg':
+                return None, EXTRACT_ERROR_NOT_JPEG, None, None
+
+            if check_only is True:
+                return None, None, None, None
+
+            # exif_tags = exifread.process_file(img_file)
+            # for tag_key in exif_tags.keys():
+            #     if tag_key in ['JPEGThumbnail']:
+            #         print('  EXIF tag: [%s], value: <binary-image-thumbnail> ' % (tag_key,))
+            #     else:
+            #         print('  EXIF tag: [%s], value: [%s] ' % (tag_key, exif_tags[tag_key]))
+
+            started = time.perf_counter()
+            try:
+                exif_date_time = read_exif_date_time_original(header, sub_sec=True)
+                strategy = EXIF_STRATEGY_NATIVE
+            except RuntimeError:
+                ## fall back to the complete EXIF parser
+                import exifread
+                try:
+                    exif_tags = exifread.process_file(HeaderBufferedFile(media_file, header), details=False, stop_tag='DateTimeOriginal')
+                except Exception:
+                    ## exifread raises whatever it runs into on truncated or corrupt data (IndexError, TypeError, ZeroDivisionError, ...)
+                    exif_tags = {}
+                # print '  DEBUG: exif_tags=(%d)' % (len(exif_tags),)
+                exif_date_time = str(exif_tags['EXIF DateTimeOriginal']).strip() if 'EXIF DateTimeOriginal' in exif_tags else None
+                strategy = EXIF_STRATEGY_EXIFREAD
+
+            ## missing, or blank or garbled (e.g. truncated) tag value
+            if exif_date_time is None or exif_date_time_re.match(exif_date_time) is None:
+                if stats is not None:
+                    stats.add_stage('exif-failed', started)
+                return None, EXTRACT_ERROR_NO_EXIF, None, None
+            if stats is not None:
+                stats.add_stage(strategy, started)
+
+            return exif_date_time.replace(':', '').replace(' ', '_'), None, strategy, DATE_SOURCE_EXIF
+
+        if header_type != 'mov':
+            return None, EXTRACT_ERROR_MOV, None, None
+
+        started = time.perf_counter()
+        try:
+            (date_time, strategy, source) = read_mov_date_time(media_file, header, sources, stats)
+        except RuntimeError:
+            if stats is not None:
+                stats.add_stage('moov-failed', started)
+            return None, EXTRACT_ERROR_MOV, None, None
+        if stats is not None:
+            stats.add_stage(strategy, started)
+
+    if date_time is None:
+        return None, EXTRACT_ERROR_NO_DATE, None, None
+
+    return date_time.strftime("%Y%m%d_%H%M%S"), None, strategy, source
+
+    #     mov_parser = hachoir_parser.createParser(file_path)
+    #     if mov_parser is None:
+    #         print('  WARNING! Failed to parse video file - unsupported format => skipping ... ')
+    #         mov_parser.stream._input.close()
+    #         continue
+
+    #     # print '  DEBUG: mov_parser.getFieldType()=%s, .mime_type=%s ' % (mov_parser.getFieldType(), mov_parser.mime_type)
+    #     if mov_parser.getFieldType() != 'MovFile':
+    #         print('  WARNING! Failed to parse video file - not a MOV/MP4 file => skipping ... ')
+    #         mov_parser.stream._input.close()
+    #         continue
+
+    #     processed_count += 1
+
+    #     moov_atom = next((field for field in mov_parser if field.description == u'Atom: moov'), None)
+    #     if moov_atom is None:
+    #         print('  ERROR! Failed to parse video file - missing "moov" atom; skipping ... ')
+    #         mov_parser.stream._input.close()
+    #         continue
+
+    #     movie_atom_list = None
+    #     try:
+    #         movie_atom_list = moov_atom.getField('movie')
+    #     except hachoir_core.field.field.MissingField:
+    #         print('  ERROR! Failed to parse video file - missing "movie" atom-list; skipping ... ')
+    #         mov_parser.stream._input.close()
+    #         continue
+
+    #     mvhd_atom = next((field for field in movie_atom_list if field.description == u'Atom: mvhd'), None)
+    #     if movie_atom_list is None:
+    #         print('  ERROR! Failed to parse video file - missing "mvhd" atom; skipping ... ')
+    #         mov_parser.stream._input.close()
+    #         continue
+
+    #     movie_hdr = None
+    #     try:
+    #         movie_hdr = mvhd_atom.getField('movie_hdr')
+    #     except hachoir_core.field.field.MissingField:
+    #         print('  ERROR! Failed to parse video file - missing "movie_hdr"; skipping ... ')
+    #         mov_parser.stream._input.close()
+    #         continue
+
+    #     ## WARNING: it does not work without this dummy iteration
+    #     for field in movie_hdr:
+    #         pass
+
+    #     creation_date_atom = None
+    #     try:
+    #         creation_date_atom = movie_hdr.getField('creation_date')
+    #     except hachoir_core.field.field.MissingField:
+    #         print('  ERROR! Failed to parse video file - missing "creation_date" atom; skipping ... ')
+    #         mov_parser.stream._input.close()
+    #         continue
+
+    #     # >>> creation_date = mov_parser.getField('/atom[1]/movie/atom[0]/movie_hdr/creation_date')
+    #     # >>> creation_date.getFieldType()
+    #     # 'TimestampUnix32'
+    #     # >>> repr(creation_date)
+    #     # "<TimestampUnix32 path='/atom[1]/movie/atom[0]/movie_hdr/creation_date', address=32, size=32>"
+    #     # >>> str(creation_date)
+    #     # '2017-03-03 14:36:52'
+
+    #     date_time_str = str(creation_date_atom).replace('-', '').replace(' ', '_').replace(':', '')
+
+    #     mov_parser.stream._input.close()
+
+
+## media types, which files get classified as by their extensions
+MEDIA_TYPES = ('image', 'video', 'other')
+## marker of compression (encoding) extensions within the lookup table, files with which are of the media type of their inner extension
+ENCODED_MEDIA_TYPE = 'encoded'
+
+def build_media_types(extra_media_types=None, stats=None):
+    ''' Build case-insensitive lookup table of media types (see MEDIA_TYPES) by file extensions.
+
+        Based on the built-in mime-types defaults of mimetypes.MimeTypes() (not reading any system mime-types files,
+        just like the file by file classification used before the lookup table); extended (or overridden) by given
+        comma-separated list of extension=type pairs, e.g. 'jpg=image,mts=video'. Raises ValueError on invalid list.
+        Like mimetypes.guess_type(), classifies compressed files by their inner extension, e.g. "photo.jpg.gz" as image,
+        and "backup.tgz" (i.e. ".tar.gz") as other; compression extensions map to ENCODED_MEDIA_TYPE, see analyze_file_names().
+        Time taken gets added to given RunStats, if any.
+    '''
+    started = time.perf_counter()
+    mime_types = mimetypes.MimeTypes()
+    media_types = {}
+    for (ext, mime_type) in mime_types.types_map[True].items():
+        if mime_type.startswith('image'):
+            media_types[ext.lower()] = 'image'
+        elif mime_type.startswith('video'):
+            media_types[ext.lower()] = 'video'
+        else:
+            media_types.setdefault(ext.lower(), 'other')
+    for (ext, full_ext) in mime_types.suffix_map.items():
+        (inner_ext, dot, encoding_ext) = full_ext.rpartition('.')
+        if dot + encoding_ext in mime_types.encodings_map and inner_ext.lower() in media_types:
+            media_types[ext.lower()] = media_types[inner_ext.lower()]
+    for ext in mime_types.encodings_map:
+        media_types[ext.lower()] = ENCODED_MEDIA_TYPE
+
+    if extra_media_types:
+        for ext_media_type in extra_media_types.split(','):
+            (ext, _, media_type) = ext_media_type.strip().partition('=')
+            ext = ext.strip().lstrip('.').lower()
+            media_type = media_type.strip().lower()
+            if ext == '' or media_type not in MEDIA_TYPES:
+                raise ValueError('invalid extension to media type mapping "%s", expected e.g. "mts=video"' % ext_media_type)
+            media_types['.' + ext] = media_type
+
+    if stats is not None:
+        stats.add_stage('mimetypes', started)
+    return media_types
+
+
+def build_date_sources(date_sources):
+    ''' Build chains of sources of the date-time string (see DATE_SOURCE_NAMES) by media type, from given comma-separated
+        list of sources, e.g. 'exif,mvhd,keys,mtime'. Raises ValueError on unknown source.
+
+        Each chain is a tuple of: sources not requiring to read the file (file name, modification time) listed before
+        the first metadata source applicable to the media type, which are tried before reading the file at all; metadata
+        sources of the media type, in order; and the rest of the sources not requiring to read the file, tried as a fallback.
+    '''
+    sources = [source.strip().lower() for source in date_sources.split(',') if source.strip()]
+    for source in sources:
+        if source not in DATE_SOURCE_NAMES:
+            raise ValueError('unknown date-time source "%s", expected any of: %s' % (source, ', '.join(DATE_SOURCE_NAMES)))
+
+    date_source_chains = {}
+    for (media_type, metadata_sources) in METADATA_DATE_SOURCES.items():
+        chain = [source for source in sources if source in metadata_sources or source in ENTRY_DATE_SOURCES]
+        split = min([chain.index(source) for source in metadata_sources if source in chain], default=len(chain))
+        date_source_chains[media_type] = (tuple(chain[:split]), tuple(source for source in chain[split:] if source in metadata_sources), tuple(source for source in chain[split:] if source in ENTRY_DATE_SOURCES))
+    return date_source_chains
+
+
+class MediaFile:
+    ''' Lightweight record of single directory entry, passed through the processing stages. '''
+
+    __slots__ = ('path', 'depth', 'kind', 'dir_entry', 'dir_names', 'media_type', 'date_time_search', 'trusted', 'extraction', 'date_time_str', 'date_subsec', 'date_source', 'extract_error', 'new_path', 'status')
+
+    def __init__(self, path, depth, kind, dir_entry=None, dir_names=None, media_type=None, date_time_search=None):
+        self.path = path
+        self.depth = depth
+        ## one of: 'directory' (to be processed), 'done-directory' (processed by interrupted run, see RenameJournal),
+        ## 'directory-end' (all its entries and sub-directories processed), 'deep-directory' (beyond maximum depth), 'visited-directory'
+        ## (already processed), 'mount-directory' (on other file system), 'other' (non-file), 'missing' (file given to Renamer) or 'file'
+        self.kind = kind
+        ## os.DirEntry of the file (or FileEntry, see scan_watched_files()), caching its stat data
+        self.dir_entry = dir_entry
+        ## counts of (case-folded) file names within the parent directory, shared by all its entries (or DirectoryNames)
+        self.dir_names = dir_names
+        ## one of: 'image', 'video', 'other' (of known type) or None (of unknown type), see build_media_types()
+        self.media_type = media_type
+        ## match of date_time_search_re in the file name (or None), see analyze_file_names()
+        self.date_time_search = date_time_search
+        ## whether date-time string in file name is trusted, see is_trusted_date_time_prefix()
+        self.trusted = False
+        ## callable returning result of extract_date_time_str(), if scheduled
+        self.extraction = None
+        self.date_time_str = None
+        ## sub-second digits of the date-time (if recorded), see extract_date_time_str()
+        self.date_subsec = None
+        ## one of DATE_SOURCE_* values, once date_time_str is determined
+        self.date_source = None
+        self.extract_error = None
+        self.new_path = None
+        ## result of plan_rename(), one of PLAN_STATUS_* (or None)
+        self.status = None
+
+
+def analyze_file_names(file_names, media_types):
+    ''' Returns media types (see build_media_types()) and date-time string searches (see date_time_search_re) of given
+        file names, as two lists; meant to be called for whole directory listing at once, rather than file by file.
+    '''
+    ## extension as by os.path.splitext() (i.e. leading dots do not start one), without the overhead of calling it for each name
+    partitions = [file_name.rpartition('.') for file_name in file_names]
+    file_media_types = [media_types.get(dot + ext.lower()) if stem.strip('.') else None for (stem, dot, ext) in partitions]
+    ## compressed files, by their inner extension; compression extensions are case-sensitive, as by mimetypes.guess_type()
+    if ENCODED_MEDIA_TYPE in file_media_types:
+        for (index, media_type) in enumerate(file_media_types):
+            if media_type == ENCODED_MEDIA_TYPE:
+                media_type = None
+                (stem, dot, ext) = partitions[index]
+                if dot + ext in mimetypes.encodings_map:
+                    (stem, dot, ext) = stem.rpartition('.')
+                    ## neither compressed again, nor a compressed suffix alias (e.g. "backup.tgz.gz")
+                    if stem.strip('.') and dot + ext.lower() not in mimetypes.suffix_map:
+                        media_type = media_types.get(dot + ext.lower())
+                file_media_types[index] = media_type if media_type != ENCODED_MEDIA_TYPE else None
+    ## date-time string contains an underscore, so names without any are not matched at all
+    search = date_time_search_re.match
+    date_time_searches = [search(file_name) if '_' in file_name else None for file_name in file_names]
+    return file_media_types, date_time_searches
+
+
+def list_directory(dir_path, media_types, stats):
+    ''' Returns list of tuples (os.DirEntry object, media type, date-time string search) of entries of given directory,
+        with counts of their (case-folded) names. Names of all the entries get analyzed at once, see analyze_file_names().
+        Time taken by listing and by analyzing the names gets added to given RunStats.
+    '''
+    started = time.perf_counter()
+    with os.scandir(dir_path) as dir_entries:
+        dir_entries = list(dir_entries)
+    stats.add_stage('scan', started)
+
+    started = time.perf_counter()
+    file_names = [dir_entry.name for dir_entry in dir_entries]
+    ## kept in memory, so that checking for name collisions does not need probing the file system
+    dir_names = collections.Counter(file_name.casefold() for file_name in file_names)
+    (file_media_types, date_time_searches) = analyze_file_names(file_names, media_types)
+    stats.add_stage('names', started)
+    return list(zip(dir_entries, file_media_types, date_time_searches)), dir_names
+
+
+class FileEntry:
+    ''' Stand-in for os.DirEntry of a file given by its path rather than listed, holding its stat data, see scan_watched_files(). '''
+
+    __slots__ = ('name', 'path', 'file_stat')
+
+    def __init__(self, path, file_stat):
+        self.name = path.name
+        self.path = str(path)
+        self.file_stat = file_stat
+
+    def stat(self, follow_symlinks=True):
+        return self.file_stat
 
-    for tmp_path in dir_path.iterdir():
+
+class DirectoryNames(collections.Counter):
+    ''' Counts of (case-folded) names of directory entries, just like those of list_directory(), but listing the directory
+        on the first lookup only, i.e. once any of its files is to be checked for new file name collisions.
+    '''
+
+    def __init__(self, dir_path, stats):
+        super().__init__()
+        self.dir_path = dir_path
+        self.stats = stats
+        self.listed = False
+
+    def list(self):
+        if self.listed:
+            return
+        self.listed = True
+        started = time.perf_counter()
+        try:
+            with os.scandir(self.dir_path) as dir_entries:
+                dict.update(self, collections.Counter(dir_entry.name.casefold() for dir_entry in dir_entries))
+        except OSError:
+            pass  ## removed meanwhile, so nothing is taken
+        self.stats.add_stage('scan', started)
+
+    def __getitem__(self, name):
+        self.list()
+        return super().__getitem__(name)
+
+    def __setitem__(self, name, count):
+        self.list()
+        super().__setitem__(name, count)
+
+
+def scan_directory(dir_path, dir_depth, options, cache=None, journal=None):
+    ''' Scan stage - walks directory tree depth-first, yielding MediaFile records in directory listing order.
+
+        Each processed directory is yielded before its entries, and once again (as 'directory-end') after all of them,
+        including its sub-directories, walked up to maximum depth. Directories completed according to given rename
+        journal (of an interrupted run) are not entered at all.
+        Relies on os.scandir(), so that types of entries are mostly known without any extra stat calls.
+        Walks iteratively with an explicit stack, and never enters the same directory twice (by device and inode),
+        so neither deep trees nor symbolic link loops are an issue; with option --one-file-system, does not
+        enter directories on other file systems either.
+    '''
+    dir_stat = os.stat(dir_path)
+    root_dev = dir_stat.st_dev
+    visited_dirs = {(dir_stat.st_dev, dir_stat.st_ino)}
+
+    if journal is not None and journal.is_directory_done(dir_path):
+        yield MediaFile(dir_path, dir_depth, 'done-directory')
+        return
+    yield MediaFile(dir_path, dir_depth, 'directory')
+    (dir_entries, dir_names) = list_directory(dir_path, options.media_types, options.context.stats)
+    stack = [(dir_path, dir_depth, iter(dir_entries), dir_names)]
+
+    while stack:
+        (dir_path, dir_depth, dir_entries, dir_names) = stack[-1]
+        entry = next(dir_entries, None)
+        if entry is None:
+            stack.pop()
+            yield MediaFile(dir_path, dir_depth, 'directory-end')
+            continue
+        (dir_entry, media_type, date_time_search) = entry
+
+        tmp_path = dir_path.joinpath(dir_entry.name)
         # print('  DEBUG: tmp_path=%r' % tmp_path)
+        if cache is not None and cache.is_cache_file(tmp_path):
+            continue
+        if journal is not None and journal.is_journal_file(tmp_path):
+            continue
 
-        if tmp_path.is_dir():
+        if dir_entry.is_dir():
             if options.max_depth > dir_depth:
-                process_directory(tmp_path, dir_depth +1, options)
-                continue
+                dir_stat = dir_entry.stat()
+                if (dir_stat.st_dev, dir_stat.st_ino) in visited_dirs:
+                    yield MediaFile(tmp_path, dir_depth, 'visited-directory')
+                elif options.one_file_system is True and dir_stat.st_dev != root_dev:
+                    yield MediaFile(tmp_path, dir_depth, 'mount-directory')
+                else:
+                    visited_dirs.add((dir_stat.st_dev, dir_stat.st_ino))
+                    if journal is not None and journal.is_directory_done(tmp_path):
+                        yield MediaFile(tmp_path, dir_depth, 'done-directory')
+                        continue
+                    yield MediaFile(tmp_path, dir_depth +1, 'directory')
+                    (sub_dir_entries, sub_dir_names) = list_directory(tmp_path, options.media_types, options.context.stats)
+                    stack.append((tmp_path, dir_depth +1, iter(sub_dir_entries), sub_dir_names))
             else:
-                print('  WARNING: Not processing sub-directory path "%s", because of reached maximum depth of %d ... ' % (tmp_path, options.max_depth))
-        elif not tmp_path.is_file():
-            print('  INFO: Path "%s" is not a file => ignoring ... ' % tmp_path)
-            continue
+                yield MediaFile(tmp_path, dir_depth, 'deep-directory')
+        elif not dir_entry.is_file():
+            yield MediaFile(tmp_path, dir_depth, 'other')
+        else:
+            yield MediaFile(tmp_path, dir_depth, 'file', dir_entry, dir_names, media_type, date_time_search)
+
 
-        file_path = tmp_path
+def count_files(dir_path, dir_depth, options, cache=None, journal=None):
+    ''' Pre-count pass (option --pre-count) - counts files to be processed, so that the progress line can tell the estimated time left.
 
-        files_count += 1
-        # print('Processing file %d: "%s" ... ' % (files_count, file_path))
+        Walks the directory tree just like scan_directory() does, i.e. listing directories only, without reading any file.
+    '''
+    progress = options.context.progress
+    count = 0
+    for media_file in scan_directory(dir_path, dir_depth, options, cache, journal):
+        ## directory beyond maximum depth gets reported (and counted) as a file too, see plan_rename()
+        if media_file.kind in ('file', 'deep-directory'):
+            count += 1
+            if progress is not None:
+                progress.update_count(count)
+    return count
+
+
+def is_trusted_date_time_prefix(media_file, options):
+    ''' Tells whether the date-time string the file name starts with can be trusted without reading the file.
+
+        It is trusted if it matches the file modification time within --trust-window seconds, except for a random
+        sample of --verify-fraction of such files, which get verified anyway.
+    '''
+    date_time_search = media_file.date_time_search
+    if date_time_search is None or date_time_search.groups()[0] != '':
+        return False
 
-        file_name = file_path.name
-        # parent_dir_path = file_path.parent
-        # print('file_name="%s", parent_dir_path: "%s"' % (file_name, parent_dir_path))
+    try:
+        prefix_timestamp = datetime.datetime.strptime(date_time_search.groups()[1], '%Y%m%d_%H%M%S').timestamp()
+    except (ValueError, OverflowError, OSError):
+        return False
 
-        # print file_path.read_hexhash('md5')
-        # print file_path.read_hexhash('sha1')
-        # print file_path.getsize()
+    if abs(media_file.dir_entry.stat().st_mtime - prefix_timestamp) > options.trust_window:
+        return False
 
-        guessed_mime_type = mimetypes.MimeTypes().guess_type(file_path.as_uri())[0]
-        # print('  DEBUG: guessed_mime_type="%r" ' % (guessed_mime_type,))
-        if guessed_mime_type is None:
-            print('  WARNING: File path "%s" cannot be quessed its mime-type => skipping ... ' % file_path)
-            continue
+    import random
+    return random.random() >= options.verify_fraction
 
-        date_time_search = date_time_search_re.match(file_name)
-        # if date_time_search is not None:
-        #     print(  DEBUG: date_time_search.groups()=%s, .pos=%d, .string=%s' % (date_time_search.groups(), date_time_search.pos, date_time_search.string))
-        date_time_str = None
 
-        if guessed_mime_type.startswith('image'):
-            if options.skip_image is True:
-                print ('  INFO: File name "%s" guessed mime-type is image, which is not to be processed => skipping ...' % file_name)
-                skipped_count += 1
-                continue
+def timed_extract_date_time_str(stats, *args):
+    ''' Like extract_date_time_str(), but records the time taken as per-file extraction latency to given RunStats too. '''
+    started = time.perf_counter()
+    try:
+        return extract_date_time_str(*args, stats=stats)
+    finally:
+        stats.add_latency(started)
 
-            img_type = imghdr.what(file_path)
-            # print('  DEBUG: img_type=%s' % (img_type,))
 
-            if img_type != 'jpeg':
-                print('  WARNING: File path "%s" (image) does not contain JPEG image header => skipping ... ' % file_path)
-                failed_count += 1
+def schedule_extraction(media_file, options, executor, cache=None):
+    ''' Classify media file and schedule extraction of its date-time string, if needed.
+
+        Extraction is skipped altogether for a file name starting with a trusted date-time string,
+        or on a hit in given metadata cache.
+    '''
+    tmp_path = media_file.path
+
+    media_type = media_file.media_type
+    # print('  DEBUG: media_type="%r" ' % (media_type,))
+    if media_type is None:
+        return
+
+    fast_skip = options.fast is True and media_file.date_time_search is not None
+
+    if media_type == 'image':
+        if options.skip_image is True:
+            return
+        ## JPEG header is verified even in fast mode, so as to keep reporting non-JPEG files as failed
+        check_only = fast_skip
+    elif media_type == 'video':
+        if options.skip_video is True or fast_skip:
+            return
+        check_only = False
+    else:
+        return
+
+    if options.trust_window is not None and not fast_skip and options.force is not True:
+        if is_trusted_date_time_prefix(media_file, options):
+            media_file.trusted = True
+            return
+
+    (entry_sources, metadata_sources, _) = options.date_sources[media_type]
+    if resolve_entry_date_sources(media_file, entry_sources, options) or not metadata_sources:
+        return
+    args = (options.context.stats, tmp_path, media_type, check_only, metadata_sources)
+
+    if cache is not None:
+        file_stat = media_file.dir_entry.stat()
+        cached_result = cache.lookup(tmp_path, file_stat, media_type, metadata_sources)
+        if cached_result is not None:
+            if fast_skip and cached_result[1] is None:
+                cached_result = (None, None, None, None)
+            media_file.extraction = lambda: cached_result
+            return
+
+    if executor is None:
+        extraction = lambda: timed_extract_date_time_str(*args)
+    else:
+        extraction = executor.submit(timed_extract_date_time_str, *args).result
+
+    ## result of header verification only (in fast mode) is not complete enough to be cached
+    if cache is None or fast_skip:
+        media_file.extraction = extraction
+    else:
+        media_file.extraction = lambda: cache.store(tmp_path, file_stat, media_type, metadata_sources, extraction())
+
+
+def resolve_entry_date_sources(media_file, sources, options):
+    ''' Tries to determine date-time string of media file from given sources not requiring to read the file, i.e. from
+        the date-time string within its file name, or from its modification time, in order; returns whether determined.
+    '''
+    for source in sources:
+        if source == DATE_SOURCE_FILE_NAME:
+            if media_file.date_time_search is None:
                 continue
+            date_time_str = media_file.date_time_search.groups()[1]
+            try:
+                datetime.datetime.strptime(date_time_str, '%Y%m%d_%H%M%S')
+            except ValueError:
+                continue
+        else:
+            date_time_str = datetime.datetime.fromtimestamp(media_file.dir_entry.stat().st_mtime).strftime('%Y%m%d_%H%M%S')
 
-            processed_count += 1
-
-            ## optimization(?) for fast mode - skip file already containing some data/time string
-            if options.fast is True:
-                if date_time_search is not None:
-                    current_date_time_prefix = date_time_search.groups()[0]
-                    current_date_time_str = date_time_search.groups()[1]
-                    if current_date_time_prefix == '':
-                        print('  WARNING: File name "%s" (image) apparently starts with some date-time string "%s"' % (file_name, current_date_time_str), end='')
-                    else:
-                        print('  WARNING: File name "%s" (image) apparently contains some date-time string "%s"' % (file_name, current_date_time_str), end='')
-                    print(' => fast mode - skipping ... ')
-                    skipped_count += 1
-                    continue
+        media_file.date_time_str = date_time_str
+        media_file.date_source = source
+        options.context.stats.source_counts[source] += 1
+        options.context.logger.debug('extracted', '  DEBUG: File name "%s" original/creation date-time string "%s" found by %s ... ', media_file.path.name, date_time_str, source)
+        return True
+    return False
 
-            with open(file_path, 'rb') as img_file:
-                # exif_tags = exifread.process_file(img_file)
-                # for tag_key in exif_tags.keys():
-                #     if tag_key in ['JPEGThumbnail']:
-                #         print('  EXIF tag: [%s], value: <binary-image-thumbnail> ' % (tag_key,))
-                #     else:
-                #         print('  EXIF tag: [%s], value: [%s] ' % (tag_key, exif_tags[tag_key]))
 
-                exif_tags = exifread.process_file(img_file, details=False, stop_tag='DateTimeOriginal')
-                # print '  DEBUG: exif_tags=(%d)' % (len(exif_tags),)
+def resolve_extraction(media_file, options):
+    ''' Wait for scheduled extraction of media file date-time string, if any, and take over its result.
 
-                if 'EXIF DateTimeOriginal' in exif_tags:
-                    date_time_str = str(exif_tags['EXIF DateTimeOriginal']).replace(':', '').replace(' ', '_')
-                else:
-                    print('  WARNING: File path "%s" (image) is missing an EXIF tag for original/creation date-time => skipping ... ' % file_path)
-                    failed_count += 1
+        On failure to find it within the file metadata (unless an image file is not a JPEG file at all), falls back to the sources
+        listed after the metadata ones (option --date-source), see resolve_entry_date_sources().
+    '''
+    (logger, stats) = (options.context.logger, options.context.stats)
+    if media_file.extraction is not None:
+        (media_file.date_time_str, media_file.extract_error, strategy, media_file.date_source) = media_file.extraction()
+        if media_file.date_time_str is not None:
+            (media_file.date_time_str, _, media_file.date_subsec) = media_file.date_time_str.partition('.')
+        if strategy is not None:
+            stats.strategy_counts[strategy] += 1
+            logger.debug('extracted', '  DEBUG: File name "%s" original/creation date-time string "%s" found by %s ... ', media_file.path.name, media_file.date_time_str, strategy)
+        if media_file.date_source is not None:
+            stats.source_counts[media_file.date_source] += 1
+        elif media_file.extract_error in (EXTRACT_ERROR_NO_EXIF, EXTRACT_ERROR_MOV, EXTRACT_ERROR_NO_DATE):
+            if resolve_entry_date_sources(media_file, options.date_sources[media_file.media_type][2], options):
+                media_file.extract_error = None
+
+
+def extract_date_time_strs(media_files, options, executor=None, cache=None):
+    ''' Extract stage - resolves date-time strings of media files, while keeping extraction scheduled ahead.
+
+        Yields MediaFile records in the same order as received, so renames get applied deterministically;
+        without executor, records are not scheduled ahead at all.
+    '''
+    lookahead = options.jobs * 4 if executor is not None else 0
+    scheduled = collections.deque()
+    for media_file in media_files:
+        if media_file.kind == 'file':
+            schedule_extraction(media_file, options, executor, cache)
+        scheduled.append(media_file)
+
+        while len(scheduled) > lookahead:
+            media_file = scheduled.popleft()
+            resolve_extraction(media_file, options)
+            yield media_file
+
+    while scheduled:
+        media_file = scheduled.popleft()
+        resolve_extraction(media_file, options)
+        yield media_file
+
+
+## statuses of planned renames, as returned by plan_rename() and written to rename plan entries
+PLAN_STATUS_RENAME = 'rename'
+PLAN_STATUS_SKIP = 'skip'
+PLAN_STATUS_FAIL = 'fail'
+## status of Result record once renamed, see apply_results()
+RESULT_STATUS_RENAMED = 'renamed'
+
+
+## fields of output file naming template (option --template)
+TEMPLATE_FIELDS = ('date', 'name', 'stem', 'ext', 'ext_lower', 'type', 'subsec', 'seq')
+## default format of the date field, i.e. of the date-time string
+TEMPLATE_DATE_FORMAT = '%Y%m%d_%H%M%S'
+## maximum sequence number tried for a template with the seq field, before giving up on colliding file names
+TEMPLATE_MAX_SEQ = 1000
+
+class NameTemplate:
+    ''' Output file naming template (option --template), e.g. '{date:%Y/%m/%Y%m%d_%H%M%S}_{stem}{ext_lower}'.
+
+        Fields: date (with strftime() format, "%Y%m%d_%H%M%S" by default), name (original file name), stem, ext and
+        ext_lower (extension, including the dot), type (media type), subsec (sub-second digits of the date-time, if
+        recorded: ".045", or empty otherwise) and seq (sequence number, for names colliding with other files: empty for
+        the first name, then "-2", "-3", ...). With a format spec, subsec and seq are formatted as digits and number
+        respectively, and always rendered, e.g. "{seq:03d}". Names with slashes get renamed into sub-directories.
+
+        Parsed just once, into a format string of positional fields, so that each file name takes a single call
+        of str.format(). Date field formats of numeric directives only (%Y, %y, %m, %d, %H, %M, %S, %f) get compiled
+        into fields of the date-time string parts, so that neither a datetime object nor strftime() is needed;
+        any other date field gets formatted by strftime().
+        Raises ValueError on invalid template.
+    '''
+
+    ## positions of the fields within str.format() arguments, see format(); subsec and seq with a format spec
+    ## are formatted from the digits and the number, rather than from the strings rendered as empty when not needed
+    FIELD_INDEXES = {'date': 0, 'name': 1, 'stem': 2, 'ext': 3, 'ext_lower': 4, 'type': 5, 'subsec': 6, 'seq': 8}
+    SPEC_FIELD_INDEXES = {'subsec': 7, 'seq': 9}
+    ## positions of the date-time string parts within str.format() arguments, by strftime() directive
+    DATE_DIRECTIVE_INDEXES = {'Y': 10, 'm': 11, 'd': 12, 'H': 13, 'M': 14, 'S': 15, 'y': 16, 'f': 17}
+
+    def __init__(self, template):
+        self.template = template
+        self.fields = set()
+        ## whether any date field gets formatted by strftime(), see compile_date_format()
+        self.strftime = False
+        parts = []
+        try:
+            parsed = list(string.Formatter().parse(template))
+        except ValueError as e:
+            raise ValueError('invalid template "%s": %s' % (template, e))
+        for (literal, field_name, format_spec, conversion) in parsed:
+            parts.append(literal.replace('{', '{{').replace('}', '}}'))
+            if field_name is None:
+                continue
+            if field_name not in TEMPLATE_FIELDS:
+                raise ValueError('unknown field "{%s}" of template "%s", expected any of: %s' % (field_name, template, ', '.join(TEMPLATE_FIELDS)))
+            if conversion is not None or '{' in format_spec:
+                raise ValueError('unsupported conversion or nested field "{%s}" of template "%s"' % (field_name, template))
+            self.fields.add(field_name)
+            if field_name == 'date':
+                date_format = self.compile_date_format(format_spec or TEMPLATE_DATE_FORMAT)
+                if date_format is not None:
+                    parts.append(date_format)
                     continue
+                self.strftime = True
+                format_spec = format_spec or TEMPLATE_DATE_FORMAT
+            index = self.SPEC_FIELD_INDEXES[field_name] if format_spec and field_name in self.SPEC_FIELD_INDEXES else self.FIELD_INDEXES[field_name]
+            parts.append('{%d:%s}' % (index, format_spec) if format_spec else '{%d}' % index)
+        self.format_string = ''.join(parts)
+        ## whether the file name needs to be split into stem and extension at all
+        self.split_ext = not self.fields.isdisjoint(('stem', 'ext', 'ext_lower'))
+
+        ## validated by formatting a sample name once, rather than each file name
+        try:
+            sample_name = self.format('20190601_120000', 'IMG_0001.JPG', 'image', '045', 2)
+        except (ValueError, TypeError) as e:
+            raise ValueError('invalid format of template "%s": %s' % (template, e))
+        sample_path = pathlib.PurePath(sample_name)
+        if sample_name == '' or sample_path.is_absolute() or sample_path.anchor or '..' in sample_path.parts or os.path.basename(sample_name) in ('', '.'):
+            raise ValueError('template "%s" does not make file names relative to the file directory' % template)
+        ## whether new file names are relative paths, within sub-directories of the file directory
+        self.nested = len(sample_path.parts) > 1
+
+    def compile_date_format(self, date_format):
+        ''' Returns format string of given strftime() format of the date field, made of the date-time string part fields,
+            or None if it has any other directives than DATE_DIRECTIVE_INDEXES.
+        '''
+        parts = []
+        for (position, part) in enumerate(re.split(r'%(.)', date_format)):
+            if position % 2 == 0:
+                if '%' in part:
+                    return None  ## trailing
+                parts.append(part.replace('{', '{{').replace('}', '}}'))
+            elif part == '%':
+                parts.append('%')
+            elif part in self.DATE_DIRECTIVE_INDEXES:
+                parts.append('{%d}' % self.DATE_DIRECTIVE_INDEXES[part])
+            else:
+                return None
+        return ''.join(parts)
+
+    def format(self, date_time_str, file_name, media_type=None, subsec=None, seq=1):
+        ''' Returns new file name (or relative path) of file of given name and date-time string (e.g. '20190601_120000'). '''
+        date_time = None
+        if self.strftime:
+            date_time = datetime.datetime(int(date_time_str[0:4]), int(date_time_str[4:6]), int(date_time_str[6:8]), int(date_time_str[9:11]), int(date_time_str[11:13]), int(date_time_str[13:15]), int(subsec[:6].ljust(6, '0')) if subsec else 0)
+        (stem, ext) = os.path.splitext(file_name) if self.split_ext else ('', '')
+        return self.format_string.format(date_time, file_name, stem, ext, ext.lower(), media_type,
+                                         '.' + subsec if subsec else '', subsec or '', '-%d' % seq if seq > 1 else '', seq,
+                                         date_time_str[0:4], date_time_str[4:6], date_time_str[6:8], date_time_str[9:11], date_time_str[11:13], date_time_str[13:15],
+                                         date_time_str[2:4], subsec[:6].ljust(6, '0') if subsec else '000000')
+
+
+def plan_rename(media_file, options, file_comparer, planned_paths=None):
+    ''' Decide new file name for single media file, reporting the decision and updating the counters.
+
+        New file paths planned for other files of the same directory (see plan_renames()) count as taken, just like existing ones.
+
+        A file to be renamed gets counted as renamed before checking its new file name for collisions, so a colliding one
+        counts as failed too; a file of unknown media type, or kept under its name, counts as neither skipped nor failed.
+        Applying a rename plan counts its entries the same way, see write_plan().
+        Sets new_path of the media file record, if it is to be renamed.
+        Returns one of PLAN_STATUS_* for a file, or None for a directory (or other non-file path).
+    '''
+    (logger, stats) = (options.context.logger, options.context.stats)
+
+    if media_file.kind == 'directory':
+        if options.max_depth > 0:
+            logger.info('directory', 'Processing directory path "%s" recursively at depth %d ... ', media_file.path.resolve(), media_file.depth)
+        else:
+            logger.info('directory', 'Processing directory path "%s" non-recursively ... ', media_file.path.resolve())
+        return
+    elif media_file.kind == 'done-directory':
+        logger.info('done-directory', '  INFO: Not processing sub-directory path "%s", because of having processed it already before interruption ... ', media_file.path)
+        return
+    elif media_file.kind == 'directory-end':
+        return
+    elif media_file.kind == 'deep-directory':
+        ## and then it is reported as a file of unknown type
+        logger.warning('deep-directory', '  WARNING: Not processing sub-directory path "%s", because of reached maximum depth of %d ... ', media_file.path, options.max_depth)
+    elif media_file.kind == 'visited-directory':
+        logger.warning('visited-directory', '  WARNING: Not processing sub-directory path "%s", because of having processed it already (symbolic link loop?) ... ', media_file.path)
+        return
+    elif media_file.kind == 'mount-directory':
+        logger.info('mount-directory', '  INFO: Not processing sub-directory path "%s", because of being on other file system ... ', media_file.path)
+        return
+    elif media_file.kind == 'other':
+        logger.info('not-file', '  INFO: Path "%s" is not a file => ignoring ... ', media_file.path)
+        return
+    elif media_file.kind == 'missing':
+        logger.error('missing', '  ERROR! File path "%s" does not exist => skipping ... ', media_file.path)
+        stats.files_count += 1
+        stats.failed_count += 1
+        return PLAN_STATUS_FAIL
+
+    file_path = media_file.path
+
+    stats.files_count += 1
+    # print('Processing file %d: "%s" ... ' % (files_count, file_path))
+
+    file_name = file_path.name
+    # parent_dir_path = file_path.parent
+    # print('file_name="%s", parent_dir_path: "%s"' % (file_name, parent_dir_path))
+
+    # print file_path.read_hexhash('md5')
+    # print file_path.read_hexhash('sha1')
+    # print file_path.getsize()
+
+    media_type = media_file.media_type
+    if media_type is None:
+        logger.warning('unknown-type', '  WARNING: File path "%s" cannot be quessed its mime-type => skipping ... ', file_path)
+        return PLAN_STATUS_SKIP
+
+    date_time_search = media_file.date_time_search
+    # if date_time_search is not None:
+    #     print(  DEBUG: date_time_search.groups()=%s, .pos=%d, .string=%s' % (date_time_search.groups(), date_time_search.pos, date_time_search.string))
+    date_time_str = media_file.date_time_str
+    extract_error = media_file.extract_error
+
+    if media_file.trusted is True:
+        logger.info('trusted', '  INFO: File name "%s" starts with date-time string "%s" matching its modification time => trusting, skipping ... ', file_name, date_time_search.groups()[1])
+        stats.processed_count += 1
+        stats.skipped_count += 1
+        stats.trusted_count += 1
+        return PLAN_STATUS_SKIP
+
+    if media_type == 'image':
+        if options.skip_image is True:
+            logger.info('skip-image', '  INFO: File name "%s" guessed mime-type is image, which is not to be processed => skipping ...', file_name)
+            stats.skipped_count += 1
+            return PLAN_STATUS_SKIP
+
+        if extract_error == EXTRACT_ERROR_NOT_JPEG:
+            logger.warning('not-jpeg', '  WARNING: File path "%s" (image) does not contain JPEG image header => skipping ... ', file_path)
+            stats.failed_count += 1
+            return PLAN_STATUS_FAIL
+
+        stats.processed_count += 1
+
+        ## optimization(?) for fast mode - skip file already containing some data/time string
+        if options.fast is True:
+            if date_time_search is not None:
+                current_date_time_prefix = date_time_search.groups()[0]
+                current_date_time_str = date_time_search.groups()[1]
+                if current_date_time_prefix == '':
+                    logger.warning('fast-skip', '  WARNING: File name "%s" (image) apparently starts with some date-time string "%s" => fast mode - skipping ... ', file_name, current_date_time_str)
+                else:
+                    logger.warning('fast-skip', '  WARNING: File name "%s" (image) apparently contains some date-time string "%s" => fast mode - skipping ... ', file_name, current_date_time_str)
+                stats.skipped_count += 1
+                return PLAN_STATUS_SKIP
+
+        if extract_error == EXTRACT_ERROR_NO_EXIF:
+            logger.warning('no-exif', '  WARNING: File path "%s" (image) is missing an EXIF tag for original/creation date-time => skipping ... ', file_path)
+            stats.failed_count += 1
+            return PLAN_STATUS_FAIL
+
+    elif media_type == 'video':
+        if options.skip_video is True:
+            logger.info('skip-video', '  INFO: File name "%s" guessed mime-type is video, which is not ot be processed => skipping ...', file_name)
+            stats.skipped_count += 1
+            return PLAN_STATUS_SKIP
+
+        stats.processed_count += 1
+
+        ## optimization(?) for fast mode - skip file already containing some data/time string
+        if options.fast is True:
+            if date_time_search is not None:
+                current_date_time_prefix = date_time_search.groups()[0]
+                current_date_time_str = date_time_search.groups()[1]
+                if current_date_time_prefix == '':
+                    logger.warning('fast-skip', '  WARNING: File name "%s" (video) apparently starts with some date-time string "%s" => fast mode - skipping ... ', file_name, current_date_time_str)
+                else:
+                    logger.warning('fast-skip', '  WARNING: File name "%s" (video) apparently contains some date-time string "%s" => fast mode - skipping ... ', file_name, current_date_time_str)
+                stats.skipped_count += 1
+                return PLAN_STATUS_SKIP
+
+        if extract_error == EXTRACT_ERROR_MOV:
+            logger.error('mov-error', '  ERROR! File path "%s" (video) cannot be extracted original/creation date-time => skipping ... ', file_path)
+            stats.failed_count += 1
+            return PLAN_STATUS_FAIL
+
+        if extract_error == EXTRACT_ERROR_NO_DATE:
+            logger.warning('no-date', '  WARNING: File path "%s" (video) is missing original/creation date-time => skipping ... ', file_path)
+            stats.failed_count += 1
+            return PLAN_STATUS_FAIL
+
+    else:
+        logger.info('other-type', '  INFO: File name "%s" guessed mime-type is neither image nor video => skipping ... ', file_name)
+        stats.skipped_count += 1
+        return PLAN_STATUS_SKIP
+
+    # print('  DEBUG: date_time_str [%s] ' % (date_time_str,))
+    if date_time_str is None:
+        logger.error('no-date-time', '  ERROR! Failed to determine original/creation date-time for image or video => skipping ... ')
+        stats.failed_count += 1
+        return PLAN_STATUS_FAIL
+
+    ## verify pattern of the date-time string
+    if date_time_verify_re.match(date_time_str) is None:
+        logger.error('invalid-date-time', '  ERROR! Invalid/unexpected format of determined date-time string "%s" => skipping ... ', date_time_str)
+        stats.failed_count += 1
+        return PLAN_STATUS_FAIL
+
+
+    ## verify current file-name containts either the same or any other date-time string
+    if date_time_search is not None:
+        current_date_time_prefix = date_time_search.groups()[0]
+        current_date_time_str = date_time_search.groups()[1]
+        action = ' => forcing rename ... ' if options.force is True else ' => skipping ... '
+        if current_date_time_prefix == '':
+            if current_date_time_str == date_time_str:
+                logger.info('already-prefixed', '  INFO: File name "%s" already starts with original/creation date-time string "%s"%s', file_name, date_time_str, action)
+            else:
+                logger.warning('other-prefix', '  WARNING: File name "%s" apparently starts with date-time string "%s" other than determined "%s"%s', file_name, current_date_time_str, date_time_str, action)
+        else:
+            if current_date_time_str == date_time_str:
+                logger.info('contains-date-time', '  INFO: File name "%s" apparently contains original/creation date-time string "%s"%s', file_name, date_time_str, action)
+            else:
+                logger.warning('contains-other-date-time', '  WARNING: File name "%s" apparently contains date-time string "%s" other than determined "%s"%s', file_name, current_date_time_str, date_time_str, action)
+
+        if options.force is not True:
+            stats.skipped_count += 1
+            return PLAN_STATUS_SKIP
+
+    if options.name_template is not None:
+        return plan_template_rename(media_file, options, file_comparer, planned_paths)
+
+    new_file_name = ''
+    if options.erase is True:
+        new_file_name = date_time_str + file_path.suffix
+    elif file_name.startswith(date_time_str):
+        new_file_name = file_name
+    else:
+        new_file_name = date_time_str + '_' + file_name
+
+    if new_file_name == file_name:
+        logger.info('keep-name', '  INFO: Keeping original file name "%s" => skipping ... ', file_name)
+        return PLAN_STATUS_SKIP
+
+    stats.renamed_count += 1
+
+    # new_file_path = dir_path.joinpath(new_file_name)
+    new_file_path = file_path.with_name(new_file_name)
+    # print('new_file_path=%s' % (new_file_path,))
+    if is_colliding(media_file, new_file_path, file_comparer, logger, planned_paths):
+        stats.failed_count += 1
+        return PLAN_STATUS_FAIL
+
+    media_file.new_path = new_file_path
+    return PLAN_STATUS_RENAME
+
+
+def plan_template_rename(media_file, options, file_comparer, planned_paths=None):
+    ''' Decide new file name for single media file by output file naming template (option --template), see NameTemplate.
+
+        For a template with the seq field, tries next sequence numbers as long as the new file name is taken by a different file.
+    '''
+    (logger, stats) = (options.context.logger, options.context.stats)
+    file_path = media_file.path
+    name_template = options.name_template
+    try:
+        new_file_name = name_template.format(media_file.date_time_str, file_path.name, media_file.media_type, media_file.date_subsec)
+    except ValueError:
+        logger.error('invalid-date-time', '  ERROR! Invalid/unexpected format of determined date-time string "%s" => skipping ... ', media_file.date_time_str)
+        stats.failed_count += 1
+        return PLAN_STATUS_FAIL
+
+    new_file_path = file_path.parent.joinpath(new_file_name)
+    ## sub-directories of the new file name are relative to the file directory, so a file moved into them by a previous run
+    ## (and walked into by this one) is kept as well
+    new_dir_parts = pathlib.PurePath(new_file_name).parent.parts
+    if new_file_path.name == file_path.name and (not new_dir_parts or file_path.parent.parts[-len(new_dir_parts):] == new_dir_parts):
+        logger.info('keep-name', '  INFO: Keeping original file name "%s" => skipping ... ', file_path.name)
+        return PLAN_STATUS_SKIP
+
+    stats.renamed_count += 1
+
+    new_file_path = find_new_file_path(media_file, new_file_path, options, file_comparer, planned_paths)
+    if new_file_path is None:
+        stats.failed_count += 1
+        return PLAN_STATUS_FAIL
+
+    media_file.new_path = new_file_path
+    return PLAN_STATUS_RENAME
+
+
+def find_new_file_path(media_file, new_file_path, options, file_comparer, planned_paths=None):
+    ''' Returns given new file path of media file, unless it already exists, then reports it and returns None.
+
+        With output file naming template having the seq field, a path with the next sequence number gets tried instead,
+        as long as it is taken (or planned to be, see plan_renames()) by a different file, up to TEMPLATE_MAX_SEQ.
+    '''
+    name_template = options.name_template
+    same_directory = name_template is None or not name_template.nested
+    collision = get_collision(media_file, new_file_path, file_comparer, same_directory, planned_paths)
+
+    if collision == 'different' and name_template is not None and 'seq' in name_template.fields:
+        file_path = media_file.path
+        for seq in range(2, TEMPLATE_MAX_SEQ + 1):
+            seq_file_path = file_path.parent.joinpath(name_template.format(media_file.date_time_str, file_path.name, media_file.media_type, media_file.date_subsec, seq))
+            seq_collision = get_collision(media_file, seq_file_path, file_comparer, same_directory, planned_paths)
+            if seq_collision != 'different':
+                (new_file_path, collision) = (seq_file_path, seq_collision)
+                break
+
+    if collision is not None:
+        report_collision(media_file, new_file_path, collision, options.context.logger)
+        return None
+    return new_file_path
+
+
+def get_collision(media_file, new_file_path, file_comparer, same_directory=True, planned_paths=None):
+    ''' Check whether new file path of media file already exists, or is planned to (by given dict of planned new file paths,
+        see plan_renames()); returns None if not, otherwise 'identical' or 'different' (file).
+    '''
+    planned_path = planned_paths.get(str(new_file_path).casefold()) if planned_paths is not None else None
+    ## directory listing is looked up first, so as to probe the file system only in case of a likely collision
+    if planned_path is None and same_directory and media_file.dir_names[new_file_path.name.casefold()] == 0:
+        return None
+    if new_file_path.exists():
+        ## including a file renamed already as planned
+        planned_path = new_file_path
+    elif planned_path is None:
+        return None
+    ## TODO: consider using the '--force' option to erase duplicate?
+    return 'identical' if file_comparer.are_identical(media_file.path, planned_path) else 'different'
+
+
+def report_collision(media_file, new_file_path, collision, logger):
+    file_name = media_file.path.name
+    new_file_name = new_file_path.name
+    if collision == 'identical':
+        logger.warning('identical-collision', '  WARNING: New file name "%s" already exists and is identical file to the original file name "%s"; consider removing duplicate => skipping ... ', new_file_name, file_name)
+    else:
+        logger.error('different-collision', '  ERROR: New file name "%s" already exists and is different file than the original file name "%s"; consider manual renaming => skipping ... ', new_file_name, file_name)
+
+
+def is_colliding(media_file, new_file_path, file_comparer, logger, planned_paths=None):
+    ''' Check whether new file path of media file already exists (or is planned to), reporting it by given logger if so. '''
+    collision = get_collision(media_file, new_file_path, file_comparer, True, planned_paths)
+    if collision is not None:
+        report_collision(media_file, new_file_path, collision, logger)
+        return True
+    return False
+
+
+def plan_renames(media_files, options, file_comparer=None):
+    ''' Plan stage - decides new file names of media files, see plan_rename().
 
-        elif guessed_mime_type.startswith('video'):
-            if options.skip_video is True:
-                print ('  INFO: File name "%s" guessed mime-type is video, which is not ot be processed => skipping ...' % file_name)
-                skipped_count += 1
+        New file names get taken (and original ones freed) in directory listings once planned, rather than once renamed,
+        and new file paths get remembered (by directory, until all its entries processed) along with the files planned to take them,
+        so that no two files get planned the same new file path, even if not renamed right away (in plan mode, or by a journal batch).
+    '''
+    (stats, progress) = (options.context.stats, options.context.progress)
+    if file_comparer is None:
+        file_comparer = FileComparer(options.hash, stats)
+    ## new file paths (casefolded) planned, mapped to the file paths planned to be renamed to them, by directory path
+    planned_paths = {}
+    for media_file in media_files:
+        if media_file.kind == 'directory-end':
+            planned_paths.pop(media_file.path, None)
+        dir_planned_paths = planned_paths.setdefault(media_file.path.parent, {}) if media_file.kind == 'file' else None
+        media_file.status = plan_rename(media_file, options, file_comparer, dir_planned_paths)
+        if media_file.status == PLAN_STATUS_RENAME:
+            dir_planned_paths[str(media_file.new_path).casefold()] = media_file.path
+            media_file.dir_names[media_file.path.name.casefold()] -= 1
+            if media_file.new_path.parent == media_file.path.parent:
+                media_file.dir_names[media_file.new_path.name.casefold()] += 1
+        if progress is not None:
+            progress.update(stats.files_count)
+        yield media_file
+
+
+def rename_media_file(media_file, stats, cache=None):
+    # try:
+    started = time.perf_counter()
+    same_directory = media_file.new_path.parent == media_file.path.parent
+    if not same_directory:
+        ## into sub-directories, by output file naming template
+        media_file.new_path.parent.mkdir(parents=True, exist_ok=True)
+    media_file.path.rename(media_file.new_path)
+    stats.add_stage('rename', started)
+    if cache is not None:
+        cache.rename(media_file.path, media_file.new_path)
+    # except
+
+
+def apply_renames(media_files, options, cache=None, journal=None):
+    ''' Apply stage - renames media files as planned (unless in dry-run mode).
+
+        With rename journal given, renames get applied in batches, recorded in the journal, see RenameJournal
+        (in the order planned, so a new file name freed by a rename batched before is free by then, see plan_renames()).
+    '''
+    (logger, stats) = (options.context.logger, options.context.stats)
+
+    def rename(file_path, new_file_path, media_file):
+        rename_media_file(media_file, stats, cache)
+        return True
+
+    for media_file in media_files:
+        if journal is not None:
+            if media_file.kind == 'directory-end':
+                journal.add_directory(media_file.path)
+            elif media_file.new_path is not None:
+                logger.info('rename', '  INFO: Renaming file name "%s" to "%s" ... ', media_file.path.name, media_file.new_path.name)
+                if journal.add_rename(media_file.path, media_file.new_path, media_file):
+                    yield from journal.apply_batch(rename)
                 continue
+        elif media_file.new_path is not None:
+            if options.dry_run is not True:
+                logger.info('rename', '  INFO: Renaming file name "%s" to "%s" ... ', media_file.path.name, media_file.new_path.name)
+                rename_media_file(media_file, stats, cache)
+            else:
+                logger.info('dry-run-rename', '  INFO: Dry-run - would be renaming file name "%s" to "%s" ... ', media_file.path.name, media_file.new_path.name)
+        yield media_file
 
-            processed_count += 1
-
-            ## optimization(?) for fast mode - skip file already containing some data/time string
-            if options.fast is True:
-                if date_time_search is not None:
-                    current_date_time_prefix = date_time_search.groups()[0]
-                    current_date_time_str = date_time_search.groups()[1]
-                    if current_date_time_prefix == '':
-                        print('  WARNING: File name "%s" (video) apparently starts with some date-time string "%s"' % (file_name, current_date_time_str), end='')
-                    else:
-                        print('  WARNING: File name "%s" (video) apparently contains some date-time string "%s"' % (file_name, current_date_time_str), end='')
-                    print(' => fast mode - skipping ... ')
-                    skipped_count += 1
-                    continue
+    if journal is not None:
+        yield from journal.apply_batch(rename)
 
-            try:
-                (date_time, _) = get_mov_timestamps(file_path)
-            except RuntimeError:
-                print('  ERROR! File path "%s" (video) cannot be extracted original/creation date-time => skipping ... ' % file_path)
-                failed_count += 1
+
+## version of the rename plan file format, written to its header record
+PLAN_VERSION = 1
+
+class Result:
+    ''' Compact record of resolved new file name of single file, as returned by Renamer, and written to rename plan entries.
+
+        Unlike MediaFile records, refers to nothing but the file paths, so it can be kept and applied later.
+    '''
+
+    __slots__ = ('path', 'new_path', 'status', 'media_type', 'date_time', 'date_source', 'error', 'size', 'mtime_ns')
+
+    def __init__(self, path, new_path, status, media_type=None, date_time=None, date_source=None, error=None, size=None, mtime_ns=None):
+        self.path = path
+        ## set only if to be renamed (or renamed already)
+        self.new_path = new_path
+        ## one of PLAN_STATUS_* or RESULT_STATUS_RENAMED
+        self.status = status
+        self.media_type = media_type
+        self.date_time = date_time
+        ## one of DATE_SOURCE_* values
+        self.date_source = date_source
+        ## one of EXTRACT_ERROR_* codes, if failed to extract the date-time string
+        self.error = error
+        ## size and modification time of the file to be renamed, so that it does not get renamed once changed
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+
+def make_result(media_file):
+    ''' Returns Result record of given MediaFile record, once planned. '''
+    date_time_str = media_file.date_time_str
+    date_source = media_file.date_source
+    if media_file.trusted is True:
+        date_time_str = media_file.date_time_search.groups()[1]
+        date_source = DATE_SOURCE_FILE_NAME
+
+    result = Result(media_file.path, media_file.new_path, media_file.status, media_file.media_type, date_time_str, date_source, media_file.extract_error)
+    if media_file.status == PLAN_STATUS_RENAME:
+        file_stat = media_file.dir_entry.stat()
+        result.size = file_stat.st_size
+        result.mtime_ns = file_stat.st_mtime_ns
+    return result
+
+
+## counters of RunStats (see PLAN_COUNTERS) a file may get counted by the plan stage, as recorded by rename plan entries
+PLAN_COUNTERS = ('processed', 'renamed', 'skipped', 'failed')
+
+def get_plan_counts(stats):
+    return stats.processed_count, stats.renamed_count, stats.skipped_count, stats.failed_count
+
+
+def write_plan(media_files, plan_file, dir_path, stats):
+    ''' Plan mode stage (instead of the apply stage) - writes rename plan entry for each file, as a line of JSON.
+
+        Paths are written relative to the directory path, so that the plan can be applied on another host,
+        having the same directory tree mounted elsewhere. Renamed file size and modification time are written
+        too, so that a file changed after planning does not get renamed. So are the counters the file got counted
+        by (see plan_rename()), taken from given RunStats, so that applying the plan reports the same summary.
+    '''
+    ## records are planned one by one, each one right before written, so the counters changed since the previous one are its own
+    counts = get_plan_counts(stats)
+    for media_file in media_files:
+        (previous_counts, counts) = (counts, get_plan_counts(stats))
+        if media_file.status is not None:
+            result = make_result(media_file)
+            entry = {
+                'source': result.path.relative_to(dir_path).as_posix(),
+                'target': result.new_path.relative_to(dir_path).as_posix() if result.new_path is not None else None,
+                'date_time': result.date_time,
+                'date_source': result.date_source,
+                'status': result.status,
+                'counts': [counter for (counter, count, previous_count) in zip(PLAN_COUNTERS, counts, previous_counts) if count != previous_count],
+            }
+            if result.status == PLAN_STATUS_RENAME:
+                entry['size'] = result.size
+                entry['mtime_ns'] = result.mtime_ns
+            plan_file.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n')
+        yield media_file
+
+
+def process_directory(dir_path, dir_depth, options, executor=None, cache=None, plan_file=None, journal=None, watcher=None):
+    ''' Process directory tree as a chain of streaming stages: scan -> extract -> plan -> apply.
+
+        With plan file given, the apply stage gets replaced with writing the rename plan, see write_plan().
+        With inotify watcher given (in watch mode), directories get watched as they are scanned, see InotifyWatcher.add_watches().
+    '''
+    media_files = scan_directory(dir_path, dir_depth, options, cache, journal)
+    if watcher is not None:
+        media_files = watcher.add_watches(media_files, dir_path)
+    media_files = extract_date_time_strs(media_files, options, executor, cache)
+    file_comparer = FileComparer(options.hash, options.context.stats)
+    media_files = plan_renames(media_files, options, file_comparer)
+    if plan_file is not None:
+        media_files = write_plan(media_files, plan_file, dir_path, options.context.stats)
+    else:
+        media_files = apply_renames(media_files, options, cache, journal)
+    for _ in media_files:
+        pass
+
+
+## https://man7.org/linux/man-pages/man7/inotify.7.html
+## https://docs.python.org/3/library/ctypes.html
+## imported by InotifyWatcher and watch_directory(), i.e. with option --watch only
+# import ctypes
+# import ctypes.util
+# import select
+# import signal
+
+## inotify event masks and flags, see <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+## struct inotify_event header: watch descriptor, mask, cookie and length of the name following it
+INOTIFY_EVENT_HEADER = struct.Struct('iIII')
+INOTIFY_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+## size of buffer for reading inotify events at once
+INOTIFY_BUFFER_SIZE = 65536
+
+## maximum number of new files processed per single batch in watch mode
+WATCH_BATCH = 1000
+## maximum number of unmatched cookies of files moved from a watched directory, kept to recognize them moved within the tree
+WATCH_COOKIES = 1024
+
+class InotifyWatcher:
+    ''' Watches directory tree for new files (option --watch), using Linux inotify through ctypes, i.e. no extra dependency.
+
+        A file becomes pending once closed after writing or moved in from outside the tree, and ready once debounce
+        seconds have passed without it being modified (or closed) again, i.e. once it is not being written anymore.
+        Files moved (or renamed) within the tree, including the renamed media files, are not new and get ignored.
+        Sub-directories created within the tree get watched too (up to maximum depth), with files found in them pending.
+        Sub-directories failing to be watched get reported by given logger. Not thread-safe - to be used by the main thread only.
+    '''
+
+    def __init__(self, max_depth, debounce, is_ignored=None, logger=None):
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.inotify_add_watch = libc.inotify_add_watch  ## AttributeError if not available
+        self.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, 'inotify_init1() failed: %s' % os.strerror(errno))
+        self.max_depth = max_depth
+        self.debounce = debounce
+        self.is_ignored = is_ignored
+        self.logger = logger if logger is not None else Logger(None, LOG_ERROR)
+        ## watched directories by watch descriptor, as tuples (dir_path, dir_depth)
+        self.watches = {}
+        ## pending files, as (time.monotonic() of their last event, dir_depth) by path
+        self.pending = {}
+        self.moved_cookies = collections.OrderedDict()
+
+    def add_watch(self, dir_path, dir_depth):
+        wd = self.inotify_add_watch(self.fd, os.fsencode(dir_path), INOTIFY_WATCH_MASK)
+        if wd < 0:
+            import ctypes
+            errno = ctypes.get_errno()
+            raise OSError(errno, 'inotify_add_watch() failed: %s' % os.strerror(errno), str(dir_path))
+        self.watches[wd] = (dir_path, dir_depth)
+
+    def add_directory(self, dir_path, dir_depth, pending=True):
+        ''' Watches new sub-directory (and its sub-directories), with all the files in there pending, as created before the watch,
+            unless processed already.
+        '''
+        try:
+            self.add_watch(dir_path, dir_depth)
+            with os.scandir(dir_path) as dir_entries:
+                dir_entries = list(dir_entries)
+        except OSError as e:
+            self.logger.warning('watch-directory', '  WARNING: Sub-directory path "%s" cannot be watched: %s => ignoring ... ', dir_path, e)
+            return
+        for dir_entry in dir_entries:
+            if dir_entry.is_dir(follow_symlinks=False):
+                if self.max_depth > dir_depth:
+                    self.add_directory(dir_path.joinpath(dir_entry.name), dir_depth + 1, pending)
+            elif pending is True and dir_entry.is_file():
+                self.add_pending(dir_path.joinpath(dir_entry.name), dir_depth)
+
+    def add_watches(self, media_files, root_path):
+        ''' Scan stage pass-through - watches directories yielded by scan_directory() (walking the tree from given root path),
+            each one right before it gets listed, so that no files added meanwhile get missed, nor any directory listed twice.
+
+            Directories completed by an interrupted run (see RenameJournal) are not entered by the scan stage, so they get walked
+            just for watching them.
+        '''
+        for media_file in media_files:
+            if media_file.kind == 'directory':
+                self.add_watch(media_file.path, media_file.depth)
+            elif media_file.kind == 'done-directory':
+                ## yielded at the depth of its parent directory, unless the root one
+                self.add_directory(media_file.path, media_file.depth + (media_file.path != root_path), pending=False)
+            yield media_file
+
+    def add_pending(self, file_path, dir_depth):
+        if self.is_ignored is None or not self.is_ignored(file_path):
+            self.pending[file_path] = (time.monotonic(), dir_depth)
+
+    def wait(self):
+        ''' Waits for events (up to the time the first pending file is due), and handles them.
+
+            Returns False on inotify queue overflow, i.e. once some events have been lost, otherwise True.
+        '''
+        timeout = None
+        if self.pending:
+            timeout = max(0.0, min(event_time for (event_time, _) in self.pending.values()) + self.debounce - time.monotonic())
+        import select
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return True
+
+        data = os.read(self.fd, INOTIFY_BUFFER_SIZE)
+        position = 0
+        complete = True
+        while position < len(data):
+            (wd, mask, cookie, name_size) = INOTIFY_EVENT_HEADER.unpack_from(data, position)
+            name = os.fsdecode(data[position + INOTIFY_EVENT_HEADER.size:position + INOTIFY_EVENT_HEADER.size + name_size].rstrip(b'\0'))
+            position += INOTIFY_EVENT_HEADER.size + name_size
+
+            if mask & IN_Q_OVERFLOW:
+                complete = False
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
                 continue
+            if wd not in self.watches:
+                continue
+            (dir_path, dir_depth) = self.watches[wd]
+            file_path = dir_path.joinpath(name)
+
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and self.max_depth > dir_depth:
+                    self.add_directory(file_path, dir_depth + 1)
+            elif mask & IN_MOVED_FROM:
+                self.pending.pop(file_path, None)
+                self.moved_cookies[cookie] = file_path
+                if len(self.moved_cookies) > WATCH_COOKIES:
+                    self.moved_cookies.popitem(last=False)
+            elif mask & IN_MOVED_TO:
+                ## moved within the tree (e.g. renamed), rather than moved in
+                if self.moved_cookies.pop(cookie, None) is None:
+                    self.add_pending(file_path, dir_depth)
+            elif mask & IN_CLOSE_WRITE:
+                self.add_pending(file_path, dir_depth)
+            elif mask & IN_MODIFY:
+                if file_path in self.pending:
+                    self.add_pending(file_path, dir_depth)
+            elif mask & IN_DELETE:
+                self.pending.pop(file_path, None)
+        return complete
+
+    def pop_ready(self, max_count=WATCH_BATCH):
+        ''' Returns up to given number of files not written for debounce seconds, as list of tuples (file_path, dir_depth). '''
+        now = time.monotonic()
+        ready = []
+        for (file_path, (event_time, dir_depth)) in self.pending.items():
+            if now - event_time >= self.debounce:
+                ready.append((file_path, dir_depth))
+                if len(ready) >= max_count:
+                    break
+        for (file_path, _) in ready:
+            del self.pending[file_path]
+        return ready
+
+    def close(self):
+        os.close(self.fd)
+
+
+def scan_watched_files(file_paths, options, cache=None, journal=None):
+    ''' Watch mode scan stage - yields MediaFile records of given new files, as tuples (file_path, dir_depth), by their directories.
+
+        Stats each file by its path, rather than listing its directory; names of each directory get analyzed at once,
+        and the directory gets listed only once any of its files is to be checked for collisions, see DirectoryNames.
+    '''
+    stats = options.context.stats
+    dir_files = collections.defaultdict(dict)
+    for (file_path, dir_depth) in file_paths:
+        dir_files[file_path.parent][file_path.name] = dir_depth
+    for (dir_path, file_depths) in dir_files.items():
+        started = time.perf_counter()
+        file_entries = []
+        for file_name in file_depths:
+            file_path = dir_path.joinpath(file_name)
+            try:
+                file_stat = os.stat(file_path)
+            except OSError:
+                continue  ## removed meanwhile
+            if stat.S_ISREG(file_stat.st_mode):
+                file_entries.append(FileEntry(file_path, file_stat))
+        stats.add_stage('scan', started)
+
+        started = time.perf_counter()
+        (file_media_types, date_time_searches) = analyze_file_names([file_entry.name for file_entry in file_entries], options.media_types)
+        stats.add_stage('names', started)
+        dir_names = DirectoryNames(dir_path, stats)
+        for (file_entry, media_type, date_time_search) in zip(file_entries, file_media_types, date_time_searches):
+            yield MediaFile(dir_path.joinpath(file_entry.name), file_depths[file_entry.name], 'file', file_entry, dir_names, media_type, date_time_search)
+
+
+def watch_directory(dir_path, dir_depth, options, executor=None, cache=None, journal=None):
+    ''' Watch mode (option --watch) - processes directory tree, then keeps processing new files in there, until interrupted.
+
+        New files get processed in batches, by the same stages as in process_directory(), with the cache committed
+        and the journal flushed after each batch. Stops on Ctrl+C (or SIGTERM) while waiting for new files.
+        Raises OSError if inotify is not available.
+    '''
+    logger = options.context.logger
+    is_ignored = lambda file_path: (cache is not None and cache.is_cache_file(file_path)) or (journal is not None and journal.is_journal_file(file_path))
+    try:
+        watcher = InotifyWatcher(options.max_depth, options.debounce, is_ignored, logger)
+    except AttributeError:
+        raise OSError('inotify is not available on this platform')
+
+    ## terminated just like interrupted, so as to finish the batch and close the journal as completed
+    import signal
+    previous_handler = signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        process_directory(dir_path, dir_depth, options, executor, cache, None, journal, watcher)
 
-            if date_time is None:
-                print('  WARNING: File path "%s" (video) is missing original/creation date-time => skipping ... ' % file_path)
-                failed_count += 1
+        while True:
+            logger.flush()
+            try:
+                complete = watcher.wait()
+            except KeyboardInterrupt:
+                logger.info('watch-end', 'INFO: Stopped watching directory path "%s" ... ', dir_path)
+                break
+            if complete is not True:
+                logger.warning('watch-overflow', 'WARNING: Too many events of watched directory path "%s" => processing it all again ... ', dir_path)
+                process_directory(dir_path, dir_depth, options, executor, cache, None, journal, watcher)
                 continue
 
-            date_time_str = date_time.strftime("%Y%m%d_%H%M%S")
-
-        #     mov_parser = hachoir_parser.createParser(file_path)
-        #     if mov_parser is None:
-        #         print('  WARNING! Failed to parse video file - unsupported format => skipping ... ')
-        #         mov_parser.stream._input.close()
-        #         continue
-
-        #     # print '  DEBUG: mov_parser.getFieldType()=%s, .mime_type=%s ' % (mov_parser.getFieldType(), mov_parser.mime_type)
-        #     if mov_parser.getFieldType() != 'MovFile':
-        #         print('  WARNING! Failed to parse video file - not a MOV/MP4 file => skipping ... ')
-        #         mov_parser.stream._input.close()
-        #         continue
-
-        #     processed_count += 1
-
-        #     moov_atom = next((field for field in mov_parser if field.description == u'Atom: moov'), None)
-        #     if moov_atom is None:
-        #         print('  ERROR! Failed to parse video file - missing "moov" atom; skipping ... ')
-        #         mov_parser.stream._input.close()
-        #         continue
-
-        #     movie_atom_list = None
-        #     try:
-        #         movie_atom_list = moov_atom.getField('movie')
-        #     except hachoir_core.field.field.MissingField:
-        #         print('  ERROR! Failed to parse video file - missing "movie" atom-list; skipping ... ')
-        #         mov_parser.stream._input.close()
-        #         continue
-
-        #     mvhd_atom = next((field for field in movie_atom_list if field.description == u'Atom: mvhd'), None)
-        #     if movie_atom_list is None:
-        #         print('  ERROR! Failed to parse video file - missing "mvhd" atom; skipping ... ')
-        #         mov_parser.stream._input.close()
-        #         continue
-
-        #     movie_hdr = None
-        #     try:
-        #         movie_hdr = mvhd_atom.getField('movie_hdr')
-        #     except hachoir_core.field.field.MissingField:
-        #         print('  ERROR! Failed to parse video file - missing "movie_hdr"; skipping ... ')
-        #         mov_parser.stream._input.close()
-        #         continue
-
-        #     ## WARNING: it does not work without this dummy iteration
-        #     for field in movie_hdr:
-        #         pass
-
-        #     creation_date_atom = None
-        #     try:
-        #         creation_date_atom = movie_hdr.getField('creation_date')
-        #     except hachoir_core.field.field.MissingField:
-        #         print('  ERROR! Failed to parse video file - missing "creation_date" atom; skipping ... ')
-        #         mov_parser.stream._input.close()
-        #         continue
-
-        #     # >>> creation_date = mov_parser.getField('/atom[1]/movie/atom[0]/movie_hdr/creation_date')
-        #     # >>> creation_date.getFieldType()
-        #     # 'TimestampUnix32'
-        #     # >>> repr(creation_date)
-        #     # "<TimestampUnix32 path='/atom[1]/movie/atom[0]/movie_hdr/creation_date', address=32, size=32>"
-        #     # >>> str(creation_date)
-        #     # '2017-03-03 14:36:52'
-
-        #     date_time_str = str(creation_date_atom).replace('-', '').replace(' ', '_').replace(':', '')
-
-        #     mov_parser.stream._input.close()
-        else:
-            print('  INFO: File name "%s" guessed mime-type is neither image nor video => skipping ... ' % file_name)
-            skipped_count += 1
-            continue
+            ready = watcher.pop_ready()
+            while ready:
+                logger.info('watch-batch', 'Processing %d new files in directory path "%s" ... ', len(ready), dir_path)
+                ## files compared for collisions get remembered per batch only, not to pile up while watching
+                file_comparer = FileComparer(options.hash, options.context.stats)
+                media_files = scan_watched_files(ready, options, cache, journal)
+                media_files = extract_date_time_strs(media_files, options, executor, cache)
+                media_files = plan_renames(media_files, options, file_comparer)
+                media_files = apply_renames(media_files, options, cache, journal)
+                for _ in media_files:
+                    pass
+                if cache is not None:
+                    cache.commit()
+                if journal is not None:
+                    journal.sync()
+                ready = watcher.pop_ready()
+    finally:
+        signal.signal(signal.SIGTERM, previous_handler)
+        watcher.close()
+
+
+def read_plan(plan_file):
+    ''' Read rename plan written in plan mode; returns the directory path recorded in its header and iterator of entries. '''
+    header = json.loads(plan_file.readline() or 'null')
+    if not isinstance(header, dict) or header.get('plan') != PLAN_VERSION:
+        raise ValueError('not a rename plan file of version %d' % PLAN_VERSION)
+    return header['path'], (json.loads(line) for line in plan_file if line.strip())
+
+
+def rename_planned_file(file_path, new_file_path, options, cache=None):
+    (logger, stats) = (options.context.logger, options.context.stats)
+
+    ## could have been created by another rename of the same journal batch
+    if new_file_path.exists():
+        logger.error('target-exists', '  ERROR: New file path "%s" already exists; consider planning again => skipping ... ', new_file_path)
+        stats.failed_count += 1
+        return False
+
+    logger.info('rename', '  INFO: Renaming file name "%s" to "%s" ... ', file_path.name, new_file_path.name)
+    started = time.perf_counter()
+    try:
+        if new_file_path.parent != file_path.parent:
+            ## into sub-directories, by output file naming template
+            new_file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.rename(new_file_path)
+    except OSError as e:
+        logger.error('rename-failed', '  ERROR! Failed to rename file path "%s": %s => skipping ... ', file_path, e)
+        stats.failed_count += 1
+        return False
+    stats.add_stage('rename', started)
+    if cache is not None:
+        cache.rename(file_path, new_file_path)
+    return True
+
+
+def apply_results(results, options, cache=None, journal=None):
+    ''' Renames files of Result records to be renamed (unless in dry-run mode), without parsing any media file metadata.
+
+        Renames only files unchanged since resolved (by size and modification time), and never overwrites any existing file.
+        With rename journal given, renames get applied in batches, recorded in the journal, see RenameJournal.
+        Yields the records, with status updated once renamed (or failed to), not necessarily in the same order.
+    '''
+    (logger, stats) = (options.context.logger, options.context.stats)
 
+    def rename(file_path, new_file_path, result):
+        renamed = rename_planned_file(file_path, new_file_path, options, cache)
+        result.status = RESULT_STATUS_RENAMED if renamed else PLAN_STATUS_FAIL
+        return renamed
 
-        # print('  DEBUG: date_time_str [%s] ' % (date_time_str,))
-        if date_time_str is None:
-            print('  ERROR! Failed to determine original/creation date-time for image or video => skipping ... ')
-            failed_count += 1
+    for result in results:
+        if result.status != PLAN_STATUS_RENAME:
+            yield result
             continue
 
-        ## verify pattern of the date-time string
-        if date_time_verify_re.match(date_time_str) is None:
-            print('  ERROR! Invalid/unexpected format of determined date-time string "%s" => skipping ... ' % (date_time_str,))
-            failed_count += 1
+        file_path = result.path
+        new_file_path = result.new_path
+        if journal is not None and journal.is_rename_done(file_path):
+            ## counted as renamed already
+            logger.info('renamed-already', '  INFO: File name "%s" renamed already by interrupted run => skipping ... ', file_path.name)
+            result.status = PLAN_STATUS_SKIP
+            yield result
+            continue
+        try:
+            file_stat = file_path.stat()
+        except OSError:
+            logger.error('missing', '  ERROR! File path "%s" does not exist any more => skipping ... ', file_path)
+            stats.failed_count += 1
+            result.status = PLAN_STATUS_FAIL
+            yield result
+            continue
+        if (file_stat.st_size, file_stat.st_mtime_ns) != (result.size, result.mtime_ns):
+            logger.warning('changed', '  WARNING: File path "%s" has changed since planning => skipping ... ', file_path)
+            stats.failed_count += 1
+            result.status = PLAN_STATUS_FAIL
+            yield result
+            continue
+        ## unless to be renamed by a rename batched before (then checked again once renaming, see rename_planned_file())
+        if new_file_path.exists() and not (journal is not None and journal.is_batched_source(new_file_path)):
+            logger.error('target-exists', '  ERROR: New file path "%s" already exists; consider planning again => skipping ... ', new_file_path)
+            stats.failed_count += 1
+            result.status = PLAN_STATUS_FAIL
+            yield result
             continue
 
+        if options.dry_run is True:
+            logger.info('dry-run-rename', '  INFO: Dry-run - would be renaming file name "%s" to "%s" ... ', file_path.name, new_file_path.name)
+            yield result
+            continue
 
-        ## verify current file-name containts either the same or any other date-time string
-        if date_time_search is not None:
-            current_date_time_prefix = date_time_search.groups()[0]
-            current_date_time_str = date_time_search.groups()[1]
-            if current_date_time_prefix == '':
-                if current_date_time_str == date_time_str:
-                    print('  INFO: File name "%s" already starts with original/creation date-time string "%s"' % (file_name, date_time_str), end='')
-                else:
-                    print('  WARNING: File name "%s" apparently starts with date-time string "%s" other than determined "%s"' % (file_name, current_date_time_str, date_time_str), end='')
-            else:
-                if current_date_time_str == date_time_str:
-                    print('  INFO: File name "%s" apparently contains original/creation date-time string "%s"' % (file_name, date_time_str), end='')
-                else:
-                    print('  WARNING: File name "%s" apparently contains date-time string "%s" other than determined "%s"' % (file_name, current_date_time_str, date_time_str), end='')
+        if journal is None:
+            rename(file_path, new_file_path, result)
+            yield result
+        elif journal.add_rename(file_path, new_file_path, result):
+            yield from journal.apply_batch(rename)
 
-            if options.force is True:
-                print(' => forcing rename ... ')
-            else:
-                print(' => skipping ... ')
-                skipped_count += 1
-                continue
+    if journal is not None:
+        yield from journal.apply_batch(rename)
 
-        new_file_name = ''
-        if options.erase is True:
-            new_file_name = date_time_str + file_path.suffix
-        elif file_name.startswith(date_time_str):
-            new_file_name = file_name
-        else:
-            new_file_name = date_time_str + '_' + file_name
 
-        if new_file_name == file_name:
-            print('  INFO: Keeping original file name "%s" => skipping ... ' % (file_name))
+def read_plan_results(entries, dir_path, options):
+    ''' Yields Result records of rename plan entries (see read_plan()), counting them by the counters recorded by the plan stage,
+        see write_plan(); entries failing to be renamed get counted as failed too, see apply_results().
+    '''
+    (stats, progress) = (options.context.stats, options.context.progress)
+    for entry in entries:
+        stats.files_count += 1
+        if progress is not None:
+            progress.update(stats.files_count)
+        counts = entry.get('counts')
+        if counts is None:
+            ## written by a previous version
+            counts = {PLAN_STATUS_RENAME: ('processed', 'renamed'), PLAN_STATUS_FAIL: ('failed',)}.get(entry['status'], ('skipped',))
+        if 'processed' in counts:
+            stats.processed_count += 1
+        if 'renamed' in counts:
+            stats.renamed_count += 1
+        if 'skipped' in counts:
+            stats.skipped_count += 1
+        if 'failed' in counts:
+            stats.failed_count += 1
+        if entry['status'] != PLAN_STATUS_RENAME:
+            yield Result(dir_path.joinpath(entry['source']), None, entry['status'], None, entry['date_time'], entry['date_source'])
             continue
 
-        renamed_count += 1
+        yield Result(dir_path.joinpath(entry['source']), dir_path.joinpath(entry['target']), entry['status'], None, entry['date_time'], entry['date_source'], None, entry['size'], entry['mtime_ns'])
 
-        # new_file_path = dir_path.joinpath(new_file_name)
-        new_file_path = file_path.with_name(new_file_name)
-        # print('new_file_path=%s' % (new_file_path,))
-        if new_file_path.exists():
-            ## TODO: consider using the '--force' option to erase duplicate?
-            if read_sha1_hexhash(file_path) == read_sha1_hexhash(new_file_path):
-                print('  WARNING: New file name "%s" already exists and is identical file to the original file name "%s"; consider removing duplicate => skipping ... ' % (new_file_name, file_name))
-            else:
-                print('  ERROR: New file name "%s" already exists and is different file than the original file name "%s"; consider manual renaming => skipping ... ' % (new_file_name, file_name))
-            failed_count += 1
+
+def apply_plan(plan_file, dir_path, options, cache=None, journal=None):
+    ''' Apply mode - renames files according to the rename plan entries, without parsing any media file metadata, see apply_results(). '''
+    options.context.logger.info('apply', 'Applying rename plan to directory path "%s" ... ', dir_path)
+    for _ in apply_results(read_plan_results(plan_file, dir_path, options), options, cache, journal):
+        pass
+
+
+def undo_renames(records, dir_path, options, cache=None, journal=None):
+    ''' Undo mode - renames files back, replaying the renames recorded in the journal in reverse order.
+
+        Each rename undone gets recorded in the journal, so that undoing can be interrupted and run again.
+    '''
+    (logger, stats, progress) = (options.context.logger, options.context.stats, options.context.progress)
+
+    logger.info('undo', 'Undoing renames in directory path "%s" ... ', dir_path)
+    undone_count = 0
+    renames = get_journal_renames(records, dir_path, pending=True)
+    if progress is not None:
+        progress.restart(len(renames))
+    for (source, target) in reversed(renames):
+        stats.files_count += 1
+        if progress is not None:
+            progress.update(stats.files_count)
+        stats.processed_count += 1
+        file_path = dir_path.joinpath(target)
+        new_file_path = dir_path.joinpath(source)
+        if not file_path.exists():
+            logger.error('missing', '  ERROR! Renamed file path "%s" does not exist any more => skipping ... ', file_path)
+            stats.failed_count += 1
             continue
 
-        if options.dry_run is not True:
-            print('  INFO: Renaming file name "%s" to "%s" ... ' % (file_name, new_file_name))
-            # try:
-            file_path.rename(new_file_path)
-            # except
+        if options.dry_run is True:
+            logger.info('dry-run-undo', '  INFO: Dry-run - would be renaming file name "%s" back to "%s" ... ', file_path.name, new_file_path.name)
+            continue
+
+        if rename_planned_file(file_path, new_file_path, options, cache):
+            stats.renamed_count += 1
+            journal.write_record(op='undo', source=source, target=target)
+            undone_count += 1
+            if undone_count % JOURNAL_BATCH == 0:
+                journal.sync()
+
+    if journal is not None:
+        journal.write_record(op='undone')
+
+
+def scan_paths(paths, options, cache=None, journal=None):
+    ''' Scan stage of Renamer - yields MediaFile records of given files, and of files within given directories (see scan_directory()).
+
+        Consecutive files get listed by their directories, see scan_watched_files(); missing ones are yielded as such.
+    '''
+    file_paths = []
+    for path in paths:
+        path = pathlib.Path(path).absolute()
+        if path.is_dir():
+            yield from scan_watched_files(file_paths, options, cache, journal)
+            file_paths = []
+            yield from scan_directory(path, 0, options, cache, journal)
+        elif path.is_file():
+            file_paths.append((path, 0))
         else:
-            print('  INFO: Dry-run - would be renaming file name "%s" to "%s" ... ' % (file_name, new_file_name))
+            yield from scan_watched_files(file_paths, options, cache, journal)
+            file_paths = []
+            yield MediaFile(path, 0, 'missing')
+    yield from scan_watched_files(file_paths, options, cache, journal)
+
+
+def build_name_template(options):
+    ''' Returns compiled output file naming template (option --template), if any. Raises ValueError on invalid template. '''
+    if options.template is None:
+        return None
+    if options.erase is True:
+        raise ValueError('option --erase cannot be used with option --template')
+    return NameTemplate(options.template)
+
 
+def build_config(**settings):
+    ''' Returns configuration of Renamer, i.e. the default command line options overridden by given settings.
 
-def main(argv=None):
+        Settings are named after the option destinations, e.g. build_config(max_depth=2, dry_run=True, ext='mts=video').
+        Raises ValueError on unknown setting, invalid extra media types, unknown date-time source or invalid template.
+    '''
+    config = build_option_parser().get_default_values()
+    for (name, value) in settings.items():
+        if not hasattr(config, name):
+            raise ValueError('unknown setting: %s' % name)
+        setattr(config, name, value)
+    config.command = None
+    ## of stages called directly; each Renamer runs with a context of its own
+    config.context = RunContext(Logger(None, LOG_ERROR), RunStats())
+    config.media_types = build_media_types(config.ext)
+    config.date_sources = build_date_sources(config.date_source)
+    config.name_template = build_name_template(config)
+    if not is_hash_available(config.hash):
+        raise ValueError('hash algorithm xxhash is not available (pip install xxhash)')
+    return config
+
+
+class Renamer:
+    ''' Library API - resolves new file names of media files and renames them, see resolve() and apply().
+
+        Meant to be reused for any number of batches of paths, e.g. by a long-lived ingest service: the extraction
+        worker threads, metadata cache and media types are kept between the batches, rather than set up again for each one.
+        Configured by options as returned by build_config() (or as parsed by main()); by default, no metadata cache
+        nor rename journal is used, unless given (or option --cache is set), and only errors get logged.
+        Logs and counts by a logger and stats of its own (see RunContext), kept along with its copy of the configuration,
+        so any number of renamers can be used at once, though each one by a single thread.
+    '''
+
+    def __init__(self, config=None, cache=None, journal=None, logger=None, stats=None, progress=None):
+        ## copied, so that renamers sharing the configuration do not share their contexts
+        self.config = optparse.Values(vars(config)) if config is not None else build_config()
+        self.logger = logger if logger is not None else Logger(None, LOG_ERROR)
+        self.stats = stats if stats is not None else RunStats()
+        self.config.context = RunContext(self.logger, self.stats, progress)
+        self.cache = cache
+        if cache is None and self.config.no_cache is not True and self.config.cache is not None:
+            self.cache = open_cache(self.config.cache, self.config)
+        self.journal = journal
+        self.executor = None
+        if self.config.jobs > 1:
+            import concurrent.futures
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.config.jobs)
+
+    def resolve(self, paths):
+        ''' Resolves new file names of given files, and of files within given directories (walked up to maximum depth),
+            without renaming any; yields Result records of the files, in directory listing order.
+
+            Files compared for collisions get remembered for a single call only, see FileComparer.
+        '''
+        file_comparer = FileComparer(self.config.hash, self.stats)
+        media_files = scan_paths(paths, self.config, self.cache, self.journal)
+        media_files = extract_date_time_strs(media_files, self.config, self.executor, self.cache)
+        for media_file in plan_renames(media_files, self.config, file_comparer):
+            if media_file.status is not None:
+                yield make_result(media_file)
+        if self.cache is not None:
+            self.cache.commit()
+
+    def apply(self, results):
+        ''' Renames files of given Result records to be renamed (unless in dry-run mode), see apply_results().
+
+            Returns list of the records, with status updated. Records resolved by this renamer have been counted as renamed
+            already, so those failing to be renamed now get counted as failed too, just like a colliding file, see plan_rename().
+        '''
+        results = list(apply_results(results, self.config, self.cache, self.journal))
+        if self.cache is not None:
+            self.cache.commit()
+        if self.journal is not None:
+            self.journal.sync()
+        self.logger.flush()
+        return results
+
+    def process(self, dir_path, plan_file=None):
+        ''' Processes directory tree (see process_directory()), or keeps watching it with option --watch (see watch_directory()). '''
+        if self.config.watch is True:
+            watch_directory(dir_path, 0, self.config, self.executor, self.cache, self.journal)
+        else:
+            process_directory(dir_path, 0, self.config, self.executor, self.cache, plan_file, self.journal)
+
+    def close(self, completed=True):
+        ''' Shuts the extraction worker threads down, and closes the rename journal (recording the run as completed if so) and the metadata cache. '''
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+        if self.journal is not None:
+            self.journal.close(completed)
+        if self.cache is not None:
+            self.cache.close()
+        self.logger.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(exc_type is None)
+
+
+def open_journal(dir_path, options):
+    ''' Opens rename journal for renaming files, resuming it (with option --resume) if recorded run was interrupted.
+
+        Returns None if journal is disabled, as well as in dry-run mode and for command plan, i.e. when nothing gets renamed,
+        and if recorded run was interrupted but not to be resumed (so that it can still be resumed or undone later);
+        raises ValueError if it cannot be opened (or resumed).
+    '''
+    if options.no_journal is True or options.dry_run is True or options.command == 'plan':
+        return None
+
+    journal_path = options.journal if options.journal is not None else dir_path.joinpath(JOURNAL_FILE_NAME)
+    if not os.path.isfile(journal_path):
+        if options.resume is True:
+            raise ValueError('there is no journal "%s" to resume' % (journal_path,))
+        return RenameJournal(journal_path, dir_path, options.command, stats=options.context.stats)
+
+    (header, records) = read_journal(journal_path)
+    state = get_journal_state(records)
+    if options.resume is not True:
+        if state == 'interrupted':
+            options.context.logger.warning('journal-interrupted', 'WARNING: Rename journal "%s" records an interrupted run; use option --resume to resume it, or command undo to undo it => renaming without journal ... ', journal_path)
+            return None
+        return RenameJournal(journal_path, dir_path, options.command, stats=options.context.stats)
+
+    if state != 'interrupted':
+        raise ValueError('journal "%s" records a run which is %s, nothing to resume' % (journal_path, state))
+    if header['path'] != str(dir_path) or header.get('command') != options.command:
+        raise ValueError('journal "%s" records a run of other command or directory path "%s"' % (journal_path, header['path']))
+    journal = RenameJournal(journal_path, dir_path, options.command, records, options.context.stats)
+    options.context.logger.info('resume', 'INFO: Resuming interrupted run - directories done: %d, renames done: %d ... ', len(journal.done_dirs), len(journal.done_renames))
+    return journal
+
+
+def open_cache(cache_path, options):
+    ''' Opens metadata cache for lookups and updates; in dry-run mode, for lookups only, and only if it exists already,
+        so that nothing gets written within the directory path.
+    '''
+    if options.dry_run is not True:
+        return MetadataCache(cache_path, stats=options.context.stats)
+    if os.path.isfile(cache_path):
+        return MetadataCache(cache_path, read_only=True, stats=options.context.stats)
+    return None
+
+
+def open_existing_cache(dir_path, options):
+    ''' Opens metadata cache for updating it along with renamed files only, i.e. never creates it (nor opens it in dry-run mode). '''
+    cache_path = options.cache if options.cache is not None else dir_path.joinpath(CACHE_FILE_NAME)
+    if options.no_cache is not True and options.dry_run is not True and os.path.isfile(cache_path):
+        return MetadataCache(cache_path, stats=options.context.stats)
+    return None
+
+
+def print_summary(options, cache=None):
+    (logger, stats, progress) = (options.context.logger, options.context.stats, options.context.progress)
+    if progress is not None:
+        progress.close(stats.files_count)
+    if options.command == 'undo':
+        summary = 'Files total: %d, processed: %d, renamed back: %d, skipped: %d, failed: %d'
+    elif options.command == 'plan':
+        summary = 'Files total: %d, processed: %d, planned to be renamed: %d, skipped: %d, failed: %d'
+    elif options.dry_run is True:
+        summary = 'Files total: %d, processed: %d, dry-run - would be renamed: %d, skipped: %d, failed: %d'
+    else:
+        summary = 'Files total: %d, processed: %d, renamed: %d, skipped: %d, failed: %d'
+    summary %= (stats.files_count, stats.processed_count, stats.renamed_count, stats.skipped_count, stats.failed_count)
+    if options.trust_window is not None:
+        summary += ', trusted: %d' % stats.trusted_count
+    if stats.strategy_counts:
+        summary += ', %s' % ', '.join('%s: %d' % item for item in sorted(stats.strategy_counts.items()))
+    if stats.source_counts:
+        summary += ', %s' % ', '.join('from %s: %d' % item for item in sorted(stats.source_counts.items()))
+    if cache is not None:
+        summary += ', cache hits: %d, misses: %d' % (cache.hit_count, cache.miss_count)
+    logger.log(LOG_SUMMARY, 'summary', summary)
+
+
+def build_option_parser():
+    ''' Returns parser of the command line options, see main(). '''
+    parser = optparse.OptionParser(usage='%prog [options]\n'
+        '       %prog plan PLAN [options] - writes rename plan (JSON lines) to file PLAN, without renaming any files\n'
+        '       %prog apply PLAN [options] - renames files according to rename plan file PLAN, without parsing any media files\n'
+        '       %prog undo [options] - renames files back, according to the rename journal of the last (or interrupted) run')
+    parser.add_option('-p', '--path', action='store', default=None, dest='path', help='directory path to start processing from; default is the current directory (or, for apply command, the directory path of the plan)') #, metavar='')
+    parser.add_option('-r', '--recursive', action='store_true', default=False, dest='recursive', help='whether to process directories recursively; obsoleted by option --max-depth')
+    parser.add_option('-e', '--erase', action='store_true', default=False, dest='erase', help='whether to completely erase original file name (but keep extendsion); by default prepends the data-time string to the original name')
+    parser.add_option('', '--template', action='store', default=None, dest='template', help='template of new file names, e.g. "{date:%%Y/%%m/%%Y%%m%%d_%%H%%M%%S}_{stem}{ext_lower}" (slashes make sub-directories); fields: %s; by default prepends the date-time string to the original name' % ', '.join(TEMPLATE_FIELDS), metavar='TEMPLATE')
+    parser.add_option('-s', '--fast', action='store_true', default=False, dest='fast', help='whether to enable fast mode skipping of file names containing any date-time string')
+    parser.add_option('-d', '--dry-run', action='store_true', default=False, dest='dry_run', help='whether to run in dry-mode, i.e. without actually renaming image files')
+    parser.add_option('-f', '--force', action='store_true', default=False, dest='force', help='whether to force renaming even in current file name contains date-time string')
+    parser.add_option('-m', '--max-depth', action='store', type='int', default=1, dest='max_depth', help='determines maximum depth for processing directories recursively; default is 1; implies option --recursive')
+    parser.add_option('', '--trust-window', action='store', type='float', default=None, dest='trust_window', help='whether to trust (i.e. not to verify by reading the file) date-time string the file name starts with, if it matches file modification time within given number of seconds', metavar='SECONDS')
+    parser.add_option('', '--verify-fraction', action='store', type='float', default=0.01, dest='verify_fraction', help='fraction of files with trusted date-time string, which get verified anyway; default is 0.01', metavar='FRACTION')
+    parser.add_option('', '--ext', action='store', default=None, dest='ext', help='comma-separated list of extra file extensions with their media types (image, video or other), e.g. "jpg=image,mts=video"; by default media types are guessed by the system mime-types database', metavar='EXT=TYPE,...')
+    parser.add_option('', '--date-source', action='store', default='%s,%s' % (DATE_SOURCE_EXIF, DATE_SOURCE_MVHD), dest='date_source', help='comma-separated list of sources of the date-time string, tried in order: %s (EXIF original date-time of JPEG files), %s (creation date-time of the moov/mvhd atom of MOV/MP4 files), %s (QuickTime creation date of the moov/meta atom), %s (date-time string the file name contains already) and %s (file modification time); default is "%%default"' % (DATE_SOURCE_EXIF, DATE_SOURCE_MVHD, DATE_SOURCE_KEYS, DATE_SOURCE_FILE_NAME, DATE_SOURCE_MTIME), metavar='SOURCE,...')
+    parser.add_option('', '--hash', action='store', type='choice', choices=HASH_ALGORITHMS, default='sha1', dest='hash', help='hash algorithm for comparing files colliding by new file name: sha1, blake2b or xxhash (if installed); default is sha1')
+    parser.add_option('-x', '--one-file-system', action='store_true', default=False, dest='one_file_system', help='whether to skip sub-directories on file systems other than the one of the directory path')
+    parser.add_option('', '--skip-video', action='store_true', default=False, dest='skip_video', help='whether to process image files only, i.e. skip video files')
+    parser.add_option('', '--skip-image', action='store_true', default=False, dest='skip_image', help='whether to process video files only, i.e. skip image files')
+    parser.add_option('', '--cache', action='store', default=None, dest='cache', help='path of the metadata cache file, allowing to skip parsing of unchanged files on subsequent runs; default is "%s" file within the directory path' % CACHE_FILE_NAME, metavar='PATH')
+    parser.add_option('', '--no-cache', action='store_true', default=False, dest='no_cache', help='whether to disable the metadata cache')
+    parser.add_option('-q', '--quiet', action='count', default=0, dest='quiet', help='whether to log less: once for warnings and errors only (and the final summary), twice for errors only')
+    parser.add_option('-v', '--verbose', action='count', default=0, dest='verbose', help='whether to log more, i.e. debug messages as well')
+    parser.add_option('', '--log-format', action='store', type='choice', choices=('text', 'json'), default='text', dest='log_format', help='format of logged messages: text, or json (a JSON object per line, with time, level, event and message); default is text', metavar='FORMAT')
+    parser.add_option('', '--log-limit', action='store', type='int', default=None, dest='log_limit', help='maximum number of messages logged of each event (e.g. file name already starting with its date-time string); the rest are just counted and summarized every %d seconds' % LOG_SUPPRESSED_SECONDS, metavar='COUNT')
+    parser.add_option('', '--progress', action='store_true', default=False, dest='progress', help='whether to show progress line (on stderr): files processed, files and bytes of metadata read per second')
+    parser.add_option('', '--pre-count', action='store_true', default=False, dest='pre_count', help='whether to count files beforehand (by listing directories only), so that the progress line tells the estimated time left; implies option --progress')
+    parser.add_option('', '--stats', action='store', type='choice', choices=('text', 'json'), default=None, dest='stats', help='whether to print report of wall time, calls and bytes read by each stage and per-file extraction latency percentiles at exit, either as text or as a line of JSON', metavar='FORMAT')
+    parser.add_option('', '--profile', action='store', default=None, dest='profile', help='path of file to dump cProfile statistics of the main thread to, see python -m pstats', metavar='PATH')
+    parser.add_option('', '--watch', action='store_true', default=False, dest='watch', help='whether to keep watching the directory tree (Linux only, using inotify) after processing it, so as to process new files as soon as they are written, until interrupted')
+    parser.add_option('', '--debounce', action='store', type='float', default=2.0, dest='debounce', help='number of seconds a new file has to remain unmodified before it gets processed in watch mode; default is 2.0', metavar='SECONDS')
+    parser.add_option('', '--journal', action='store', default=None, dest='journal', help='path of the rename journal file, allowing to resume an interrupted run or to undo it; default is "%s" file within the directory path' % JOURNAL_FILE_NAME, metavar='PATH')
+    parser.add_option('', '--no-journal', action='store_true', default=False, dest='no_journal', help='whether to disable the rename journal')
+    parser.add_option('', '--resume', action='store_true', default=False, dest='resume', help='whether to resume the interrupted run recorded in the rename journal, skipping directories processed already')
+    parser.add_option('-j', '--jobs', action='store', type='int', default=os.cpu_count() or 1, dest='jobs', help='number of worker threads extracting date-time strings from media files in parallel, i.e. of file reads in flight; default is the number of CPU cores; 1 disables parallel extraction; for high-latency network shares, consider 32 or more')
+
+    return parser
+
+
+## https://docs.python.org/3/library/profile.html
+## imported by main(), with option --profile only
+# import cProfile
+
+def main(argv=None, stats=None):
     # # Decode the command line arguments to unicode
     # for i, a in enumerate(sys.argv):
     #     # >>> sys.stdin.encoding
@@ -479,19 +3132,67 @@ def main(argv=None):
 
     # print '  DEBUG: argv=%r' % (argv,)
 
-    parser = optparse.OptionParser()
-    parser.add_option('-p', '--path', action='store', default='.', dest='path', help='directory path to start processing from; default is the current directory') #, metavar='')
-    parser.add_option('-r', '--recursive', action='store_true', default=False, dest='recursive', help='whether to process directories recursively; obsoleted by option --max-depth')
-    parser.add_option('-e', '--erase', action='store_true', default=False, dest='erase', help='whether to completely erase original file name (but keep extendsion); by default prepends the data-time string to the original name')
-    parser.add_option('-s', '--fast', action='store_true', default=False, dest='fast', help='whether to enable fast mode skipping of file names containing any date-time string')
-    parser.add_option('-d', '--dry-run', action='store_true', default=False, dest='dry_run', help='whether to run in dry-mode, i.e. without actually renaming image files')
-    parser.add_option('-f', '--force', action='store_true', default=False, dest='force', help='whether to force renaming even in current file name contains date-time string')
-    parser.add_option('-m', '--max-depth', action='store', type='int', default=1, dest='max_depth', help='determines maximum depth for processing directories recursively; default is 1; implies option --recursive')
-    parser.add_option('', '--skip-video', action='store_true', default=False, dest='skip_video', help='whether to process image files only, i.e. skip video files')
-    parser.add_option('', '--skip-image', action='store_true', default=False, dest='skip_image', help='whether to process video files only, i.e. skip image files')
-
-    (options, _) = parser.parse_args()
-
+    ## counters and timings of the run, to be read by the caller if given; the stages count by those of their run, see RunContext
+    if stats is None:
+        stats = RunStats()
+
+    parser = build_option_parser()
+    (options, args) = parser.parse_args(argv[1:])
+
+    level = min(max(LOG_INFO + 10 * (options.quiet - options.verbose), LOG_DEBUG), LOG_ERROR)
+    logger = Logger(None, level, options.log_format, options.log_limit)
+    progress = None
+    if options.progress is True or options.pre_count is True:
+        logger.progress = progress = Progress(stats)
+    options.context = RunContext(logger, stats, progress)
+
+    options.command = args[0] if args else None
+    plan_path = None
+    if options.command in ('plan', 'apply'):
+        if len(args) != 2:
+            parser.error('command %s requires exactly one argument, the plan file path' % options.command)
+        plan_path = args[1]
+    elif options.command == 'undo':
+        if len(args) != 1:
+            parser.error('command undo does not take any arguments')
+    elif args:
+        parser.error('unknown command: %s' % args[0])
+    if options.watch is True and options.command is not None:
+        parser.error('option --watch cannot be used with command %s' % options.command)
+
+    try:
+        options.media_types = build_media_types(options.ext, stats)
+        options.date_sources = build_date_sources(options.date_source)
+        options.name_template = build_name_template(options)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if not is_hash_available(options.hash):
+        logger.warning('hash-unavailable', 'WARNING: Hash algorithm xxhash is not available (pip install xxhash) => using blake2b instead ... ')
+        options.hash = 'blake2b'
+
+    profiler = None
+    if options.profile is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+    try:
+        if profiler is not None:
+            return profiler.runcall(run, options, plan_path)
+        return run(options, plan_path)
+    finally:
+        if profiler is not None:
+            profiler.dump_stats(options.profile)
+        logger.flush()
+        if progress is not None:
+            progress.close(stats.files_count)
+        if options.stats is not None:
+            stats.print_report(logger, options.stats)
+        logger.close()
+
+
+def run(options, plan_path=None):
+    ''' Runs command given by already parsed command line options, see main(); returns the exit code. '''
+    (logger, progress) = (options.context.logger, options.context.progress)
     # print 'options=%r' % (options,)
     # # print 'args=%r' % (args,)
     # print 'options.path=%s' % (options.path)
@@ -499,27 +3200,119 @@ def main(argv=None):
     # working_path = path.Path('E:\Pictures')
     # working_path = path.Path('C:\Projects\Code\sample_imgs')
     # working_path = path.Path(u'C:\\Users\\Marcin\\Pictures\\2019-06 Vacation')
-    working_path = pathlib.Path(options.path)
+    if options.command == 'apply':
+        try:
+            plan_file = open(plan_path, 'r', encoding='utf-8')
+        except OSError as e:
+            logger.error('plan-file', 'ERROR! Specified plan file "%s" cannot be opened: %s => quitting ...', plan_path, e)
+            return 1
+        with plan_file:
+            try:
+                (plan_dir_path, entries) = read_plan(plan_file)
+            except ValueError as e:
+                logger.error('plan-file', 'ERROR! Specified plan file "%s" is invalid: %s => quitting ...', plan_path, e)
+                return 1
+
+            working_path = pathlib.Path(options.path if options.path is not None else plan_dir_path)
+            if not working_path.is_dir():
+                logger.error('working-path', 'ERROR! Specified working path "%s" is not a valid directory => quitting ...', working_path)
+                return 1
+            dir_path = working_path.resolve()
+
+            try:
+                journal = open_journal(dir_path, options)
+            except (OSError, ValueError, KeyError) as e:
+                logger.error('journal', 'ERROR! Rename journal cannot be used: %s => quitting ...', e)
+                return 1
+            cache = open_existing_cache(dir_path, options)
+
+            completed = False
+            try:
+                apply_plan(entries, dir_path, options, cache, journal)
+                completed = True
+            except (ValueError, KeyError, TypeError) as e:
+                logger.error('plan-file', 'ERROR! Specified plan file "%s" is invalid: %s => quitting ...', plan_path, e)
+                return 1
+            finally:
+                if journal is not None:
+                    journal.close(completed)
+                if cache is not None:
+                    cache.close()
+
+        print_summary(options, cache)
+        return 0
+
+    working_path = pathlib.Path(options.path if options.path is not None else '.')
     # print('  DEBUG: working_path="%s", .resolve()="%s"' % (working_path, working_path.resolve()))
     if not working_path.is_dir():
-        print('ERROR! Specified working path "%s" is not a valid directory => quitting ...' % (working_path,))
+        logger.error('working-path', 'ERROR! Specified working path "%s" is not a valid directory => quitting ...', working_path)
         return 1
 
 
     dir_path = working_path.resolve()
     dir_depth = 0
 
+    if options.command == 'undo':
+        journal_path = options.journal if options.journal is not None else dir_path.joinpath(JOURNAL_FILE_NAME)
+        try:
+            (header, records) = read_journal(journal_path)
+        except (OSError, ValueError) as e:
+            logger.error('journal', 'ERROR! Rename journal "%s" cannot be read: %s => quitting ...', journal_path, e)
+            return 1
+
+        journal = None
+        if options.dry_run is not True:
+            journal = RenameJournal(journal_path, dir_path, header.get('command'), records, options.context.stats)
+        cache = open_existing_cache(dir_path, options)
+        try:
+            undo_renames(records, dir_path, options, cache, journal)
+        finally:
+            if journal is not None:
+                journal.close(False)
+            if cache is not None:
+                cache.close()
+
+        print_summary(options, cache)
+        return 0
+
+    try:
+        journal = open_journal(dir_path, options)
+    except (OSError, ValueError, KeyError) as e:
+        logger.error('journal', 'ERROR! Rename journal cannot be used: %s => quitting ...', e)
+        return 1
+
     # all_file_paths = working_path.files()
     # # print '  DEBUG: all_file_paths=', all_file_paths
 
-    global files_count, processed_count, renamed_count, skipped_count, failed_count
 
-    process_directory(dir_path, dir_depth, options)
+    cache = None
+    if options.no_cache is not True:
+        cache = open_cache(options.cache if options.cache is not None else dir_path.joinpath(CACHE_FILE_NAME), options)
+    renamer = Renamer(options, cache, journal, logger, options.context.stats, progress)
 
-    if options.dry_run is True:
-        print('Files total: %d, processed: %d, dry-run - would be renamed: %d, skipped: %d, failed: %d' % (files_count, processed_count, renamed_count, skipped_count, failed_count))
-    else:
-        print('Files total: %d, processed: %d, renamed: %d, skipped: %d, failed: %d' % (files_count, processed_count, renamed_count, skipped_count, failed_count))
+    plan_file = None
+    if options.command == 'plan':
+        plan_file = open(plan_path, 'w', encoding='utf-8', newline='\n')
+        plan_file.write(json.dumps({'plan': PLAN_VERSION, 'path': str(dir_path)}, ensure_ascii=False) + '\n')
+
+    if progress is not None and options.pre_count is True:
+        progress.restart(count_files(dir_path, dir_depth, options, cache, journal))
+
+    completed = False
+    try:
+        renamer.process(dir_path, plan_file)
+        completed = True
+    except OSError as e:
+        if options.watch is not True:
+            raise
+        logger.error('watch', 'ERROR! Specified working path "%s" cannot be watched: %s => quitting ...', dir_path, e)
+        return 1
+    finally:
+        renamer.close(completed)
+        if plan_file is not None:
+            plan_file.close()
+
+    print_summary(options, cache)
 
     return 0
 
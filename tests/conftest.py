@@ -0,0 +1,10 @@
+# -*- coding: utf8  -*-
+
+import sys
+import pathlib
+
+ROOT_PATH = pathlib.Path(__file__).resolve().parent.parent
+
+## main3.py is a script rather than a package; builders of synthetic media files (shared with the benchmarks) live in here
+sys.path.insert(0, str(ROOT_PATH))
+sys.path.insert(0, str(ROOT_PATH.joinpath('tests')))
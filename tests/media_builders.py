@@ -0,0 +1,83 @@
+# -*- coding: utf8  -*-
+
+r"""Builders of synthetic media files, used by the tests and by the benchmarks (see bench/).
+
+JPEG files have an EXIF segment with DateTimeOriginal tag; MOV/MP4 files are sparse, with "moov" atom either in front of
+or behind the media data.
+"""
+
+import struct
+
+import main3
+
+## layouts of MOV/MP4 files built by make_mov()
+LAYOUTS = ('moov-first', 'moov-last')
+
+
+def make_jpeg(date_time, byte_order='>', jfif=False, thumbnail_size=0, sub_sec=None):
+    ''' Build minimal JPEG file with EXIF segment containing some IFD0 tags, EXIF IFD (with optional SubSecTimeOriginal tag)
+        and optional thumbnail.
+    '''
+    def ifd(entries, next_ifd, data_offset):
+        ## entries are tuples (tag, type, count, data), with data longer than 4 bytes stored after the IFD
+        table = struct.pack(byte_order + 'H', len(entries))
+        data = b''
+        for (tag, field_type, count, value) in entries:
+            if isinstance(value, int):
+                table += struct.pack(byte_order + 'HHII', tag, field_type, count, value)
+            elif len(value) <= 4:
+                table += struct.pack(byte_order + 'HHI', tag, field_type, count) + value.ljust(4, b'\0')
+            else:
+                table += struct.pack(byte_order + 'HHII', tag, field_type, count, data_offset + len(data))
+                data += value
+        return table + struct.pack(byte_order + 'I', next_ifd) + data
+
+    ifd0_entries = [(0x010f, 2, 6, b'Maker\0'), (0x0110, 2, 6, b'Model\0'), (0x0132, 2, 20, date_time.encode() + b'\0')]
+    exif_entries = [(0x829a, 5, 1, b'\0' * 8), (0x9003, 2, 20, date_time.encode() + b'\0'), (0x9004, 2, 20, date_time.encode() + b'\0')]
+    if sub_sec is not None:
+        exif_entries.append((0x9291, 2, len(sub_sec) + 1, sub_sec.encode() + b'\0'))
+
+    ifd0_offset = 8
+    ifd0_size = len(ifd(ifd0_entries + [(0x8769, 4, 1, 0)], 0, 0))
+    exif_offset = ifd0_offset + ifd0_size
+    exif_ifd = ifd(exif_entries, 0, exif_offset + 2 + len(exif_entries) * 12 + 4)
+    ifd1_offset = exif_offset + len(exif_ifd) if thumbnail_size else 0
+    ifd0 = ifd(ifd0_entries + [(0x8769, 4, 1, exif_offset)], ifd1_offset, ifd0_offset + 2 + (len(ifd0_entries) + 1) * 12 + 4)
+    tiff = (b'II' if byte_order == '<' else b'MM') + struct.pack(byte_order + 'HI', 42, ifd0_offset) + ifd0 + exif_ifd
+    if thumbnail_size:
+        thumbnail_offset = ifd1_offset + 2 + 2 * 12 + 4
+        tiff += ifd([(0x0201, 4, 1, thumbnail_offset), (0x0202, 4, 1, thumbnail_size)], 0, 0)
+        tiff += b'\xff\xd8' + b'\0' * (thumbnail_size - 4) + b'\xff\xd9'
+
+    app1 = b'Exif\0\0' + tiff
+    jpeg = b'\xff\xd8'
+    if jfif:
+        jpeg += b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\0\x01\x01\0\0\x01\0\x01\0\0'
+    jpeg += b'\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1
+    return jpeg + b'\xff\xda\0\x08' + b'\0' * 1024 + b'\xff\xd9'
+
+
+def make_atom(atom_type, payload):
+    return struct.pack('>I4s', 8 + len(payload), atom_type) + payload
+
+
+def make_mov(file_path, file_size, layout, date_time):
+    ''' Writes sparse MP4 file of given size, with 64-bit sized "mdat" atom and version 1 "mvhd" atom. '''
+    timestamp = int(date_time.timestamp()) + main3.QUICKTIME_EPOCH_ADJUSTER
+    ## version 1: creation and modification time, time scale, duration, then the rest of atom left blank
+    mvhd = make_atom(b'mvhd', b'\x01\x00\x00\x00' + struct.pack('>QQIQ', timestamp, timestamp, 1000, 0) + bytes(80))
+    moov = make_atom(b'moov', mvhd)
+    ftyp = make_atom(b'ftyp', b'isom\x00\x00\x00\x00isommp41')
+    mdat_size = file_size - len(ftyp) - len(moov)
+    mdat_header = struct.pack('>I4sQ', 1, b'mdat', mdat_size)
+
+    with open(file_path, 'wb') as f:
+        f.write(ftyp)
+        if layout == 'moov-first':
+            f.write(moov)
+        f.write(mdat_header)
+        if layout == 'moov-last':
+            f.seek(len(ftyp) + mdat_size)
+            f.write(moov)
+        else:
+            f.truncate(file_size)
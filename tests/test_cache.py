@@ -0,0 +1,64 @@
+# -*- coding: utf8  -*-
+
+import os
+import sqlite3
+
+import main3
+from media_builders import make_jpeg
+
+SOURCES = ('exif',)
+RESULT = ('20190601_123456', None, main3.EXIF_STRATEGY_NATIVE, main3.DATE_SOURCE_EXIF)
+
+
+def make_media_dir(tmp_path):
+    tmp_path.joinpath('IMG_0001.JPG').write_bytes(make_jpeg('2019:06:01 12:34:56'))
+    return tmp_path
+
+
+def test_lookup(tmp_path):
+    file_path = make_media_dir(tmp_path).joinpath('IMG_0001.JPG')
+    cache = main3.MetadataCache(tmp_path.joinpath(main3.CACHE_FILE_NAME))
+    assert cache.lookup(file_path, file_path.stat(), 'image', SOURCES) is None
+    cache.store(file_path, file_path.stat(), 'image', SOURCES, RESULT)
+    assert cache.lookup(file_path, file_path.stat(), 'image', SOURCES) == RESULT[:2] + (None, RESULT[3])
+    assert cache.lookup(file_path, file_path.stat(), 'image', ('exif', 'mtime')) is None
+    os.utime(file_path, ns=(0, 0))
+    assert cache.lookup(file_path, file_path.stat(), 'image', SOURCES) is None
+    cache.close()
+
+
+def test_dry_run_never_creates_cache(tmp_path):
+    media_dir = make_media_dir(tmp_path)
+    assert main3.main(['main3.py', '--path', str(media_dir), '--dry-run', '-q']) == 0
+    assert not media_dir.joinpath(main3.CACHE_FILE_NAME).exists()
+
+
+def test_dry_run_reads_cache_only(tmp_path):
+    media_dir = make_media_dir(tmp_path)
+    cache_path = media_dir.joinpath(main3.CACHE_FILE_NAME)
+    file_path = media_dir.joinpath('IMG_0001.JPG')
+    cache = main3.MetadataCache(cache_path)
+    cache.store(file_path, file_path.stat(), 'image', main3.METADATA_DATE_SOURCES['image'], RESULT)
+    cache.close()
+    cache_data = cache_path.read_bytes()
+
+    options = main3.build_config(dry_run=True, cache=str(cache_path))
+    renamer = main3.Renamer(options)
+    assert renamer.cache.read_only is True
+    assert [result.new_path.name for result in renamer.resolve([media_dir])] == ['20190601_123456_IMG_0001.JPG']
+    assert (renamer.cache.hit_count, renamer.cache.miss_count) == (1, 0)
+    renamer.close()
+    assert cache_path.read_bytes() == cache_data
+    assert sorted(path.name for path in media_dir.iterdir()) == [main3.CACHE_FILE_NAME, 'IMG_0001.JPG']
+
+
+def test_dry_run_outdated_cache(tmp_path):
+    media_dir = make_media_dir(tmp_path)
+    cache_path = media_dir.joinpath(main3.CACHE_FILE_NAME)
+    connection = sqlite3.connect(str(cache_path))
+    connection.execute('PRAGMA user_version = %d' % (main3.CACHE_VERSION - 1))
+    connection.close()
+    cache_data = cache_path.read_bytes()
+
+    assert main3.main(['main3.py', '--path', str(media_dir), '--dry-run', '-q']) == 0
+    assert cache_path.read_bytes() == cache_data
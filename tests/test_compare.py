@@ -0,0 +1,78 @@
+# -*- coding: utf8  -*-
+
+import os
+
+import pytest
+
+import main3
+
+PARTIAL_HASH_SIZE = 16
+## tuples (content of the other file, whether identical, whether read in part, whether read as a whole)
+TIERS = {
+    'size': (b'a' * 64 + b'b' * 63, False, False, False),
+    'head': (b'c' + b'a' * 63 + b'b' * 64, False, True, False),
+    'tail': (b'a' * 64 + b'b' * 63 + b'c', False, True, False),
+    'middle': (b'a' * 63 + b'cc' + b'b' * 63, False, True, True),
+    'identical': (b'a' * 64 + b'b' * 64, True, True, True),
+}
+
+
+@pytest.fixture
+def hashes(monkeypatch):
+    ''' Records (file name, size) of every file hashing. '''
+    monkeypatch.setattr(main3, 'PARTIAL_HASH_SIZE', PARTIAL_HASH_SIZE)
+    hashes = []
+    read_hexhash = main3.read_hexhash
+    def recording_read_hexhash(file_path, algorithm, size=None):
+        hashes.append((file_path.name, size))
+        return read_hexhash(file_path, algorithm, size)
+    monkeypatch.setattr(main3, 'read_hexhash', recording_read_hexhash)
+    return hashes
+
+
+@pytest.mark.parametrize('tier', list(TIERS))
+def test_tiers(tmp_path, hashes, tier):
+    ''' Files get read only as far as needed to tell them apart: not at all if of different sizes, then just their heads and tails. '''
+    (other_content, identical, partial, whole) = TIERS[tier]
+    file_path = tmp_path.joinpath('a.JPG')
+    file_path.write_bytes(b'a' * 64 + b'b' * 64)
+    other_file_path = tmp_path.joinpath('b.JPG')
+    other_file_path.write_bytes(other_content)
+
+    stats = main3.RunStats()
+    comparer = main3.FileComparer('sha1', stats)
+    assert comparer.are_identical(file_path, other_file_path) is identical
+    expected = ([('a.JPG', PARTIAL_HASH_SIZE), ('b.JPG', PARTIAL_HASH_SIZE)] if partial else []) + ([('a.JPG', None), ('b.JPG', None)] if whole else [])
+    assert hashes == expected
+    assert stats.stage_calls['hash'] == len(expected)
+    assert stats.stage_bytes['hash'] == 2 * PARTIAL_HASH_SIZE * 2 * partial + 2 * 128 * whole
+
+
+def test_small_files_hashed_whole(tmp_path, hashes):
+    ''' Files not larger than head and tail together get hashed as a whole right away, just once. '''
+    file_path = tmp_path.joinpath('a.JPG')
+    file_path.write_bytes(b'a' * 32)
+    other_file_path = tmp_path.joinpath('b.JPG')
+    other_file_path.write_bytes(b'a' * 32)
+    assert main3.FileComparer().are_identical(file_path, other_file_path) is True
+    assert hashes == [('a.JPG', None), ('b.JPG', None)]
+
+
+def test_hashes_remembered(tmp_path, hashes):
+    ''' A file colliding with several others is read just once, unless changed in the meantime. '''
+    file_path = tmp_path.joinpath('a.JPG')
+    file_path.write_bytes(b'a' * 64 + b'b' * 64)
+    for name in ('b.JPG', 'c.JPG'):
+        tmp_path.joinpath(name).write_bytes(b'a' * 64 + b'b' * 64)
+
+    comparer = main3.FileComparer()
+    assert comparer.are_identical(file_path, tmp_path.joinpath('b.JPG')) is True
+    assert comparer.are_identical(file_path, tmp_path.joinpath('c.JPG')) is True
+    assert sorted(name for (name, _) in hashes) == ['a.JPG'] * 2 + ['b.JPG'] * 2 + ['c.JPG'] * 2
+
+    file_path.write_bytes(b'a' * 64 + b'c' * 64)
+    file_stat = file_path.stat()
+    os.utime(file_path, ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns + 1000000000))
+    hashes.clear()
+    assert comparer.are_identical(file_path, tmp_path.joinpath('b.JPG')) is False
+    assert hashes == [('a.JPG', PARTIAL_HASH_SIZE)]
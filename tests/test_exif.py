@@ -0,0 +1,80 @@
+# -*- coding: utf8  -*-
+
+import struct
+import logging
+
+import pytest
+
+import main3
+from media_builders import make_jpeg
+
+DATE_TIME = '2019:06:01 12:34:56'
+
+
+@pytest.fixture(autouse=True)
+def quiet_exifread():
+    ## exifread logs each corrupt field it runs into
+    logging.disable(logging.CRITICAL)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+@pytest.mark.parametrize('byte_order', ['<', '>'])
+def test_date_time_original(byte_order):
+    assert main3.read_exif_date_time_original(make_jpeg(DATE_TIME, byte_order=byte_order, jfif=True, thumbnail_size=256)) == DATE_TIME
+    assert main3.read_exif_date_time_original(make_jpeg(DATE_TIME, byte_order=byte_order, sub_sec='045'), sub_sec=True) == DATE_TIME + '.045'
+    ## neither missing nor invalid SubSecTimeOriginal tag is an error
+    assert main3.read_exif_date_time_original(make_jpeg(DATE_TIME, byte_order=byte_order), sub_sec=True) == DATE_TIME
+    assert main3.read_exif_date_time_original(make_jpeg(DATE_TIME, byte_order=byte_order, sub_sec='n/a'), sub_sec=True) == DATE_TIME
+
+
+def test_no_exif_segment():
+    assert main3.read_exif_date_time_original(b'\xff\xd8\xff\xda\x00\x08' + bytes(64)) is None
+
+
+def corrupt(jpeg, offset, data):
+    return jpeg[:offset] + data + jpeg[offset + len(data):]
+
+## offset of TIFF header within make_jpeg() output: SOI, APP1 marker and size, 'Exif\0\0'
+TIFF_OFFSET = 2 + 4 + 6
+
+
+@pytest.mark.parametrize('jpeg', [
+    corrupt(make_jpeg(DATE_TIME), TIFF_OFFSET, b'XX'),
+    corrupt(make_jpeg(DATE_TIME), TIFF_OFFSET + 2, struct.pack('>H', 43)),
+    corrupt(make_jpeg(DATE_TIME), TIFF_OFFSET + 4, struct.pack('>I', 0xfffffff0)),
+    corrupt(make_jpeg(DATE_TIME), 4, struct.pack('>H', 0xfff0)),
+    make_jpeg(DATE_TIME).replace(DATE_TIME.encode(), b'\xff' * len(DATE_TIME)),
+    make_jpeg(DATE_TIME).replace(struct.pack('>HH', 0x9003, 2), struct.pack('>HH', 0x9003, 3)),
+    make_jpeg(DATE_TIME).replace(struct.pack('>HH', 0x9003, 2), struct.pack('>HH', 0x9004, 2), 1),
+], ids=['byte-order', 'magic', 'ifd-offset', 'segment-size', 'undecodable', 'tag-type', 'missing-tag'])
+def test_corrupt_exif(jpeg):
+    with pytest.raises(RuntimeError):
+        main3.read_exif_date_time_original(jpeg)
+
+
+@pytest.mark.parametrize('byte_order', ['<', '>'])
+def test_truncated_exif(tmp_path, byte_order):
+    ''' Header truncated at any byte of EXIF segment either yields the tag value, or no EXIF at all, rather than raising.
+        Too short header is not even recognized as JPEG one.
+    '''
+    jpeg = make_jpeg(DATE_TIME, byte_order=byte_order, thumbnail_size=64)
+    file_path = tmp_path.joinpath('IMG_0001.JPG')
+    for size in range(2, len(jpeg) - 1024):
+        try:
+            assert main3.read_exif_date_time_original(jpeg[:size]) in (DATE_TIME, None), size
+        except RuntimeError:
+            pass
+        file_path.write_bytes(jpeg[:size])
+        (date_time_str, error, _, _) = main3.extract_date_time_str(file_path, 'image')
+        assert (date_time_str, error) in (('20190601_123456', None), (None, main3.EXTRACT_ERROR_NO_EXIF), (None, main3.EXTRACT_ERROR_NOT_JPEG)), size
+
+
+def test_corrupt_exif_fallback(tmp_path):
+    ''' Corrupt data failing the native parser falls back to exifread, which fails as well, without raising. '''
+    file_path = tmp_path.joinpath('IMG_0001.JPG')
+    ## IFD0 entry count pointing far beyond the EXIF segment
+    file_path.write_bytes(corrupt(make_jpeg(DATE_TIME, byte_order='<'), TIFF_OFFSET + 8, struct.pack('<H', 0xffff))[:TIFF_OFFSET + 64])
+    assert main3.extract_date_time_str(file_path, 'image')[:2] == (None, main3.EXTRACT_ERROR_NO_EXIF)
+    file_path.write_bytes(b'\xff\xd8\xff\xe1\x00\x10Exif\x00\x00MM\x00*' + bytes(64))
+    assert main3.extract_date_time_str(file_path, 'image')[:2] == (None, main3.EXTRACT_ERROR_NO_EXIF)
@@ -0,0 +1,134 @@
+# -*- coding: utf8  -*-
+
+import json
+
+import pytest
+
+import main3
+from media_builders import make_jpeg
+
+FILE_NAMES = ['IMG_%04d.JPG' % index for index in range(3)]
+NEW_FILE_NAMES = ['20190601_12345%d_IMG_%04d.JPG' % (index, index) for index in range(3)]
+
+
+def run(dir_path, *args, stats=None):
+    return main3.main(['main3.py', '--path', str(dir_path), '--no-cache', '-q'] + list(args), stats)
+
+
+@pytest.fixture
+def media_dir(tmp_path):
+    for (index, file_name) in enumerate(FILE_NAMES):
+        tmp_path.joinpath(file_name).write_bytes(make_jpeg('2019:06:01 12:34:5%d' % index))
+    return tmp_path
+
+
+def list_names(dir_path):
+    return sorted(path.name for path in dir_path.iterdir() if path.name != main3.JOURNAL_FILE_NAME)
+
+
+def write_journal(journal_path, dir_path, *records, tail=''):
+    lines = [json.dumps({'journal': main3.JOURNAL_VERSION, 'path': str(dir_path), 'command': None})]
+    lines += [json.dumps(record) for record in records]
+    journal_path.write_text('\n'.join(lines) + '\n' + tail, encoding='utf-8')
+
+
+def test_round_trip(media_dir):
+    journal_path = media_dir.joinpath(main3.JOURNAL_FILE_NAME)
+    assert run(media_dir) == 0
+    assert list_names(media_dir) == NEW_FILE_NAMES
+    (header, records) = main3.read_journal(journal_path)
+    assert header['path'] == str(media_dir)
+    assert main3.get_journal_state(records) == 'completed'
+    assert sorted(main3.get_journal_renames(records, media_dir)) == list(zip(FILE_NAMES, NEW_FILE_NAMES))
+
+    assert run(media_dir, 'undo') == 0
+    assert list_names(media_dir) == FILE_NAMES
+    (_, records) = main3.read_journal(journal_path)
+    assert main3.get_journal_state(records) == 'undone'
+    assert main3.get_journal_renames(records, media_dir, pending=True) == []
+
+    ## undoing again finds nothing to undo, rather than failing on files renamed back already
+    stats = main3.RunStats()
+    assert run(media_dir, 'undo', stats=stats) == 0
+    assert list_names(media_dir) == FILE_NAMES
+    assert (stats.renamed_count, stats.failed_count) == (0, 0)
+
+
+@pytest.mark.parametrize('tail', ['{"op":"done","sour', '{"op":"directory","path":"sub"}'], ids=['truncated-record', 'missing-newline'])
+def test_resume_after_partial_write(media_dir, tail):
+    ''' Run interrupted while writing the journal: the first rename recorded as done, the second one applied but not recorded
+        as done yet (the record cut short, or the last one written without its line end), the third one not even started.
+    '''
+    journal_path = media_dir.joinpath(main3.JOURNAL_FILE_NAME)
+    media_dir.joinpath(FILE_NAMES[0]).rename(media_dir.joinpath(NEW_FILE_NAMES[0]))
+    media_dir.joinpath(FILE_NAMES[1]).rename(media_dir.joinpath(NEW_FILE_NAMES[1]))
+    write_journal(journal_path, media_dir,
+        {'op': 'rename', 'source': FILE_NAMES[0], 'target': NEW_FILE_NAMES[0]},
+        {'op': 'rename', 'source': FILE_NAMES[1], 'target': NEW_FILE_NAMES[1]},
+        {'op': 'done', 'source': FILE_NAMES[0], 'target': NEW_FILE_NAMES[0]},
+        tail=tail)
+
+    (_, records) = main3.read_journal(journal_path)
+    assert len(records) == 3 + tail.endswith('}')
+    assert main3.get_journal_state(records) == 'interrupted'
+
+    ## interrupted run is neither overwritten, nor resumed unless asked to; a run not asked to resume it renames without journal
+    journal = journal_path.read_bytes()
+    media_dir.joinpath(FILE_NAMES[2]).rename(media_dir.joinpath('IMG_0002.jpeg'))
+    assert run(media_dir) == 0
+    assert journal_path.read_bytes() == journal
+    assert list_names(media_dir) == sorted(NEW_FILE_NAMES[:2] + ['20190601_123452_IMG_0002.jpeg'])
+    media_dir.joinpath('20190601_123452_IMG_0002.jpeg').rename(media_dir.joinpath(FILE_NAMES[2]))
+
+    assert run(media_dir, '--resume') == 0
+    assert list_names(media_dir) == NEW_FILE_NAMES
+    (_, records) = main3.read_journal(journal_path)
+    assert main3.get_journal_state(records) == 'completed'
+    assert sorted(main3.get_journal_renames(records, media_dir)) == list(zip(FILE_NAMES, NEW_FILE_NAMES))
+
+    assert run(media_dir, '--resume') == 1
+    assert run(media_dir, 'undo') == 0
+    assert list_names(media_dir) == FILE_NAMES
+
+
+def test_undo_interrupted(media_dir):
+    ''' Undo of a run interrupted right after its intents got flushed, before recording any rename as done. '''
+    journal_path = media_dir.joinpath(main3.JOURNAL_FILE_NAME)
+    media_dir.joinpath(FILE_NAMES[0]).rename(media_dir.joinpath(NEW_FILE_NAMES[0]))
+    write_journal(journal_path, media_dir,
+        {'op': 'rename', 'source': FILE_NAMES[0], 'target': NEW_FILE_NAMES[0]},
+        {'op': 'rename', 'source': FILE_NAMES[1], 'target': NEW_FILE_NAMES[1]})
+
+    assert run(media_dir, 'undo') == 0
+    assert list_names(media_dir) == FILE_NAMES
+    assert run(media_dir, 'undo') == 0
+    assert list_names(media_dir) == FILE_NAMES
+
+
+def test_dry_run_without_journal(media_dir):
+    assert run(media_dir, '--dry-run') == 0
+    assert run(media_dir, 'undo', '--dry-run') == 1
+    assert list_names(media_dir) == FILE_NAMES
+    assert not media_dir.joinpath(main3.JOURNAL_FILE_NAME).exists()
+
+    assert run(media_dir) == 0
+    journal = media_dir.joinpath(main3.JOURNAL_FILE_NAME).read_bytes()
+    assert run(media_dir, 'undo', '--dry-run') == 0
+    assert list_names(media_dir) == NEW_FILE_NAMES
+    assert media_dir.joinpath(main3.JOURNAL_FILE_NAME).read_bytes() == journal
+
+
+def test_batched_source_freed(media_dir):
+    ''' New file name of a file renamed by the same journal batch, before it, is free by the time of renaming. '''
+    (first_path, second_path) = (media_dir.joinpath(FILE_NAMES[0]), media_dir.joinpath(FILE_NAMES[1]))
+    results = []
+    for (file_path, new_file_path) in [(first_path, media_dir.joinpath('moved.JPG')), (second_path, first_path)]:
+        file_stat = file_path.stat()
+        results.append(main3.Result(file_path, new_file_path, main3.PLAN_STATUS_RENAME, size=file_stat.st_size, mtime_ns=file_stat.st_mtime_ns))
+    config = main3.build_config()
+    journal = main3.RenameJournal(media_dir.joinpath(main3.JOURNAL_FILE_NAME), media_dir)
+    with main3.Renamer(config, journal=journal) as renamer:
+        results = renamer.apply(results)
+    assert [result.status for result in results] == [main3.RESULT_STATUS_RENAMED] * 2
+    assert list_names(media_dir) == sorted([FILE_NAMES[0], FILE_NAMES[2], 'moved.JPG'])
+    assert renamer.stats.failed_count == 0
@@ -0,0 +1,73 @@
+# -*- coding: utf8  -*-
+
+import io
+import json
+
+import pytest
+
+import main3
+from media_builders import make_jpeg
+
+
+@pytest.fixture
+def stream(monkeypatch):
+    ''' Stream written to only on flush, or once buffer is full. '''
+    monkeypatch.setattr(main3, 'LOG_BUFFER_LINES', 4)
+    monkeypatch.setattr(main3, 'LOG_BUFFER_SECONDS', 3600.0)
+    return io.StringIO()
+
+
+def test_buffered(stream):
+    logger = main3.Logger(stream)
+    logger.debug('debug', '  DEBUG: not written at all ... ')
+    for index in range(3):
+        logger.info('info', '  INFO: Message %d ... ', index)
+    assert stream.getvalue() == ''
+    logger.flush()
+    assert stream.getvalue().splitlines() == ['  INFO: Message %d ... ' % index for index in range(3)]
+
+    for index in range(3, 7):
+        logger.warning('warning', '  WARNING: Message %d ... ', index)
+    ## written out as the buffer got full
+    assert len(stream.getvalue().splitlines()) == 7
+    logger.error('error', '  ERROR: Message %d ... ', 7)
+    assert len(stream.getvalue().splitlines()) == 7
+    logger.close()
+    assert stream.getvalue().splitlines()[-1] == '  ERROR: Message 7 ... '
+
+
+def test_json(stream):
+    logger = main3.Logger(stream, main3.LOG_DEBUG, format='json')
+    logger.debug('found', '  DEBUG: File name "%s" date-time string "%s" found ... ', 'IMG_0001.JPG', '20190601_123456')
+    logger.warning('unknown-type', '  WARNING: File path "%s" cannot be quessed its mime-type => skipping ... ', 'notes')
+    logger.log(main3.LOG_SUMMARY, 'summary', 'Files total: %d', 2)
+    logger.close()
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [sorted(record) for record in records] == [['event', 'level', 'message', 'time']] * 3
+    assert [(record['level'], record['event'], record['message']) for record in records] == [
+        ('debug', 'found', 'File name "IMG_0001.JPG" date-time string "20190601_123456" found'),
+        ('warning', 'unknown-type', 'File path "notes" cannot be quessed its mime-type => skipping'),
+        ('summary', 'summary', 'Files total: 2')]
+
+
+def test_limit(stream):
+    ''' Messages over the limit of their event are counted, and reported at close; summary messages are never suppressed. '''
+    logger = main3.Logger(stream, limit=2)
+    for index in range(5):
+        logger.info('already-prefixed', '  INFO: Message %d ... ', index)
+    logger.warning('unknown-type', '  WARNING: Message ... ')
+    for index in range(3):
+        logger.log(main3.LOG_SUMMARY, 'summary', 'Summary %d', index)
+    logger.close()
+    assert stream.getvalue().splitlines() == [
+        '  INFO: Message 0 ... ', '  INFO: Message 1 ... ', '  WARNING: Message ... ', 'Summary 0', 'Summary 1', 'Summary 2',
+        '  INFO: Suppressed 3 more messages of event "already-prefixed" (5 in total) ... ']
+
+
+def test_command_line_json(tmp_path, capsys):
+    tmp_path.joinpath('IMG_0001.JPG').write_bytes(make_jpeg('2019:06:01 12:34:56'))
+    tmp_path.joinpath('20190601_123457_IMG_0002.JPG').write_bytes(make_jpeg('2019:06:01 12:34:57'))
+    assert main3.main(['main3.py', '--path', str(tmp_path), '--no-cache', '--dry-run', '--log-format', 'json']) == 0
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert {record['event'] for record in records} >= {'already-prefixed'}
+    assert records[-1]['level'] == 'summary'
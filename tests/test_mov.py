@@ -0,0 +1,127 @@
+# -*- coding: utf8  -*-
+
+import io
+import struct
+import datetime
+
+import pytest
+
+import main3
+import media_builders
+from media_builders import make_atom
+
+CREATION_DATE = b'2020-07-08T09:10:11+0200'
+
+
+def make_keys(*keys):
+    return make_atom(b'keys', bytes(4) + struct.pack('>I', len(keys)) + b''.join(struct.pack('>I', 8 + len(key)) + b'mdta' + key for key in keys))
+
+
+def make_ilst(key_index, value):
+    return make_atom(b'ilst', make_atom(struct.pack('>I', key_index), make_atom(b'data', struct.pack('>II', 1, 0) + value)))
+
+
+def make_meta(*atoms):
+    hdlr = make_atom(b'hdlr', bytes(8) + b'mdta' + bytes(13))
+    return make_atom(b'meta', bytes(4) + hdlr + b''.join(atoms))
+
+
+def make_mov_file(tmp_path, moov_payload):
+    ''' Writes MOV file of given "moov" atom payload, with a zeroed (censored) version 0 "mvhd" atom in front of it. '''
+    mvhd = make_atom(b'mvhd', bytes(100))
+    data = make_atom(b'ftyp', b'qt  \x00\x00\x00\x00qt  ') + make_atom(b'moov', mvhd + moov_payload) + make_atom(b'mdat', bytes(1000))
+    file_path = tmp_path.joinpath('MOV_0001.MOV')
+    file_path.write_bytes(data)
+    return file_path
+
+
+def test_keys_creation_date(tmp_path):
+    file_path = make_mov_file(tmp_path, make_meta(make_keys(b'com.apple.quicktime.make', main3.QUICKTIME_CREATION_DATE_KEY), make_ilst(2, CREATION_DATE)))
+    assert main3.extract_date_time_str(file_path, 'video', sources=(main3.DATE_SOURCE_MVHD, main3.DATE_SOURCE_KEYS)) == ('20200708_091011', None, main3.MOV_STRATEGY_HEADER, main3.DATE_SOURCE_KEYS)
+    assert main3.extract_date_time_str(file_path, 'video')[1] == main3.EXTRACT_ERROR_NO_DATE
+
+
+@pytest.mark.parametrize('keys', [
+    make_atom(b'keys', b''),
+    make_atom(b'keys', bytes(4)),
+    make_atom(b'keys', bytes(4) + struct.pack('>I', 1)),
+    make_atom(b'keys', bytes(4) + struct.pack('>I', 1) + struct.pack('>I', 100) + b'mdta'),
+    make_atom(b'keys', bytes(4) + struct.pack('>I', 1) + struct.pack('>I', 4) + b'mdta'),
+], ids=['empty', 'no-count', 'missing-key', 'key-exceeding', 'key-too-short'])
+def test_truncated_keys_atom(tmp_path, keys):
+    file_path = make_mov_file(tmp_path, make_meta(keys, make_ilst(1, CREATION_DATE)))
+    with pytest.raises(RuntimeError):
+        main3.read_keys_creation_date(memoryview(file_path.read_bytes()), 0, file_path.stat().st_size)
+    ## falls back to the next source, rather than stopping the run
+    assert main3.extract_date_time_str(file_path, 'video', sources=(main3.DATE_SOURCE_KEYS, main3.DATE_SOURCE_MVHD))[1] == main3.EXTRACT_ERROR_NO_DATE
+    assert main3.extract_date_time_str(file_path, 'video', sources=(main3.DATE_SOURCE_KEYS,))[1] == main3.EXTRACT_ERROR_MOV
+
+
+@pytest.mark.parametrize('ilst', [
+    make_atom(b'ilst', make_atom(struct.pack('>I', 1), make_atom(b'data', b''))),
+    make_atom(b'ilst', make_atom(struct.pack('>I', 1), struct.pack('>I4s', 100, b'data'))),
+], ids=['empty-data', 'data-exceeding'])
+def test_truncated_ilst_atom(tmp_path, ilst):
+    file_path = make_mov_file(tmp_path, make_meta(make_keys(main3.QUICKTIME_CREATION_DATE_KEY), ilst))
+    assert main3.extract_date_time_str(file_path, 'video', sources=(main3.DATE_SOURCE_KEYS,))[1] == main3.EXTRACT_ERROR_MOV
+
+
+def make_mvhd(date_time, version=0):
+    timestamp = int(date_time.timestamp()) + main3.QUICKTIME_EPOCH_ADJUSTER
+    if version == 0:
+        return make_atom(b'mvhd', b'\x00\x00\x00\x00' + struct.pack('>IIII', timestamp, timestamp, 1000, 0) + bytes(80))
+    return make_atom(b'mvhd', b'\x01\x00\x00\x00' + struct.pack('>QQIQ', timestamp, timestamp, 1000, 0) + bytes(80))
+
+
+@pytest.mark.parametrize('layout', media_builders.LAYOUTS)
+def test_moov_layouts(tmp_path, layout):
+    file_path = tmp_path.joinpath('MOV_0001.MOV')
+    media_builders.make_mov(file_path, 4 * main3.MOV_TAIL_SIZE, layout, datetime.datetime(2019, 6, 1, 12, 34, 56))
+    strategy = main3.MOV_STRATEGY_HEADER if layout == 'moov-first' else main3.MOV_STRATEGY_TAIL
+    assert main3.extract_date_time_str(file_path, 'video') == ('20190601_123456', None, strategy, main3.DATE_SOURCE_MVHD)
+
+
+@pytest.mark.parametrize('version', [0, 1])
+def test_truncated_mov(tmp_path, version):
+    ''' File truncated at any byte either yields the creation date-time, or fails as invalid, rather than raising. '''
+    moov = make_atom(b'moov', make_mvhd(datetime.datetime(2019, 6, 1, 12, 34, 56), version) + make_meta(make_keys(main3.QUICKTIME_CREATION_DATE_KEY), make_ilst(1, CREATION_DATE)))
+    data = make_atom(b'ftyp', b'qt  \x00\x00\x00\x00qt  ') + moov + make_atom(b'mdat', bytes(100))
+    file_path = tmp_path.joinpath('MOV_0001.MOV')
+    for sources in ((main3.DATE_SOURCE_MVHD,), (main3.DATE_SOURCE_KEYS, main3.DATE_SOURCE_MVHD)):
+        for size in range(len(data)):
+            file_path.write_bytes(data[:size])
+            (date_time_str, error, _, _) = main3.extract_date_time_str(file_path, 'video', sources=sources)
+            assert (date_time_str, error) in (('20190601_123456', None), ('20200708_091011', None), (None, main3.EXTRACT_ERROR_MOV)), size
+
+
+def test_moov_truncated_at_tail(tmp_path):
+    ''' "moov" atom claiming more data than there is at the end of file is not taken for a valid one by the tail lookup,
+        while walking the atoms still finds "mvhd" atom within what there is.
+    '''
+    file_path = tmp_path.joinpath('MOV_0001.MOV')
+    moov = make_atom(b'moov', make_mvhd(datetime.datetime(2019, 6, 1, 12, 34, 56)))
+    with open(file_path, 'wb') as f:
+        f.write(make_atom(b'ftyp', b'qt  \x00\x00\x00\x00qt  '))
+        f.write(struct.pack('>I4s', 8 + 2 * main3.MOV_TAIL_SIZE, b'mdat'))
+        f.seek(8 + 2 * main3.MOV_TAIL_SIZE + 20)
+        f.write(struct.pack('>I', len(moov) + 16) + moov[4:])
+    assert main3.find_moov_atom_at_tail(file_path.read_bytes()[-main3.MOV_TAIL_SIZE:]) is None
+    assert main3.extract_date_time_str(file_path, 'video') == ('20190601_123456', None, main3.MOV_STRATEGY_WALK, main3.DATE_SOURCE_MVHD)
+
+
+def test_tail_bytes_reported(tmp_path):
+    ''' Bytes of the tail read get reported, even though the "moov" atom is not there, but in the middle of the file. '''
+    mvhd = make_atom(b'mvhd', b'\x01\x00\x00\x00' + struct.pack('>QQIQ', 3000000000, 3000000000, 1000, 0) + bytes(80))
+    data = make_atom(b'ftyp', b'isom\x00\x00\x00\x00isommp41') + make_atom(b'mdat', bytes(main3.HEADER_SIZE)) + make_atom(b'moov', mvhd) + make_atom(b'mdat', bytes(main3.MOV_TAIL_SIZE))
+    file_path = tmp_path.joinpath('MOV_0001.MOV')
+    file_path.write_bytes(data)
+    stats = main3.RunStats()
+    assert main3.extract_date_time_str(file_path, 'video', stats=stats)[2] == main3.MOV_STRATEGY_WALK
+    assert stats.stage_calls[main3.MOV_STRATEGY_TAIL] == 0
+    assert stats.get_report()['stages'][main3.MOV_STRATEGY_TAIL]['bytes'] == main3.MOV_TAIL_SIZE
+
+    stream = io.StringIO()
+    logger = main3.Logger(stream)
+    stats.print_report(logger)
+    logger.flush()
+    assert [line for line in stream.getvalue().splitlines() if line.strip().startswith(main3.MOV_STRATEGY_TAIL)][0].endswith(' %d bytes read' % main3.MOV_TAIL_SIZE)
@@ -0,0 +1,117 @@
+# -*- coding: utf8  -*-
+
+import pytest
+
+import main3
+from media_builders import make_jpeg
+
+
+@pytest.mark.parametrize(('file_name', 'groups'), [
+    ('20190601_123456_IMG_0001.JPG', ('', '20190601_123456')),
+    ('IMG_20190601_123456.jpg', ('IMG_', '20190601_123456')),
+    ('PXL_20190601_123456789.PORTRAIT.jpg', ('PXL_', '20190601_123456')),
+    ('MVIMG_20190601_123456.jpg', ('MVIMG_', '20190601_123456')),
+    ('Screenshot 20190601_123456 (2).png', ('Screenshot ', '20190601_123456')),
+    ## prefixes of any camera file naming scheme, known or not
+    ('DSC_20190601_123456.jpg', ('DSC_', '20190601_123456')),
+    ('A.B_20190601_123456.jpg', ('A.B_', '20190601_123456')),
+    ## the first date-time string, rather than the last one
+    ('20190601_123456_PXL_20200101_000000000.jpg', ('', '20190601_123456')),
+    ('IMG_0001.JPG', None),
+    ('20190601123456.jpg', None),
+])
+def test_date_time_search(file_name, groups):
+    search = main3.date_time_search_re.match(file_name)
+    assert (search.groups() if search is not None else None) == groups
+
+
+def test_analyze_file_names():
+    media_types = main3.build_media_types(None)
+    (file_media_types, searches) = main3.analyze_file_names(['IMG_20190601_123456.JPG', 'clip.MP4', 'notes', 'README.txt'], media_types)
+    assert list(file_media_types) == ['image', 'video', None, 'other']
+    assert [search.groups()[1] if search is not None else None for search in searches] == ['20190601_123456', None, None, None]
+
+
+def test_media_types_as_guessed_by_mimetypes():
+    ''' Classification by extension, including compressed files, is the one of mimetypes.guess_type() (as used before the lookup table). '''
+    import mimetypes
+    import pathlib
+
+    mime_types = mimetypes.MimeTypes()
+    def guess_media_type(file_name):
+        mime_type = mime_types.guess_type(pathlib.Path('/media', file_name).as_uri())[0]
+        if mime_type is None:
+            return None
+        return 'image' if mime_type.startswith('image') else 'video' if mime_type.startswith('video') else 'other'
+
+    exts = ['', '.', '.jpg', '.JPG', '.mp4', '.tar', '.txt', '.unknown', '.gz', '.GZ', '.Z', '.z', '.bz2', '.xz', '.svgz', '.tgz', '.TGZ', '.tbz2']
+    file_names = [stem + ext + inner_ext + outer_ext for stem in ('IMG_0001', '.hidden', '') for ext in exts for inner_ext in exts for outer_ext in ('', '.gz', '.Z')]
+    file_names = [file_name for file_name in file_names if file_name.strip('.')]
+    (file_media_types, _) = main3.analyze_file_names(file_names, main3.build_media_types(None))
+    assert [(file_name, media_type) for (file_name, media_type) in zip(file_names, file_media_types) if media_type != guess_media_type(file_name)] == []
+    assert main3.analyze_file_names(['IMG_0001.jpg.gz', 'backup.tgz', 'IMG_0001.JPG.BZ2'], main3.build_media_types('gz=other'))[0] == ['other', 'other', None]
+
+
+def get_media_file(file_path):
+    return next(media_file for media_file in main3.scan_directory(file_path.parent, 0, main3.build_config()) if media_file.kind == 'file')
+
+
+@pytest.mark.parametrize(('file_name', 'mtime_offset', 'random', 'trusted'), [
+    ('20190601_123456_IMG_0001.JPG', 0, 0.5, True),
+    ('20190601_123456_IMG_0001.JPG', 2, 0.5, True),
+    ## sampled for verification
+    ('20190601_123456_IMG_0001.JPG', 0, 0.1, False),
+    ('20190601_123456_IMG_0001.JPG', 3, 0.5, False),
+    ('IMG_20190601_123456.JPG', 0, 0.5, False),
+    ('IMG_0001.JPG', 0, 0.5, False),
+])
+def test_trusted_date_time_prefix(tmp_path, monkeypatch, file_name, mtime_offset, random, trusted):
+    import datetime
+    import os
+    import random as random_module
+
+    file_path = tmp_path.joinpath(file_name)
+    file_path.write_bytes(b'')
+    timestamp = datetime.datetime(2019, 6, 1, 12, 34, 56).timestamp() + mtime_offset
+    os.utime(file_path, (timestamp, timestamp))
+    monkeypatch.setattr(random_module, 'random', lambda: random)
+    assert main3.is_trusted_date_time_prefix(get_media_file(file_path), main3.build_config(trust_window=2.0, verify_fraction=0.2)) is trusted
+
+
+def test_trusted_date_time_prefix_sampled(tmp_path):
+    ''' No file verified with --verify-fraction 0, every one with 1. '''
+    import datetime
+    import os
+
+    file_path = tmp_path.joinpath('20190601_123456_IMG_0001.JPG')
+    file_path.write_bytes(b'')
+    timestamp = datetime.datetime(2019, 6, 1, 12, 34, 56).timestamp()
+    os.utime(file_path, (timestamp, timestamp))
+    media_file = get_media_file(file_path)
+    assert all(main3.is_trusted_date_time_prefix(media_file, main3.build_config(trust_window=2.0, verify_fraction=0.0)) for _ in range(100))
+    assert not any(main3.is_trusted_date_time_prefix(media_file, main3.build_config(trust_window=2.0, verify_fraction=1.0)) for _ in range(100))
+
+
+def test_trusted_files_not_read(tmp_path, monkeypatch):
+    ''' Trusted files are counted as skipped, without reading them; the ones sampled for verification get read. '''
+    import datetime
+    import os
+
+    timestamp = datetime.datetime(2019, 6, 1, 12, 34, 56).timestamp()
+    for index in range(3):
+        file_path = tmp_path.joinpath('20190601_123456_IMG_%04d.JPG' % index)
+        file_path.write_bytes(make_jpeg('2019:06:01 12:34:56'))
+        os.utime(file_path, (timestamp, timestamp))
+
+    extracted = []
+    extract_date_time_str = main3.extract_date_time_str
+    def counting_extract_date_time_str(file_path, *args, **kwargs):
+        extracted.append(file_path.name)
+        return extract_date_time_str(file_path, *args, **kwargs)
+    monkeypatch.setattr(main3, 'extract_date_time_str', counting_extract_date_time_str)
+
+    for (verify_fraction, trusted_count) in [('0', 3), ('1', 0)]:
+        extracted.clear()
+        stats = main3.RunStats()
+        main3.main(['main3.py', '--path', str(tmp_path), '--dry-run', '--no-cache', '-q', '--trust-window', '2', '--verify-fraction', verify_fraction], stats)
+        assert (stats.processed_count, stats.trusted_count, len(extracted)) == (3, trusted_count, 3 - trusted_count)
@@ -0,0 +1,135 @@
+# -*- coding: utf8  -*-
+
+import json
+
+import pytest
+
+import main3
+from media_builders import make_jpeg
+
+
+def get_counts(stats):
+    return stats.files_count, stats.processed_count, stats.renamed_count, stats.skipped_count, stats.failed_count
+
+
+def run(args):
+    ''' Runs main() with given command line arguments; returns the counters of the run. '''
+    stats = main3.RunStats()
+    assert main3.main(['main3.py'] + args, stats) == 0
+    return get_counts(stats)
+
+
+@pytest.fixture
+def media_dir(tmp_path):
+    media_dir = tmp_path.joinpath('media')
+    media_dir.mkdir()
+    media_dir.joinpath('IMG_0001.JPG').write_bytes(make_jpeg('2019:06:01 12:34:56'))
+    ## already prefixed, and colliding with a different file by new file name
+    media_dir.joinpath('20190601_123457_IMG_0002.JPG').write_bytes(make_jpeg('2019:06:01 12:34:57'))
+    media_dir.joinpath('IMG_0003.JPG').write_bytes(make_jpeg('2019:06:01 12:34:58'))
+    media_dir.joinpath('20190601_123458_IMG_0003.JPG').write_bytes(make_jpeg('2019:06:01 12:34:58') + b'\x00')
+    ## not JPEG, of other and unknown media type
+    media_dir.joinpath('IMG_0004.JPG').write_bytes(b'\x00' * 64)
+    media_dir.joinpath('notes.txt').write_text('notes')
+    media_dir.joinpath('notes.unknown-extension').write_text('notes')
+    return media_dir
+
+
+@pytest.mark.parametrize('args', [[], ['--template', '{date}{seq}_{name}'], ['--erase']], ids=['prefix', 'template', 'erase'])
+def test_plan_apply_counts(tmp_path, media_dir, args):
+    plan_path = tmp_path.joinpath('plan.jsonl')
+    common_args = ['--path', str(media_dir), '--no-cache', '--no-journal', '-q'] + args
+    ## counted just like by a normal run
+    run_counts = run(['--dry-run'] + common_args)
+    plan_counts = run(['plan', str(plan_path)] + common_args)
+    assert plan_counts == run_counts
+    (files_count, processed_count, renamed_count, skipped_count, failed_count) = plan_counts
+    assert files_count == 7
+
+    entries = [json.loads(line) for line in plan_path.read_text(encoding='utf-8').splitlines()[1:]]
+    assert len(entries) == files_count
+    for (index, counter) in enumerate(main3.PLAN_COUNTERS, 1):
+        assert sum(1 for entry in entries if counter in entry['counts']) == plan_counts[index]
+
+    assert run(['apply', str(plan_path), '--dry-run'] + common_args) == plan_counts
+    assert run(['apply', str(plan_path)] + common_args) == plan_counts
+    ## nothing left to rename, by a run with the same options
+    file_names = sorted(path.name for path in media_dir.iterdir())
+    assert run(common_args)[0] == files_count
+    assert sorted(path.name for path in media_dir.iterdir()) == file_names
+
+
+def test_plan_counts_collisions(tmp_path, media_dir):
+    plan_path = tmp_path.joinpath('plan.jsonl')
+    run(['plan', str(plan_path), '--path', str(media_dir), '--no-cache', '-q'])
+    entries = {entry['source']: entry for entry in map(json.loads, plan_path.read_text(encoding='utf-8').splitlines()[1:])}
+    assert entries['IMG_0001.JPG']['counts'] == ['processed', 'renamed']
+    ## colliding with a different file
+    assert entries['IMG_0003.JPG']['counts'] == ['processed', 'renamed', 'failed']
+    assert entries['notes.unknown-extension']['counts'] == []
+
+
+def test_apply_old_plan(tmp_path, media_dir):
+    plan_path = tmp_path.joinpath('plan.jsonl')
+    common_args = ['--path', str(media_dir), '--no-cache', '-q']
+    run(['plan', str(plan_path)] + common_args)
+    lines = plan_path.read_text(encoding='utf-8').splitlines()
+    entries = [json.loads(line) for line in lines[1:]]
+    for entry in entries:
+        del entry['counts']
+    plan_path.write_text('\n'.join([lines[0]] + [json.dumps(entry) for entry in entries]) + '\n', encoding='utf-8')
+    statuses = [entry['status'] for entry in entries]
+    renamed_count = statuses.count(main3.PLAN_STATUS_RENAME)
+    assert run(['apply', str(plan_path), '--dry-run'] + common_args) == (7, renamed_count, renamed_count, statuses.count(main3.PLAN_STATUS_SKIP), statuses.count(main3.PLAN_STATUS_FAIL))
+
+
+def test_apply_failures(tmp_path, media_dir):
+    plan_path = tmp_path.joinpath('plan.jsonl')
+    common_args = ['--path', str(media_dir), '--no-cache', '--no-journal', '-q']
+    (files_count, processed_count, renamed_count, skipped_count, failed_count) = run(['plan', str(plan_path)] + common_args)
+    media_dir.joinpath('IMG_0001.JPG').write_bytes(make_jpeg('2019:06:01 12:34:59'))
+    ## counted as renamed by the plan, and as failed once changed since, just like a colliding file
+    assert run(['apply', str(plan_path)] + common_args) == (files_count, processed_count, renamed_count, skipped_count, failed_count + 1)
+
+
+@pytest.mark.parametrize('args', [['--template', '{date}{ext}'], ['--erase']], ids=['template', 'erase'])
+def test_plan_same_date_time(tmp_path, args):
+    ''' Two different files of the same date-time, not renamed until applying the plan, must not be planned the same new file name. '''
+    media_dir = tmp_path.joinpath('media')
+    media_dir.mkdir()
+    media_dir.joinpath('IMG_0001.JPG').write_bytes(make_jpeg('2019:06:01 12:34:56'))
+    media_dir.joinpath('IMG_0002.JPG').write_bytes(make_jpeg('2019:06:01 12:34:56') + b'\x00')
+    plan_path = tmp_path.joinpath('plan.jsonl')
+    common_args = ['--path', str(media_dir), '--no-cache', '--no-journal', '-q'] + args
+    plan_counts = run(['plan', str(plan_path)] + common_args)
+    entries = [json.loads(line) for line in plan_path.read_text(encoding='utf-8').splitlines()[1:]]
+    assert sorted(entry['status'] for entry in entries) == [main3.PLAN_STATUS_FAIL, main3.PLAN_STATUS_RENAME]
+    assert plan_counts == (2, 2, 2, 0, 1)
+
+    assert run(['apply', str(plan_path)] + common_args) == plan_counts
+    assert len(list(media_dir.glob('20190601_123456*'))) == 1
+
+
+@pytest.mark.parametrize('jobs', ['4', '16'])
+def test_parallel_as_serial(tmp_path, media_dir, capsys, jobs):
+    ''' Extraction by a thread pool yields just the same messages, plan and counters, in just the same order, as a sequential one. '''
+    import datetime
+    from media_builders import make_mov
+
+    sub_dir = media_dir.joinpath('sub')
+    sub_dir.mkdir()
+    date_time = datetime.datetime(2019, 6, 1, 12, 0, 0)
+    for index in range(40):
+        file_date_time = date_time + datetime.timedelta(seconds=index // 3)
+        if index % 4:
+            sub_dir.joinpath('IMG_%04d.JPG' % index).write_bytes(make_jpeg(file_date_time.strftime('%Y:%m:%d %H:%M:%S')) + b'\x00' * index)
+        else:
+            make_mov(sub_dir.joinpath('MOV_%04d.MP4' % index), 4 * main3.HEADER_SIZE, 'moov-first', file_date_time)
+
+    outputs = []
+    for jobs_arg in ('1', jobs):
+        plan_path = tmp_path.joinpath('plan-%s.jsonl' % jobs_arg)
+        counts = run(['plan', str(plan_path), '--path', str(media_dir), '--no-cache', '--jobs', jobs_arg, '-v'])
+        outputs.append((counts, capsys.readouterr().out, plan_path.read_text(encoding='utf-8').splitlines()[1:]))
+    assert outputs[0][0][0] == 47
+    assert outputs[1] == outputs[0]
@@ -0,0 +1,65 @@
+# -*- coding: utf8  -*-
+
+import io
+
+import pytest
+
+import main3
+from media_builders import make_jpeg
+
+
+class TerminalStream(io.StringIO):
+    def isatty(self):
+        return True
+
+
+def test_lines():
+    ''' Elsewhere than on a terminal, written as new lines, at most every interval unless forced. '''
+    stream = io.StringIO()
+    stats = main3.RunStats()
+    progress = main3.Progress(stats, stream, total=4)
+    progress.update(1)
+    assert stream.getvalue() == ''
+    progress.update(2, force=True)
+    stats.bytes_read += 1000
+    progress.close(4)
+    progress.close(4)
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 2
+    assert lines[0].startswith('Files: 2 of 4 (50.0%), ')
+    assert lines[1].startswith('Files: 4 of 4 (100.0%), ')
+    assert lines[1].endswith(', ETA: 0:00:00')
+
+
+def test_terminal(monkeypatch):
+    ''' On a terminal, rewritten in place, and cleared before any logged lines get written. '''
+    monkeypatch.setattr(main3, 'PROGRESS_INTERVAL', 0.0)
+    stream = TerminalStream()
+    progress = main3.Progress(main3.RunStats(), stream)
+    logger = main3.Logger(stream)
+    logger.progress = progress
+    progress.update_count(12)
+    progress.update(3)
+    width = progress.width
+    (_, count_line, line) = stream.getvalue().split('\r')
+    assert count_line == 'Counting files: 12 ... '
+    assert line.startswith('Files: 3, ') and len(line) == width
+    assert 'ETA' not in line
+
+    stream.seek(0)
+    stream.truncate()
+    logger.info('info', '  INFO: Message ... ')
+    logger.flush()
+    assert stream.getvalue() == '\r' + ' ' * width + '\r' + '  INFO: Message ... \n'
+    progress.close(3)
+    assert stream.getvalue().endswith('\n')
+
+
+@pytest.mark.parametrize('args', [['--progress'], ['--pre-count']])
+def test_command_line(tmp_path, capsys, args):
+    for index in range(3):
+        tmp_path.joinpath('IMG_%04d.JPG' % index).write_bytes(make_jpeg('2019:06:01 12:34:5%d' % index))
+    tmp_path.joinpath('notes.txt').write_text('notes')
+    assert main3.main(['main3.py', '--path', str(tmp_path), '--no-cache', '--dry-run', '-q'] + args) == 0
+    last_line = capsys.readouterr().err.splitlines()[-1]
+    assert last_line.startswith('Files: 4 of 4 (100.0%), ' if args == ['--pre-count'] else 'Files: 4, ')
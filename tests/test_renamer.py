@@ -0,0 +1,88 @@
+# -*- coding: utf8  -*-
+
+import time
+
+import pytest
+
+import main3
+from media_builders import make_jpeg
+
+
+def get_counts(stats):
+    return stats.files_count, stats.processed_count, stats.renamed_count, stats.skipped_count, stats.failed_count
+
+
+def make_media_dir(dir_path, count):
+    dir_path.mkdir()
+    for index in range(count):
+        dir_path.joinpath('IMG_%04d.JPG' % index).write_bytes(make_jpeg('2019:06:01 12:34:%02d' % index))
+    return dir_path
+
+
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_interleaved(tmp_path, jobs):
+    ''' Two renamers sharing the configuration, with their resolve() generators interleaved, each one counting its own files. '''
+    config = main3.build_config(jobs=jobs)
+    renamers = [main3.Renamer(config), main3.Renamer(config)]
+    assert renamers[0].config.context is not renamers[1].config.context
+    dir_paths = [make_media_dir(tmp_path.joinpath('a'), 3), make_media_dir(tmp_path.joinpath('b'), 5)]
+
+    generators = [renamer.resolve([dir_path]) for (renamer, dir_path) in zip(renamers, dir_paths)]
+    results = [[], []]
+    pending = [0, 1]
+    while pending:
+        for index in list(pending):
+            result = next(generators[index], None)
+            if result is None:
+                pending.remove(index)
+            else:
+                results[index].append(result)
+
+    for (renamer, dir_path, count, dir_results) in zip(renamers, dir_paths, (3, 5), results):
+        assert [result.path.parent for result in dir_results] == [dir_path] * count
+        assert get_counts(renamer.stats) == (count, count, count, 0, 0)
+        assert renamer.stats.latency_count == count
+        renamer.apply(dir_results)
+        assert sorted(path.name for path in dir_path.iterdir()) == sorted(result.new_path.name for result in dir_results)
+        renamer.close()
+    assert get_counts(config.context.stats) == (0, 0, 0, 0, 0)
+
+
+def test_apply_counts_failures_once(tmp_path):
+    dir_path = make_media_dir(tmp_path.joinpath('media'), 3)
+    with main3.Renamer(main3.build_config(jobs=1)) as renamer:
+        results = list(renamer.resolve([dir_path]))
+        assert get_counts(renamer.stats) == (3, 3, 3, 0, 0)
+        results[0].path.unlink()
+        results = renamer.apply(results)
+    assert sorted(result.status for result in results) == [main3.PLAN_STATUS_FAIL, main3.RESULT_STATUS_RENAMED, main3.RESULT_STATUS_RENAMED]
+    assert get_counts(renamer.stats) == (3, 3, 3, 0, 1)
+
+
+@pytest.mark.parametrize('template', ['{date}{ext}', '{date}{seq}{ext}'])
+@pytest.mark.parametrize('by_file', [False, True], ids=['directory', 'files'])
+def test_resolve_same_date_time(tmp_path, template, by_file):
+    ''' Files of the same date-time, resolved without being renamed, never get the same new file path. '''
+    dir_path = tmp_path.joinpath('media')
+    dir_path.mkdir()
+    for index in range(3):
+        dir_path.joinpath('IMG_%04d.JPG' % index).write_bytes(make_jpeg('2019:06:01 12:34:56') + b'\x00' * index)
+    paths = sorted(dir_path.iterdir()) if by_file else [dir_path]
+    with main3.Renamer(main3.build_config(jobs=1, template=template)) as renamer:
+        results = list(renamer.resolve(paths))
+        new_paths = [result.new_path for result in results if result.new_path is not None]
+        assert len(new_paths) == len(set(new_paths)) == (3 if '{seq}' in template else 1)
+        results = renamer.apply(results)
+    assert sorted(path.name for path in dir_path.iterdir()) == sorted(result.path.name if result.new_path is None else result.new_path.name for result in results)
+
+
+def test_latency_sample(monkeypatch):
+    monkeypatch.setattr(main3, 'STAT_LATENCY_SAMPLES', 10)
+    stats = main3.RunStats()
+    for _ in range(100):
+        stats.add_latency(time.perf_counter())
+    assert len(stats.latencies) == 10
+    report = stats.get_report()['latency']
+    assert report['count'] == 100
+    assert report['max'] >= max(stats.latencies)
+    assert set(report) == {'p50', 'p90', 'p99', 'count', 'max'}
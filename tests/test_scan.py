@@ -0,0 +1,62 @@
+# -*- coding: utf8  -*-
+
+import os
+import collections
+import shutil
+import tempfile
+
+import pytest
+
+import main3
+from media_builders import make_jpeg
+
+
+def scan(dir_path, **settings):
+    return list(main3.scan_directory(dir_path, 0, main3.build_config(**settings)))
+
+
+def get_kinds(media_files, dir_path):
+    return sorted((media_file.kind, media_file.path.relative_to(dir_path).as_posix()) for media_file in media_files)
+
+
+def test_symlink_loop(tmp_path):
+    ''' Directories linked in a loop (or twice) get entered just once, however deep the walk may go. '''
+    tmp_path.joinpath('a', 'b').mkdir(parents=True)
+    tmp_path.joinpath('a', 'b', 'IMG_0001.JPG').write_bytes(make_jpeg('2019:06:01 12:34:56'))
+    tmp_path.joinpath('a', 'b', 'loop').symlink_to(tmp_path.joinpath('a'), target_is_directory=True)
+    tmp_path.joinpath('b').symlink_to(tmp_path.joinpath('a', 'b'), target_is_directory=True)
+
+    ## which of the links to a directory gets entered depends on listing order; either way, each directory once
+    kinds = collections.Counter(kind for (kind, _) in get_kinds(scan(tmp_path, max_depth=100), tmp_path))
+    assert kinds == {'directory': 3, 'directory-end': 3, 'visited-directory': 2, 'file': 1}
+
+
+def test_deep_tree(tmp_path):
+    ''' Directories beyond maximum depth are not entered. '''
+    depth = 50
+    dir_path = tmp_path.joinpath(*['d'] * depth)
+    dir_path.mkdir(parents=True)
+    dir_path.joinpath('IMG_0001.JPG').write_bytes(make_jpeg('2019:06:01 12:34:56'))
+
+    media_files = scan(tmp_path, max_depth=depth)
+    assert [media_file.depth for media_file in media_files if media_file.kind == 'file'] == [depth]
+    media_files = scan(tmp_path, max_depth=depth - 1)
+    assert [media_file.kind for media_file in media_files if media_file.path == dir_path] == ['deep-directory']
+
+
+@pytest.mark.skipif(not os.path.isdir('/dev/shm'), reason='no other file system to link to')
+def test_mount_boundary(tmp_path):
+    ''' With option --one-file-system, directories on other file systems (here linked to) are not entered. '''
+    other_path = tempfile.mkdtemp(dir='/dev/shm')
+    try:
+        if os.stat(other_path).st_dev == os.stat(tmp_path).st_dev:
+            pytest.skip('/dev/shm is on the same file system')
+        with open(os.path.join(other_path, 'IMG_0001.JPG'), 'wb') as f:
+            f.write(make_jpeg('2019:06:01 12:34:56'))
+        tmp_path.joinpath('other').symlink_to(other_path, target_is_directory=True)
+
+        assert ('file', 'other/IMG_0001.JPG') in get_kinds(scan(tmp_path, max_depth=2), tmp_path)
+        assert get_kinds(scan(tmp_path, max_depth=2, one_file_system=True), tmp_path) == [
+            ('directory', '.'), ('directory-end', '.'), ('mount-directory', 'other')]
+    finally:
+        shutil.rmtree(other_path)
@@ -0,0 +1,87 @@
+# -*- coding: utf8  -*-
+
+import json
+import re
+
+import pytest
+
+import main3
+from media_builders import make_jpeg
+
+
+@pytest.mark.parametrize('template, message', [
+    ('{date', 'invalid template'),
+    ('}{name}', 'invalid template'),
+    ('{nope}', 'unknown field "{nope}"'),
+    ('{}', 'unknown field "{}"'),
+    ('{0}', 'unknown field "{0}"'),
+    ('{date.year}', 'unknown field "{date.year}"'),
+    ('{name[0]}', 'unknown field "{name[0]}"'),
+    ('{name!r}', 'unsupported conversion or nested field'),
+    ('{date:{seq}}', 'unsupported conversion or nested field'),
+    ('{seq:q}', 'invalid format of template'),
+    ('{subsec:d}', 'invalid format of template'),
+    ('', 'does not make file names relative'),
+    ('/photos/{name}', 'does not make file names relative'),
+    ('../{name}', 'does not make file names relative'),
+    ('{date:%Y}/../{name}', 'does not make file names relative'),
+    ('{date:%Y}/', 'does not make file names relative'),
+    ('.', 'does not make file names relative'),
+    ('{date:%Y}/.', 'does not make file names relative'),
+])
+def test_invalid(template, message):
+    with pytest.raises(ValueError, match=re.escape(message)):
+        main3.NameTemplate(template)
+
+
+@pytest.mark.parametrize('template, name, nested', [
+    ('{date}', '20190601_120000', False),
+    ('{date}_{name}', '20190601_120000_IMG_0001.JPG', False),
+    ('{date:%Y-%m-%d %H.%M.%S}{ext_lower}', '2019-06-01 12.00.00.jpg', False),
+    ('{date:%Y/%m}/{stem}_{seq:03d}{ext}', '2019/06/IMG_0001_002.JPG', True),
+    ('{type}/{date}{subsec}{seq}{ext}', 'image/20190601_120000.045-2.JPG', True),
+    ('{date}_{subsec:0<4}{ext}', '20190601_120000_0450.JPG', False),
+    ('{date:%Y_%j}_{name}', '2019_152_IMG_0001.JPG', False),
+    ('{{{date:%Y}}}{name}', '{2019}IMG_0001.JPG', False),
+])
+def test_format(template, name, nested):
+    name_template = main3.NameTemplate(template)
+    assert name_template.format('20190601_120000', 'IMG_0001.JPG', 'image', '045', 2) == name
+    assert name_template.nested is nested
+
+
+def test_build_config():
+    assert main3.build_config().name_template is None
+    assert main3.build_config(template='{date}_{name}').name_template.fields == {'date', 'name'}
+    with pytest.raises(ValueError, match='unknown field'):
+        main3.build_config(template='{nope}')
+    with pytest.raises(ValueError, match='option --erase cannot be used with option --template'):
+        main3.build_config(template='{date}', erase=True)
+
+
+def test_command_line(tmp_path):
+    with pytest.raises(SystemExit) as e:
+        main3.main(['main3.py', '--path', str(tmp_path), '--no-cache', '-q', '--template', '../{name}'])
+    assert e.value.code == 2
+
+
+def test_plan_seq(tmp_path):
+    ''' Files of the same date-time get planned consecutive sequence numbers, even though none of them gets renamed when planning. '''
+    media_dir = tmp_path.joinpath('media')
+    media_dir.mkdir()
+    for index in range(3):
+        media_dir.joinpath('IMG_%04d.JPG' % index).write_bytes(make_jpeg('2019:06:01 12:34:56') + b'\x00' * index)
+    ## identical to the first one
+    media_dir.joinpath('IMG_0003.JPG').write_bytes(make_jpeg('2019:06:01 12:34:56'))
+    plan_path = tmp_path.joinpath('plan.jsonl')
+    common_args = ['--path', str(media_dir), '--no-cache', '--no-journal', '-q', '--template', '{date}{seq}{ext}']
+    assert main3.main(['main3.py', 'plan', str(plan_path)] + common_args) == 0
+    entries = {entry['source']: entry for entry in map(json.loads, plan_path.read_text(encoding='utf-8').splitlines()[1:])}
+    targets = sorted(entry['target'] for entry in entries.values() if entry['target'] is not None)
+    assert targets == ['20190601_123456-2.JPG', '20190601_123456-3.JPG', '20190601_123456.JPG']
+    ## the identical one collides with the first one, rather than taking the next sequence number
+    identical = [source for (source, entry) in entries.items() if entry['status'] == main3.PLAN_STATUS_FAIL]
+    assert len(identical) == 1 and identical[0] in ('IMG_0000.JPG', 'IMG_0003.JPG')
+
+    assert main3.main(['main3.py', 'apply', str(plan_path)] + common_args) == 0
+    assert sorted(path.name for path in media_dir.iterdir()) == sorted(targets + identical)
@@ -0,0 +1,85 @@
+# -*- coding: utf8  -*-
+
+import collections
+
+import pytest
+
+import main3
+from media_builders import make_jpeg
+
+
+@pytest.fixture
+def watcher():
+    try:
+        watcher = main3.InotifyWatcher(max_depth=5, debounce=0.0)
+    except AttributeError:
+        pytest.skip('inotify is not available on this platform')
+    yield watcher
+    watcher.close()
+
+
+def test_initial_pass_lists_once(tmp_path, monkeypatch, watcher):
+    tmp_path.joinpath('a', 'b').mkdir(parents=True)
+    tmp_path.joinpath('IMG_0001.JPG').write_bytes(make_jpeg('2019:06:01 12:34:56'))
+    tmp_path.joinpath('a', 'b', 'IMG_0002.JPG').write_bytes(make_jpeg('2019:06:01 12:34:57'))
+
+    listed = collections.Counter()
+    list_directory = main3.list_directory
+    def counting_list_directory(dir_path, *args):
+        listed[dir_path] += 1
+        return list_directory(dir_path, *args)
+    monkeypatch.setattr(main3, 'list_directory', counting_list_directory)
+
+    main3.process_directory(tmp_path, 0, main3.build_config(max_depth=5, dry_run=True), watcher=watcher)
+    dir_paths = {tmp_path, tmp_path.joinpath('a'), tmp_path.joinpath('a', 'b')}
+    assert listed == {dir_path: 1 for dir_path in dir_paths}
+    assert {dir_path for (dir_path, _) in watcher.watches.values()} == dir_paths
+    assert watcher.pending == {}
+
+    ## watched already, by the time the directory got listed
+    tmp_path.joinpath('a', 'IMG_0003.JPG').write_bytes(make_jpeg('2019:06:01 12:34:58'))
+    assert watcher.wait() is True
+    assert watcher.pop_ready() == [(tmp_path.joinpath('a', 'IMG_0003.JPG'), 1)]
+
+
+def test_done_directories_watched(tmp_path, watcher):
+    ''' Directories completed by an interrupted run get watched without any of their files pending. '''
+    tmp_path.joinpath('a', 'b').mkdir(parents=True)
+    tmp_path.joinpath('a', 'IMG_0001.JPG').write_bytes(make_jpeg('2019:06:01 12:34:56'))
+    media_files = [main3.MediaFile(tmp_path, 0, 'directory'), main3.MediaFile(tmp_path.joinpath('a'), 0, 'done-directory')]
+    assert list(watcher.add_watches(iter(media_files), tmp_path)) == media_files
+    assert sorted((dir_path, dir_depth) for (dir_path, dir_depth) in watcher.watches.values()) == [(tmp_path, 0), (tmp_path.joinpath('a'), 1), (tmp_path.joinpath('a', 'b'), 2)]
+    assert watcher.pending == {}
+
+
+def test_watched_files_listed_lazily(tmp_path, monkeypatch):
+    ''' New files get stat'ed by their paths; their directory gets listed only once checking any of them for collisions. '''
+    tmp_path.joinpath('IMG_0001.JPG').write_bytes(make_jpeg('2019:06:01 12:34:56'))
+    tmp_path.joinpath('IMG_0002.JPG').write_bytes(make_jpeg('2019:06:01 12:34:57'))
+    tmp_path.joinpath('20190601_123458_IMG_0003.JPG').write_bytes(make_jpeg('2019:06:01 12:34:58'))
+    ## taken already, by a file not watched
+    tmp_path.joinpath('20190601_123457_IMG_0002.JPG').write_bytes(make_jpeg('2019:06:01 12:34:57') + b'\x00')
+
+    listed = collections.Counter()
+    scandir = main3.os.scandir
+    def counting_scandir(dir_path):
+        listed[dir_path] += 1
+        return scandir(dir_path)
+    monkeypatch.setattr(main3.os, 'scandir', counting_scandir)
+
+    config = main3.build_config(dry_run=True)
+    file_paths = [(tmp_path.joinpath(file_name), 0) for file_name in ('20190601_123458_IMG_0003.JPG', 'IMG_0001.JPG', 'IMG_0002.JPG', 'IMG_0004.JPG')]
+    media_files = list(main3.scan_watched_files(file_paths, config))
+    assert [media_file.path.name for media_file in media_files] == ['20190601_123458_IMG_0003.JPG', 'IMG_0001.JPG', 'IMG_0002.JPG']
+    assert [media_file.media_type for media_file in media_files] == ['image'] * 3
+    assert media_files[1].dir_entry.stat().st_size == tmp_path.joinpath('IMG_0001.JPG').stat().st_size
+    assert listed == {}
+
+    ## kept under its name, without listing the directory
+    assert [result.status for result in main3.Renamer(config).resolve([tmp_path.joinpath('20190601_123458_IMG_0003.JPG')])] == [main3.PLAN_STATUS_SKIP]
+    assert listed == {}
+
+    results = list(main3.Renamer(config).resolve([path for (path, _) in file_paths[1:3]]))
+    assert [(result.status, result.new_path.name if result.new_path else None) for result in results] == [
+        (main3.PLAN_STATUS_RENAME, '20190601_123456_IMG_0001.JPG'), (main3.PLAN_STATUS_FAIL, None)]
+    assert listed == {tmp_path: 1}